@@ -0,0 +1,295 @@
+import asyncio
+import zipfile
+import zlib
+from urllib.parse import urlsplit
+
+import aiohttp
+from psycopg_pool import AsyncConnectionPool
+
+import helpers
+import http_cache
+import metrics
+import statements
+
+
+def get_session(concurrency, per_host):
+    """
+    Creates an aiohttp session which keeps no more than `concurrency`
+      connections open, `per_host` of them to the same host; the
+      responses are decompressed by http_cache.decompress(), so the
+      bytes received are counted
+
+    Returns: aiohttp.ClientSession
+    """
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+
+    return aiohttp.ClientSession(
+        connector=connector, raise_for_status=False, auto_decompress=False
+    )
+
+
+def get_pool(conninfo, min_size=1, max_size=4):
+    """
+    Creates a not yet opened pool of autocommit async connections
+      checked before they are given out; open it with `async with`
+
+    Returns: psycopg_pool.AsyncConnectionPool
+    """
+
+    return AsyncConnectionPool(
+        conninfo,
+        min_size=min_size,
+        max_size=max(min_size, max_size),
+        kwargs={"autocommit": True},
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+    )
+
+
+@metrics.timed()
+async def wait_turn(url, hosts, delay):
+    """
+    Keeps the requests to the same host at least `delay` seconds apart
+
+    Parameters:
+    - url: str: the url about to be requested
+    - hosts: dict: host name -> its lock and the time of the last
+      request, shared between the tasks
+    - delay: float: seconds between the requests to the host
+    """
+
+    loop = asyncio.get_running_loop()
+    host = urlsplit(url).netloc
+    state = hosts.setdefault(host, {"lock": asyncio.Lock(), "last": 0.0})
+
+    async with state["lock"]:
+        wait = state["last"] + delay - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        state["last"] = loop.time()
+
+
+async def get_txt(session, url, hosts, delay, verbose=False, key=None):
+    """
+    Downloads a txt file from a url link with one request (with
+      http_cache.zipped, its .zip edition first); if the book is in
+      the http cache, the request is conditional and 304 Not Modified
+      is answered from the cache
+
+    Returns: list of str: the lines of the text or None
+      if the url is not okay
+    """
+
+    entry = None
+    if http_cache.directory is not None and key is not None:
+        entry = http_cache.get_entry(http_cache.directory, key)
+
+    zip_url = http_cache.get_zip_url(url) if http_cache.zipped else None
+    links = [(zip_url, True)] if zip_url else []
+    try:
+        for link, archive in links + [(url, False)]:
+            await wait_turn(link, hosts, delay)
+            headers = http_cache.get_headers(entry, link)
+            with metrics.timer("download"):
+                content, charset = await request_txt(
+                    session, link, headers, entry, key, archive
+                )
+            if content is not None:
+                break
+
+    except (aiohttp.ClientError, zipfile.BadZipFile, zlib.error, ValueError) as e:
+        metrics.count("http_errors")
+        print("Error:", e)
+        return None
+
+    if content is None:
+        return None
+
+    if verbose:
+        print(f"Got {len(content)} bytes from {url}")
+
+    helpers.hash_book(content, key)
+    encoding = helpers.detect_encoding(content, charset, final=True)
+
+    return list(helpers.iter_lines([content], encoding))
+
+
+async def request_txt(session, url, headers, entry, key=None, archive=False):
+    """
+    Sends the request (conditional if the book is cached) and reads
+      the content or takes it from the cache on 304 Not Modified;
+      see http_cache.fetch_url()
+
+    Returns: tuple: the bytes and the charset the server declared
+      (None if it declared none) or (None, None) if the url is not okay
+    """
+
+    async with session.get(url, allow_redirects=True, headers=headers) as r:
+        if r.status == 304 and entry:
+            metrics.count("http_not_modified")
+            path = http_cache.get_object_path(http_cache.directory, entry["sha256"])
+            return path.read_bytes(), entry.get("charset")
+
+        if archive and r.status == 404:
+            # a missing .zip edition is not an error, the .txt one is asked for
+            return None, None
+
+        if r.status != 200:
+            metrics.count("http_errors")
+            if r.status == 404 and key is not None:
+                http_cache.not_found.add(key)
+            print(f"Error {r.status}: {url}")
+            return None, None
+
+        content = await r.read()
+        metrics.count("bytes_wire", len(content))
+        chunks = http_cache.decompress([content], r.headers.get("Content-Encoding"))
+        if archive:
+            chunks = http_cache.unzip(chunks)
+        content = b"".join(chunks)
+        metrics.count("bytes_downloaded", len(content))
+        http_cache.store(content, key, url, r.headers, r.charset)
+
+        return content, r.charset
+
+
+@metrics.timed()
+async def row_exists(relation, attributes_list, values_list, cursor):
+    """
+    Checks whether the value is already in the relation,
+      see helpers.row_exists()
+    Returns: bool: True if the value exists
+    """
+
+    query = statements.get("exists", relation, attributes_list)
+    await cursor.execute(query, values_list, prepare=True)
+
+    return (await cursor.fetchone())[0]
+
+
+@metrics.timed()
+async def upsert_name(relation, attribute, value, cursor):
+    """
+    Inserts the value into the unique attribute of the relation
+      or finds the existing one, safe for the concurrent tasks
+
+    Returns: int: id of the row
+    """
+
+    query = helpers.upsert_query(relation, attribute)
+    await cursor.execute(query, [value], prepare=True)
+
+    return (await cursor.fetchone())[0]
+
+
+@metrics.timed()
+async def insert_into_table(relation, attributes, values, cursor):
+    """
+    Inserts data into attributes of the relation and returns
+      the primary key, i.e. id.
+
+    Returns: int: id of the row or 0 on conflict
+    """
+
+    query = helpers.insert_query(relation, attributes)
+    await cursor.execute(query, values, prepare=True)
+    result = await cursor.fetchone()
+    if result:
+        return result[0]
+
+    return 0
+
+
+@metrics.timed()
+async def claim_book(book_relation, ebook_id, cursor, staged=False):
+    """
+    Takes the book whose general info is loaded from the catalog,
+      see helpers.claim_book()
+
+    Returns: int: the book's id or 0 if the book is not pending
+    """
+
+    await cursor.execute(helpers.claim_query(book_relation), [staged, ebook_id])
+    row = await cursor.fetchone()
+
+    return row[0] if row else 0
+
+
+@metrics.timed()
+async def get_partition(relation, partitions, key, cursor):
+    """
+    Finds the partition of the relation the key's rows are in,
+      see helpers.get_partition()
+
+    Returns: str: name of the partition
+    """
+
+    await cursor.execute(helpers.partition_query(relation, partitions), [key])
+
+    return helpers.PARTITION.format(relation, (await cursor.fetchone())[0])
+
+
+@metrics.timed()
+async def save_content_hash(book_relation, book_id, key, cursor):
+    """
+    Saves the digest and the size of the bytes the book was loaded
+      from with the book, see helpers.save_content_hash()
+
+    Returns: int: 1 if the book's digest is known and saved
+    """
+
+    content = helpers.content_hashes.pop(key, None)
+    if content is None:
+        return 0
+
+    attributes = ["content_hash", "content_size"]
+    query = statements.get("update", book_relation, attributes)
+    await cursor.execute(query, [*content, book_id], prepare=True)
+
+    return cursor.rowcount
+
+
+@metrics.timed()
+async def store_paragraphs(relation, paragraphs, cursor, hash_size=16):
+    """
+    Keeps the book's paragraphs in the content-addressed store,
+      see helpers.store_paragraphs()
+
+    Returns: list of bytes: the paragraphs' hashes in their order
+    """
+
+    hashes, unique, sizes = helpers.hash_paragraphs(paragraphs, hash_size)
+
+    await cursor.execute(helpers.known_query(relation), [list(unique)])
+    for row in await cursor.fetchall():
+        unique.pop(row[0], None)
+
+    stored = list()
+    if unique:
+        keys = sorted(unique)
+        await cursor.execute(
+            helpers.store_query(relation), [keys, [unique[key] for key in keys]]
+        )
+        stored = [row[0] for row in await cursor.fetchall()]
+    helpers.count_stored(hashes, sizes, stored)
+
+    return hashes
+
+
+@metrics.timed()
+async def copy_into_table(relation, attributes, rows, cursor):
+    """
+    Streams rows into attributes of the relation with one
+      COPY ... FROM STDIN command
+
+    Returns: int: number of rows copied
+    """
+
+    count = 0
+    async with cursor.copy(helpers.copy_query(relation, attributes)) as copy:
+        for row in rows:
+            await copy.write_row(row)
+            count += 1
+
+    return count
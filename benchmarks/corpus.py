@@ -0,0 +1,218 @@
+"""
+Makes a synthetic corpus of books in the Gutenberg's txt format:
+
+  `python benchmarks/corpus.py DIR [--books N] [--paragraphs N]
+    [--paragraph-lines MIN,MAX] [--variants modern,legacy,...] [--seed N]
+    [--compressed]`
+
+  The books are written as DIR/cache/epub/{0}/pg{0}.txt, the layout of
+  gutenberg.org, so DIR may be served by benchmarks/server.py or read
+  as a mirror with `--mirror DIR`. `--compressed` writes every book
+  gzipped (pg{0}.txt.gz, served with `Content-Encoding: gzip`) and as
+  its .zip edition (pg{0}.zip) too.
+"""
+
+import gzip
+import random
+import sys
+import zipfile
+from pathlib import Path
+
+WORDS = (
+    "the of and to a in that was he it his for as with be on at by "
+    "they from this are had not but all were she which her there whale "
+    "sea ship captain morning letter garden house river naïve café"
+).split()
+NAMES = "Herman Jane Leo Mary Charles Anna Fyodor Virginia Honoré Emily".split()
+SURNAMES = "Melville Austen Tolstoy Shelley Dickens Brontë Balzac Woolf".split()
+LANGUAGES = ["English", "English", "English", "French", "German", "Russian"]
+MONTHS = "January February March April May June July August September".split()
+
+# the technical info part of the file, every variant is met on gutenberg.org
+HEADERS = {
+    "modern": (
+        "The Project Gutenberg eBook of {title}\n\n"
+        "This ebook is for the use of anyone anywhere in the United States and\n"
+        "most other parts of the world at no cost and with almost no restrictions\n"
+        "whatsoever.\n\n"
+        "Title: {title}\n\n"
+        "Author: {author}\n\n"
+        "Release date: {month} {day}, {release} [eBook #{id}]\n"
+        "                Most recently updated: {month} {day}, 2024\n\n"
+        "Language: {language}\n\n"
+        "Credits: Synthetic Books\n\n\n"
+        "*** START OF THE PROJECT GUTENBERG EBOOK {upper} ***\n\n\n"
+    ),
+    "legacy": (
+        "Project Gutenberg's {title}, by {author}\n\n"
+        "This eBook is for the use of anyone anywhere at no cost and with\n"
+        "almost no restrictions whatsoever.\n\n"
+        "Title: {title}\n\n"
+        "Author: {author}\n\n"
+        "Release Date: {month} {day}, {release} [EBook #{id}]\n\n"
+        "Language: {language}\n\n"
+        "Character set encoding: UTF-8\n\n"
+        "*** START OF THIS PROJECT GUTENBERG EBOOK {upper} ***\n\n\n"
+    ),
+    "translator": (
+        "The Project Gutenberg eBook of {title}\n\n"
+        "Title: {title}\n\n"
+        "Translator: {author}\n\n"
+        "Release date: {month} {day}, {release} [eBook #{id}]\n\n"
+        "Language: {language}\n\n"
+        "*** START OF THE PROJECT GUTENBERG EBOOK {upper} ***\n\n\n"
+    ),
+    # no technical info and no markers at all
+    "bare": "{title}\n\nby {author}\n\n\n",
+}
+FOOTER = "\n\n*** END OF THE PROJECT GUTENBERG EBOOK {upper} ***\n\n"
+# number of the license's lines below the end of a book
+LICENSE_LINES = 350
+
+
+def make_line(rng, length):
+    """
+    Returns: str: random words up to `length` characters
+    """
+
+    words = list()
+    size = 0
+    for word in rng.choices(WORDS, k=length // 3):
+        size += len(word) + 1
+        if size > length:
+            break
+        words.append(word)
+
+    return " ".join(words)
+
+
+def make_book(
+    ebook_id,
+    paragraphs=1000,
+    paragraph_lines=(1, 8),
+    line_length=70,
+    variant="modern",
+    seed=None,
+):
+    """
+    Makes a book in the Gutenberg's txt format: the technical info,
+      the published year, the paragraphs, the end marker and the license
+
+    Parameters:
+    - ebook_id: int: the book's number
+    - paragraphs: int: number of the paragraphs
+    - paragraph_lines: tuple of int: the least and the most number
+      of lines in a paragraph
+    - line_length: int: the most number of characters in a line
+    - variant: str: the technical info's layout, a key of HEADERS
+    - seed: int: the books with the same seed are the same,
+      by default the ebook_id
+
+    Returns: str: the book's text with "\\r\\n" line endings
+    """
+
+    rng = random.Random(ebook_id if seed is None else seed)
+    title = " ".join(rng.choices(WORDS, k=rng.randint(1, 5))).title()
+    info = {
+        "id": ebook_id,
+        "title": title,
+        "upper": title.upper(),
+        "author": f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}",
+        "language": rng.choice(LANGUAGES),
+        "month": rng.choice(MONTHS),
+        "day": rng.randint(1, 28),
+        "release": rng.randint(1994, 2024),
+    }
+
+    parts = [HEADERS[variant].format(**info)]
+    parts.append(f"{title}\n\nPublished {rng.randint(1600, 1950)}\n\n")
+    for i in range(paragraphs):
+        lines = rng.randint(*paragraph_lines)
+        parts.append(
+            "\n".join(make_line(rng, line_length) for j in range(lines)) + "\n\n"
+        )
+
+    if variant != "bare":
+        parts.append(FOOTER.format(**info))
+        parts.extend(make_line(rng, line_length) + "\n" for i in range(LICENSE_LINES))
+
+    return "".join(parts).replace("\n", "\r\n")
+
+
+def write_corpus(
+    directory,
+    books=100,
+    paragraphs=1000,
+    paragraph_lines=(1, 8),
+    variants=tuple(HEADERS),
+    seed=0,
+    first_id=1,
+    compressed=False,
+):
+    """
+    Writes the books as directory/cache/epub/{0}/pg{0}.txt, the books'
+      variants follow one another; with `compressed` as pg{0}.txt.gz
+      and pg{0}.zip too
+
+    Returns: list of int: the books' numbers
+    """
+
+    ids = list(range(first_id, first_id + books))
+    for ebook_id in ids:
+        path = Path(directory, "cache", "epub", str(ebook_id), f"pg{ebook_id}.txt")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        text = make_book(
+            ebook_id,
+            paragraphs,
+            paragraph_lines,
+            variant=variants[ebook_id % len(variants)],
+            seed=seed * 1_000_003 + ebook_id,
+        )
+        path.write_bytes(text.encode("utf-8"))
+        if compressed:
+            Path(f"{path}.gz").write_bytes(gzip.compress(path.read_bytes()))
+            with zipfile.ZipFile(path.with_suffix(".zip"), "w") as archive:
+                archive.write(path, path.name, zipfile.ZIP_DEFLATED)
+
+    return ids
+
+
+def main():
+    args = sys.argv[1:]
+    options = {
+        "--books": "100",
+        "--paragraphs": "1000",
+        "--paragraph-lines": "1,8",
+        "--variants": ",".join(HEADERS),
+        "--seed": "0",
+    }
+    for option in options:
+        if option in args:
+            index = args.index(option)
+            options[option] = args[index + 1]
+            del args[index : index + 2]
+
+    compressed = "--compressed" in args
+    if compressed:
+        args.remove("--compressed")
+    if len(args) != 1:
+        print(__doc__)
+        return 1
+
+    least, most = map(int, options["--paragraph-lines"].split(","))
+    ids = write_corpus(
+        args[0],
+        int(options["--books"]),
+        int(options["--paragraphs"]),
+        (least, most),
+        options["--variants"].split(","),
+        int(options["--seed"]),
+        compressed=compressed,
+    )
+    print(f"{len(ids)} books written to {args[0]}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
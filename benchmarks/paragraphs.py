@@ -0,0 +1,115 @@
+"""
+Compares the paragraph engine (helpers.get_paragraphs) reading lines
+  and the whole text with the loop text_to_database() used before it
+  on the books given, every book's text repeated to make it large:
+
+  `python benchmarks/paragraphs.py pg1.txt pg2.txt --repeat 20`
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers
+
+
+def legacy_paragraphs(lines, counts):
+    """
+    The paragraph loop as it was in text_to_database(): every line
+      is added to the paragraph by itself, the license included
+    """
+
+    paragraph = ""
+
+    for line in lines:
+        counts["lines"] += 1
+        line = line.strip()
+        counts["chars"] += len(line)
+
+        if line == "" and paragraph == "":
+            continue
+
+        elif line == "":
+            counts["paragraphs"] += 1
+            yield paragraph
+            paragraph = ""
+            continue
+
+        paragraph += " " + line
+
+
+def read_book(path, repeat=1):
+    """
+    Reads the book's lines; the text between the markers is repeated
+      `repeat` times
+
+    Returns: list of str: the lines
+    """
+
+    lines = list(helpers.iter_lines([Path(path).read_bytes()]))
+    starts = [i for i, line in enumerate(lines) if helpers.START_PATTERN.match(line)]
+    ends = [i for i, line in enumerate(lines) if helpers.END_PATTERN.match(line)]
+    if not starts or not ends:
+        return lines * repeat
+
+    start, end = starts[0] + 1, ends[0]
+
+    return lines[:start] + lines[start:end] * repeat + lines[end:]
+
+
+def measure(splitter, lines, rounds=5):
+    """
+    Runs the splitter over the lines (or the text) `rounds` times
+
+    Returns: tuple: the best time in seconds and the counts
+    """
+
+    best = None
+    for i in range(rounds):
+        counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+        start = time.perf_counter()
+        for paragraph in splitter(lines, counts):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, counts
+
+
+def main():
+    args = sys.argv[1:]
+    repeat = 1
+    if "--repeat" in args:
+        index = args.index("--repeat")
+        repeat = int(args[index + 1])
+        del args[index : index + 2]
+
+    if not args:
+        print("Usage: `python benchmarks/paragraphs.py book.txt [...] [--repeat N]`")
+        return 1
+
+    for path in args:
+        lines = read_book(path, repeat)
+        text = "".join(lines)
+        megabytes = len(text) / 2**20
+        print(f"{path}: {len(lines)} lines, {megabytes:.1f} MB")
+
+        for name, splitter, source in (
+            ("legacy loop", legacy_paragraphs, lines),
+            ("engine lines", helpers.get_paragraphs, lines),
+            ("engine text", helpers.get_paragraphs, text),
+        ):
+            elapsed, counts = measure(splitter, source)
+            print(
+                f"  {name:12} {elapsed:.3f} sec, {megabytes / elapsed:.1f} MB/sec: "
+                f"{counts['paragraphs']} paragraphs, {counts['lines']} lines, "
+                f"{counts['chars']} characters"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Times every stage of loading a synthetic corpus (see corpus.py) served
+  by a local http server (see server.py) into a local Postgres:
+  fetch, decode, header parse, paragraph split and database load.
+
+  `python benchmarks/run.py [--books N] [--paragraphs N] [--no-db]
+    [--layouts paragraph,chunk,dedup] [--staging] [--partitions N]
+    [--transfer plain|gzip|zip] [--output FILE] [--compare FILE]`
+
+  The database is the one of info.py, the relations are created in its
+  "benchmark" schema which is dropped first ("benchmark_chunk" etc. for
+  the other layouts of schemata.layouts). The same parsed corpus is
+  loaded in every layout, the load time, the database size and the time
+  to read a random paragraph are reported by layout (and the share of
+  the paragraphs stored once for the dedup layout); with --staging
+  every layout is loaded through its staging relation too ("paragraph
+  staging" etc., the merge including); --partitions splits the
+  paragraphs' relation into N hash partitions by book. At the end some
+  books are deleted one by one and the time of a delete is reported.
+  --transfer chooses how the books are sent: plain, gzipped (the default)
+  or as .zip editions; the bytes on the wire are reported. The results
+  are saved as JSON (benchmarks/results/<time>.json by default); --compare
+  prints the change of every stage against the results of an earlier run.
+"""
+
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import psycopg
+
+import corpus
+import helpers
+import http_cache
+import lookup
+import main as app
+import metrics
+import schemata
+import server
+
+STAGES = ["fetch", "decode", "header", "split", "load"]
+# how the server sends the books, see --transfer
+TRANSFERS = ["plain", "gzip", "zip"]
+# the relations of the benchmark are kept apart from the loaded books
+SCHEMA = "benchmark"
+# number of the random paragraphs read back from every layout
+READS = 1000
+# number of the books deleted from every layout at the end
+DELETES = 5
+
+
+def prepare_schema(conninfo, relations, schema=SCHEMA):
+    """
+    Drops and creates the benchmark schema with the relations
+
+    Returns: str: the connection string using the schema
+    """
+
+    with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+
+    conninfo += f" options='-c search_path={schema}'"
+    with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as cur:
+        helpers.create_tables(relations, conn, cur)
+
+    return conninfo
+
+
+def load_layout(layout, parsed_books, paragraph_counts, staging=False, partitions=0):
+    """
+    Loads the parsed books into the relations of the layout in its own
+      schema, measures the relations' size and reads random paragraphs
+
+    Parameters:
+    - layout: str: a key of schemata.layouts
+    - parsed_books: list of tuples: the book's link, number and
+      helpers.parse_content() result
+    - paragraph_counts: dict: the book's number -> its paragraphs
+    - staging: bool: load the paragraphs into the staging relation
+      and merge them at the end, default False
+    - partitions: int: number of the hash partitions of the paragraphs'
+      relation, 0 for none
+
+    Returns: dict: "seconds" of the load, "loaded" books, "text_mb"
+      (the paragraphs' relation and the layout's stores with their
+      indexes and TOAST), "total_mb" (all the relations), "read_ms"
+      per paragraph, "delete_ms" per book and for the dedup layout
+      "dedup_ratio", the share of the paragraphs not stored again
+    """
+
+    relations = schemata.get_relations(layout, partitions)
+    stores = schemata.get_stores(layout)
+    text_rel = list(relations)[4]
+    name = f"{layout}_staging" if staging else layout
+    schema = SCHEMA if name == "paragraph" else f"{SCHEMA}_{name}"
+    conninfo = prepare_schema(app.get_conninfo(), stores | relations, schema)
+    load_relations = relations
+    if staging:
+        load_relations = schemata.get_staging(relations)
+        with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as cur:
+            staging_rel = list(load_relations)[4]
+            staging_relations = {staging_rel: load_relations[staging_rel]}
+            helpers.create_tables(staging_relations, conn, cur, unlogged=True)
+    # the ids of the names and the books are the schema's own
+    lookup.clear()
+    lookup.loaded_ids.clear()
+
+    loaded = 0
+    mapped = metrics.counters.get("paragraphs_mapped", 0)
+    stored = metrics.counters.get("paragraphs_stored", 0)
+    with helpers.get_pool(conninfo, 1, 1) as pool:
+        start = time.perf_counter()
+        for link, ebook_id, parsed in parsed_books:
+            # the loading functions print every book
+            with contextlib.redirect_stdout(io.StringIO()):
+                loaded += not app.parsed_to_database(
+                    link, parsed, load_relations, pool, False, True, ebook_id
+                )
+        if staging:
+            with pool.connection() as conn, conn.cursor() as cur:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    app.merge_staging(relations, conn, cur)
+        seconds = time.perf_counter() - start
+    mapped = metrics.counters.get("paragraphs_mapped", 0) - mapped
+    stored = metrics.counters.get("paragraphs_stored", 0) - stored
+
+    # VACUUM runs outside of a transaction only
+    with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as cur:
+        for relation in stores | relations:
+            cur.execute(f"VACUUM ANALYZE {relation}")
+        cur.execute(
+            "SELECT COALESCE((SELECT sum(pg_total_relation_size(relid))"
+            " FROM pg_partition_tree(%s::regclass)), pg_total_relation_size(%s)),"
+            " sum(pg_total_relation_size(oid)) FROM pg_class"
+            " WHERE relnamespace = %s::regnamespace AND relkind = 'r'",
+            [f"{schema}.{text_rel}"] * 2 + [schema],
+        )
+        text_size, total_size = cur.fetchone()
+        for store in stores:
+            cur.execute("SELECT pg_total_relation_size(%s)", [f"{schema}.{store}"])
+            text_size += cur.fetchone()[0]
+
+        cur.execute("SELECT id, ebook_id FROM book")
+        books = [
+            (book_id, paragraph_counts[ebook_id])
+            for book_id, ebook_id in cur.fetchall()
+            if paragraph_counts.get(ebook_id)
+        ]
+        rng = random.Random(0)
+        chunk_size = schemata.CHUNK_SIZE if schemata.is_chunked(text_rel) else None
+        store = schemata.STORE if schemata.is_deduplicated(text_rel) else None
+        start = time.perf_counter()
+        for i in range(READS if books else 0):
+            book_id, count = rng.choice(books)
+            helpers.read_paragraph(
+                text_rel, book_id, rng.randrange(count), cur, chunk_size, store
+            )
+        read_time = time.perf_counter() - start
+
+        ebook_ids = rng.sample(sorted(paragraph_counts), min(DELETES, len(books)))
+        start = time.perf_counter()
+        for ebook_id in ebook_ids:
+            helpers.delete_book("book", text_rel, ebook_id, cur, partitions)
+        delete_time = time.perf_counter() - start
+
+    results = {
+        "seconds": round(seconds, 4),
+        "loaded": loaded,
+        "text_mb": round(float(text_size) / 2**20, 3),
+        "total_mb": round(float(total_size) / 2**20, 3),
+        "read_ms": round(read_time / READS * 1000, 4),
+        "delete_ms": round(delete_time / max(len(ebook_ids), 1) * 1000, 4),
+    }
+    if mapped:
+        results["dedup_ratio"] = round((mapped - stored) / mapped, 4)
+
+    return results
+
+
+def run(
+    books=50,
+    paragraphs=1000,
+    database=True,
+    layouts=("paragraph",),
+    staging=False,
+    partitions=0,
+    transfer="gzip",
+):
+    """
+    Makes the corpus, serves it and parses it book by book timing
+      every stage apart, then loads it in every layout
+
+    Parameters:
+    - books: int: number of the books
+    - paragraphs: int: number of the paragraphs in a book
+    - database: bool: time the database load too, default True
+    - layouts: list of str: keys of schemata.layouts, the load of the
+      first one is the "load" stage
+    - staging: bool: load every layout through its staging relation
+      too, default False
+    - partitions: int: number of the hash partitions of the paragraphs'
+      relation, 0 for none
+    - transfer: str: one of TRANSFERS, default gzip
+
+    Returns: dict: the settings, the totals, the stages' timings
+      and the layouts' results, see load_layout()
+    """
+
+    seconds = dict.fromkeys(STAGES, 0.0)
+    size, paragraph_count, loaded = 0, 0, 0
+    parsed_books, paragraph_counts, layout_results = list(), dict(), dict()
+
+    with tempfile.TemporaryDirectory() as directory:
+        compressed = transfer != "plain"
+        ids = corpus.write_corpus(directory, books, paragraphs, compressed=compressed)
+        http, url = server.start_server(directory, compress=compressed)
+        http_cache.zipped = transfer == "zip"
+        wire = metrics.counters.get("bytes_wire", 0)
+
+        try:
+            for ebook_id in ids:
+                start = time.perf_counter()
+                content, encoding = helpers.get_content(url.format(ebook_id))
+                seconds["fetch"] += time.perf_counter() - start
+                size += len(content)
+
+                start = time.perf_counter()
+                text = helpers.decode(content, encoding)
+                seconds["decode"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                head_lines = iter(helpers.read_head(io.StringIO(text)))
+                header = helpers.get_header(head_lines)
+                year = helpers.get_year(head_lines)
+                seconds["header"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+                book_paragraphs = list(helpers.get_paragraphs(text, counts))
+                seconds["split"] += time.perf_counter() - start
+                paragraph_count += counts["paragraphs"]
+
+                if database:
+                    parsed = header, year, book_paragraphs, counts
+                    parsed_books.append((url.format(ebook_id), ebook_id, parsed))
+                    paragraph_counts[ebook_id] = counts["paragraphs"]
+
+            wire = metrics.counters.get("bytes_wire", 0) - wire
+        finally:
+            http.shutdown()
+            http_cache.zipped = False
+
+    if database:
+        for layout in layouts:
+            layout_results[layout] = load_layout(
+                layout, parsed_books, paragraph_counts, False, partitions
+            )
+            if staging:
+                layout_results[f"{layout} staging"] = load_layout(
+                    layout, parsed_books, paragraph_counts, True, partitions
+                )
+        seconds["load"] = layout_results[layouts[0]]["seconds"]
+        loaded = layout_results[layouts[0]]["loaded"]
+
+    megabytes = size / 2**20
+    results = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {
+            "books": books,
+            "paragraphs": paragraphs,
+            "layouts": list(layouts) if database else [],
+            "staging": staging,
+            "partitions": partitions,
+            "transfer": transfer,
+        },
+        "totals": {
+            "books": len(ids),
+            "loaded": loaded,
+            "paragraphs": paragraph_count,
+            "megabytes": round(megabytes, 3),
+            "wire_megabytes": round(wire / 2**20, 3),
+        },
+        "stages": dict(),
+        "layouts": layout_results,
+    }
+    for stage in STAGES:
+        if stage == "load" and not database:
+            continue
+        elapsed = seconds[stage] or 1e-9
+        results["stages"][stage] = {
+            "seconds": round(seconds[stage], 4),
+            "books_per_sec": round(len(ids) / elapsed, 1),
+            "paragraphs_per_sec": round(paragraph_count / elapsed, 1),
+            "mb_per_sec": round(megabytes / elapsed, 2),
+            "ms_per_mb": round(elapsed * 1000 / (megabytes or 1e-9), 3),
+        }
+
+    return results
+
+
+def print_results(results, previous=None):
+    """
+    Prints the stages' timings and their change against
+      the previous results
+    """
+
+    totals = results["totals"]
+    print(
+        f"{totals['books']} books, {totals['paragraphs']} paragraphs, "
+        f"{totals['megabytes']} MB, "
+        f"{totals.get('wire_megabytes', 0)} MB on the wire "
+        f"({results['settings'].get('transfer', 'plain')})"
+    )
+    for stage, timing in results["stages"].items():
+        line = (
+            f"  {stage:7} {timing['seconds']:8.3f} sec "
+            f"{timing['books_per_sec']:10.1f} books/sec "
+            f"{timing['paragraphs_per_sec']:12.1f} paragraphs/sec "
+            f"{timing['mb_per_sec']:8.2f} MB/sec "
+            f"{timing.get('ms_per_mb', 0):9.3f} ms/MB"
+        )
+        if previous and stage in previous["stages"]:
+            before = previous["stages"][stage]["mb_per_sec"]
+            if before:
+                change = (timing["mb_per_sec"] - before) / before * 100
+                line += f"  {change:+.1f}%"
+        print(line)
+
+    for layout, timing in results.get("layouts", dict()).items():
+        print(
+            f"  {layout:17} load {timing['seconds']:8.3f} sec, "
+            f"text {timing['text_mb']:8.2f} MB, all {timing['total_mb']:8.2f} MB, "
+            f"read {timing['read_ms']:7.3f} ms a paragraph, "
+            f"delete {timing['delete_ms']:7.2f} ms a book"
+            + (
+                f", {timing['dedup_ratio']:.1%} deduplicated"
+                if "dedup_ratio" in timing
+                else ""
+            )
+        )
+
+
+def main():
+    args = sys.argv[1:]
+    options = {"--books": "50", "--paragraphs": "1000", "--output": None}
+    options["--compare"] = None
+    options["--layouts"] = "paragraph"
+    options["--partitions"] = "0"
+    options["--transfer"] = "gzip"
+    for option in options:
+        if option in args:
+            index = args.index(option)
+            options[option] = args[index + 1]
+            del args[index : index + 2]
+    staging = "--staging" in args
+    if staging:
+        args.remove("--staging")
+    database = True
+    if "--no-db" in args:
+        database = False
+        args.remove("--no-db")
+    if args:
+        print(__doc__)
+        return 1
+
+    previous = None
+    if options["--compare"]:
+        previous = json.loads(Path(options["--compare"]).read_text())
+
+    layouts = options["--layouts"].split(",")
+    for layout in layouts:
+        if layout not in schemata.layouts:
+            print(f"Unknown layout {layout}, one of {', '.join(schemata.layouts)}")
+            return 1
+    if options["--transfer"] not in TRANSFERS:
+        print(f"--transfer is one of {', '.join(TRANSFERS)}")
+        return 1
+
+    results = run(
+        int(options["--books"]),
+        int(options["--paragraphs"]),
+        database,
+        layouts,
+        staging,
+        int(options["--partitions"]),
+        options["--transfer"],
+    )
+    print_results(results, previous)
+
+    output = options["--output"]
+    if output is None:
+        name = results["date"].replace(":", "-") + ".json"
+        output = Path(__file__).resolve().parent / "results" / name
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    Path(output).write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
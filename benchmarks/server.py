@@ -0,0 +1,121 @@
+"""
+Serves a directory over http in place of gutenberg.org, e.g. the corpus
+  made by benchmarks/corpus.py:
+
+  `python benchmarks/server.py DIR [--port 8000] [--no-gzip]`
+
+  and `python main.py 50 --url http://127.0.0.1:8000/cache/epub/{0}/pg{0}.txt`
+
+  A .txt file is sent with `Content-Encoding: gzip` to the clients
+  accepting it (its .txt.gz file if there is one, see benchmarks/corpus.py
+  `--compressed`), the .zip editions are served as they are.
+"""
+
+import email.utils
+import functools
+import gzip
+import io
+import os
+import sys
+import threading
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # send the .txt files gzipped to the clients accepting it
+    gzip = True
+
+    # the server answers If-Modified-Since with 304 Not Modified
+    # by itself; the requests are not logged to keep the timings clean
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        accepted = "gzip" in self.headers.get("Accept-Encoding", "")
+        if not (self.gzip and accepted and path.endswith(".txt")):
+            return super().send_head()
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        modified = int(os.stat(path).st_mtime)
+        since = self.headers.get("If-Modified-Since")
+        if since and "If-None-Match" not in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and modified <= since:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.end_headers()
+                return None
+
+        compressed = Path(f"{path}.gz")
+        if compressed.is_file():
+            body = compressed.read_bytes()
+        else:
+            body = gzip.compress(Path(path).read_bytes())
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", self.date_time_string(modified))
+        self.end_headers()
+
+        return io.BytesIO(body)
+
+
+def start_server(directory, port=0, compress=True):
+    """
+    Starts serving the directory in a background thread
+
+    Parameters:
+    - directory: str or Path: the served directory
+    - port: int: the port, 0 for any free one
+    - compress: bool: send the .txt files gzipped to the clients
+      accepting it, default True
+
+    Returns: tuple: the server (call shutdown() to stop it)
+      and the url template of the books
+    """
+
+    handler_class = type("Handler", (QuietHandler,), {"gzip": compress})
+    handler = functools.partial(handler_class, directory=str(directory))
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+
+    return server, f"http://{host}:{port}/cache/epub/{{0}}/pg{{0}}.txt"
+
+
+def main():
+    args = sys.argv[1:]
+    port = 8000
+    if "--port" in args:
+        index = args.index("--port")
+        port = int(args[index + 1])
+        del args[index : index + 2]
+    compress = "--no-gzip" not in args
+    if not compress:
+        args.remove("--no-gzip")
+
+    if len(args) != 1:
+        print(__doc__)
+        return 1
+
+    server, url = start_server(args[0], port, compress)
+    print(f"Serving {args[0]} as {url}, press Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
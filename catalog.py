@@ -0,0 +1,241 @@
+import csv
+import gzip
+import re
+from collections import namedtuple
+
+from psycopg import sql
+
+import metrics
+
+# a book of the Gutenberg's catalog, the fields as the header gives them
+Entry = namedtuple("Entry", "ebook_id title author role language year")
+# the catalog's language codes of the most books, the others are kept
+LANGUAGES = {
+    "en": "English",
+    "fr": "French",
+    "fi": "Finnish",
+    "de": "German",
+    "nl": "Dutch",
+    "it": "Italian",
+    "es": "Spanish",
+    "pt": "Portuguese",
+    "zh": "Chinese",
+    "el": "Greek",
+    "la": "Latin",
+    "sv": "Swedish",
+    "eo": "Esperanto",
+    "da": "Danish",
+    "ca": "Catalan",
+    "hu": "Hungarian",
+    "tl": "Tagalog",
+    "pl": "Polish",
+    "ja": "Japanese",
+    "cy": "Welsh",
+    "no": "Norwegian",
+    "is": "Icelandic",
+    "ru": "Russian",
+    "cs": "Czech",
+}
+# "Melville, Herman, 1819-1891 [Editor]": the name, the dates, the role
+CREATOR_PATTERN = re.compile(r"^(.*?)(?:,\s*[^,[]*\d[^,[]*)?\s*(?:\[([^\]]+)\])?$")
+# the attributes' lengths in schemata.relations
+LIMITS = {"title": 512, "author": 256, "role": 64, "language": 64}
+
+
+def open_catalog(path):
+    """
+    Returns: file object: the catalog's text, pg_catalog.csv
+      or pg_catalog.csv.gz
+    """
+
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def get_creator(authors):
+    """
+    Gets the first creator of the book: "Melville, Herman, 1819-1891"
+      is "Herman Melville", the role is "Author" unless it is given
+      in brackets
+
+    Returns: tuple of str: the name and the role
+    """
+
+    creator = authors.split(";")[0].strip()
+    if not creator:
+        return "Unknown", "Author"
+
+    name, role = CREATOR_PATTERN.match(creator).groups()
+    parts = [part.strip() for part in name.split(",")]
+    if len(parts) == 2 and all(parts):
+        # "Last, First" as the header gives it
+        name = f"{parts[1]} {parts[0]}"
+
+    return name.strip() or "Unknown", role or "Author"
+
+
+def read_catalog(path):
+    """
+    Reads the text books of the catalog
+
+    Parameters:
+    - path: str: the catalog's file, see open_catalog()
+
+    Yields: Entry: the book's general info, the year is the one
+      the book was issued in by Gutenberg (the catalog has no other)
+    """
+
+    with open_catalog(path) as file:
+        for row in csv.DictReader(file):
+            if row.get("Type") != "Text" or not row.get("Text#", "").isdigit():
+                continue
+
+            author, role = get_creator(row.get("Authors", ""))
+            # the first of the book's languages
+            code = row.get("Language", "").split(";")[0].strip()
+            issued = row.get("Issued", "")[:4]
+            yield Entry(
+                int(row["Text#"]),
+                " ".join(row.get("Title", "").split()) or "Unknown",
+                author,
+                role,
+                LANGUAGES.get(code, code or "Unknown"),
+                int(issued) if issued.isdigit() else None,
+            )
+
+
+def truncate(value, field):
+    """
+    Returns: str: the value cut to the attribute's length, it is
+      copied as it is
+    """
+
+    return value[: LIMITS[field]]
+
+
+def copy_names(relation, attribute, names, cursor):
+    """
+    Inserts the names that are not in the relation with one COPY
+      into a temporary relation and one INSERT ... SELECT
+
+    Returns: dict: name -> id of every name
+    """
+
+    temporary = sql.Identifier(f"{relation}_catalog")
+    cursor.execute(
+        sql.SQL("CREATE TEMP TABLE {} (name TEXT) ON COMMIT DROP").format(temporary)
+    )
+    with cursor.copy(sql.SQL("COPY {} (name) FROM STDIN").format(temporary)) as copy:
+        for name in names:
+            copy.write_row([name])
+
+    identifiers = {"rel": sql.Identifier(relation), "attr": sql.Identifier(attribute)}
+    cursor.execute(
+        sql.SQL(
+            """
+            INSERT INTO {rel} ({attr})
+              SELECT DISTINCT name FROM {temporary}
+              ON CONFLICT DO NOTHING
+            """
+        ).format(temporary=temporary, **identifiers)
+    )
+    cursor.execute(
+        sql.SQL(
+            """
+            SELECT r.{attr}, r.id FROM {rel} AS r
+              JOIN {temporary} AS t ON t.name = r.{attr}
+            """
+        ).format(temporary=temporary, **identifiers)
+    )
+
+    return dict(cursor.fetchall())
+
+
+@metrics.timed()
+def load_catalog(path, relations, connection, cursor, verbose=False):
+    """
+    Loads the general info of every text book of the catalog in one
+      transaction: the authors, the roles and the languages are copied
+      and upserted at once, the books are copied with their paragraphs
+      pending, so loading a book later only streams its paragraphs.
+      The books already in the database are kept as they are, an ebook
+      id listed twice is loaded once; the books pending are looked up
+      in lookup.catalog_ids, read from the database
+
+    Parameters:
+    - path: str: the catalog's file, see open_catalog()
+    - relations: dict: relations' schemata
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of books inserted
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+
+    entries = {entry.ebook_id: entry for entry in read_catalog(path)}
+    if verbose:
+        print(f"{len(entries)} books read from the catalog {path}")
+
+    with connection.transaction():
+        ids = dict()
+        for relation, field in (
+            (author_rel, "author"),
+            (role_rel, "role"),
+            (language_rel, "language"),
+        ):
+            names = {
+                truncate(getattr(entry, field), field) for entry in entries.values()
+            }
+            ids[field] = copy_names(relation, relations[relation][1][0], names, cursor)
+
+        attributes = [
+            "title",
+            "year",
+            "author_id",
+            "role_id",
+            "language_id",
+            "ebook_id",
+            "text_pending",
+        ]
+        columns = sql.SQL(", ").join(map(sql.Identifier, attributes))
+        temporary = sql.Identifier(f"{book_rel}_catalog")
+        cursor.execute(
+            sql.SQL(
+                "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+            ).format(temporary, columns, sql.Identifier(book_rel))
+        )
+        query = sql.SQL("COPY {} ({}) FROM STDIN").format(temporary, columns)
+        with cursor.copy(query) as copy:
+            for entry in entries.values():
+                copy.write_row(
+                    [
+                        truncate(entry.title, "title"),
+                        entry.year,
+                        ids["author"][truncate(entry.author, "author")],
+                        ids["role"][truncate(entry.role, "role")],
+                        ids["language"][truncate(entry.language, "language")],
+                        entry.ebook_id,
+                        True,
+                    ]
+                )
+
+        cursor.execute(
+            sql.SQL(
+                """
+                INSERT INTO {book} ({columns})
+                  SELECT {columns} FROM {temporary}
+                  ON CONFLICT DO NOTHING
+                """
+            ).format(
+                book=sql.Identifier(book_rel), columns=columns, temporary=temporary
+            )
+        )
+        inserted = cursor.rowcount
+
+    print(f"Loaded {inserted} of {len(entries)} books of the catalog")
+
+    return inserted
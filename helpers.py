@@ -1,29 +1,67 @@
+import codecs
+import hashlib
+import io
+import itertools
 import re
 import time
+from collections import namedtuple
+from urllib.parse import urlsplit
 
-import psycopg
-import requests
 from psycopg import sql
+from psycopg_pool import ConnectionPool
 
+import http_cache
+import metrics
+import statements
 
-def url_check(url):
-    """
-    Checks whether url is responding
-    Returns: int: 0 if url is okay
-    """
+# number of bytes read from the response at a time
+CHUNK_SIZE = 64 * 1024
+# the name of the relation's partition by its number
+PARTITION = "{}_p{}"
+# the modulus of the relations' hash partitions read from the catalog
+moduli = {}
+# the constraints and the indexes are dropped and made anew when more
+# rows than this part of the relation's rows are merged from the staging
+STAGING_REBUILD_FRACTION = 0.2
 
-    try:
-        r = requests.get(url, allow_redirects=True)
-        result = r.status_code
-        if result == 200:
-            return 0
-
-    except Exception as e:
-        print("Error:", e)
-        return 1
+# the book's general info from the technical info part of the file
+Header = namedtuple(
+    "Header", ["title", "author", "role", "language", "release_date", "ebook_id"]
+)
+# the line the text of the book starts below
+START_PATTERN = re.compile(r"\*\*\* ?START OF")
+# the line the text of the book ends above, the license follows it
+END_PATTERN = re.compile(r"\*\*\* ?END OF")
+# the lines of the technical info part the general info is taken from
+HEADER_PATTERNS = {
+    "title": re.compile(r"Title: (.*)$"),
+    "author": re.compile(r"(Author|Creator|Compiler|Contributor): (.*)$"),
+    "language": re.compile(r"Language: ([A-Za-z]+)"),
+    "release_date": re.compile(r"Release [Dd]ate: ([^\[]*[^\[\s])"),
+    "ebook_id": re.compile(r"\[(?:e-?book|e-?text) #(\d+)\]", re.IGNORECASE),
+}
+# number of lines read while looking for the start of the text
+HEAD_LIMIT = 1000
+# the byte order marks and the encodings they mark, the longest first
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+# the line of the technical info part naming the encoding of the file
+CHARSET_PATTERN = re.compile(rb"Character set encoding: *([A-Za-z][\w.:-]*)")
+# number of bytes of the beginning of the file the encoding is detected by
+DETECT_LIMIT = 64 * 1024
+# the errors handler the books are decoded with: the bytes that are not
+# valid in the book's encoding are decoded as latin-1, so a latin-1 book
+# taken for utf-8 by its beginning keeps its letters, see detect_encoding()
+FALLBACK = "latin-1-fallback"
 
-    print(f"Error {result}")
-    return 0
+# the book's number -> the sha256 digest and the size of its bytes read
+# last, saved with the book, see save_content_hash()
+content_hashes = dict()
 
 
 def get_file_name(url):
@@ -42,24 +80,440 @@ def get_file_name(url):
     return None
 
 
-def get_txt(url, file_name, verbose=False):
+@metrics.timed("download")
+def get_txt(url, file_name, verbose=False, key=None):
     """
-    Creates a txt file out of a url link
-    Returns: int: 0 if the file is saved
+    Creates a txt file out of a url link with one request
+      (see http_cache.fetch()); the bytes are saved as they are
+      received, the encoding is detected by the first chunk
+
+    Returns: str: the encoding of the file or None if the file
+      is not saved
     """
 
     try:
-        r = requests.get(url, allow_redirects=True)
-        content = r.text
-        with open(file_name, "w") as file:
-            file.write(content)
+        chunks, charset = http_cache.fetch(url, key, verbose=verbose)
+        chunks = hash_chunks(chunks, key)
+        first = next(chunks, b"")
+        encoding = detect_encoding(first, charset)
+        with open(file_name, "wb") as file:
+            for chunk in itertools.chain([first], chunks):
+                file.write(chunk)
             if verbose:
-                print(f"Text saved as {file_name}")
-        return 0
+                print(f"Text saved as {file_name} ({encoding})")
+        return encoding
 
     except Exception as e:
         print("Error:", e)
-        return 1
+        return None
+
+
+def wait_turn(url, hosts, delay):
+    """
+    Keeps the requests to the same host at least `delay` seconds apart,
+      see async_helpers.wait_turn()
+
+    Parameters:
+    - url: str: the url about to be requested
+    - hosts: dict: host name -> the time of the last request
+    - delay: float: seconds between the requests to the host
+    """
+
+    host = urlsplit(url).netloc
+    wait = hosts.get(host, 0.0) + delay - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    hosts[host] = time.monotonic()
+
+
+@metrics.timed("download")
+def get_content(url, verbose=False, key=None):
+    """
+    Downloads a txt file from a url link with one request
+      (see http_cache.fetch()) without decoding it
+
+    Returns: tuple: the bytes and the encoding of the text
+      (see detect_encoding()) or None if the url is not okay
+    """
+
+    try:
+        chunks, charset = http_cache.fetch(url, key, verbose=verbose)
+        content = b"".join(chunks)
+        if verbose:
+            print(f"Downloaded {len(content)} bytes from {url}")
+        return content, detect_encoding(content, charset, final=True)
+
+    except Exception as e:
+        print("Error:", e)
+        return None
+
+
+def stream_lines(url, chunk_size=CHUNK_SIZE, verbose=False, key=None):
+    """
+    Downloads a txt file from a url link by chunks and yields
+      its lines without saving the file, so only one chunk
+      is kept in memory at a time
+
+    Parameters:
+    - url: str: link to the txt file
+    - chunk_size: int: number of bytes read at a time
+    - verbose: bool: print progress statements, default False
+    - key: the book's number, the http cache's key
+
+    Yields: str: line of the text with its line ending
+    """
+
+    start = time.perf_counter()
+    chunks, charset = http_cache.fetch(url, key, chunk_size, verbose)
+    # the chunks are received while the lines are parsed and loaded,
+    # their time is the download's, not the paragraphs' load
+    request = time.perf_counter() - start
+    chunks = hash_chunks(metrics.timed_iter(chunks, "download", request), key)
+    first = next(chunks, b"")
+    encoding = detect_encoding(first, charset)
+    if verbose:
+        print(f"Streaming {url} by {chunk_size} bytes ({encoding})")
+    yield from iter_lines(itertools.chain([first], chunks), encoding)
+
+
+def hash_book(content, key=None):
+    """
+    Hashes the book's bytes, the digest is kept in `content_hashes`
+      under the book's number
+
+    Returns: tuple: the sha256 digest (bytes) and the size
+    """
+
+    result = hashlib.sha256(content).digest(), len(content)
+    if key is not None:
+        content_hashes[key] = result
+
+    return result
+
+
+def hash_chunks(chunks, key=None):
+    """
+    Passes the book's chunks through hashing them: when they are read
+      to the end, their digest is kept in `content_hashes` under the
+      book's number, see hash_book()
+
+    Yields: bytes: the same chunks
+    """
+
+    digest, size = hashlib.sha256(), 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        yield chunk
+
+    if key is not None:
+        content_hashes[key] = digest.digest(), size
+
+
+@metrics.timed()
+def save_content_hash(book_relation, book_id, key, cursor):
+    """
+    Saves the digest and the size of the bytes the book was loaded
+      from, see hash_book(), with the book
+
+    Returns: int: 1 if the book's digest is known and saved
+    """
+
+    content = content_hashes.pop(key, None)
+    if content is None:
+        return 0
+
+    attributes = ["content_hash", "content_size"]
+    query = statements.get("update", book_relation, attributes)
+    cursor.execute(query, [*content, book_id], prepare=True)
+
+    return cursor.rowcount
+
+
+def get_content_hashes(book_relation, cursor, limit=None):
+    """
+    Returns: dict: the Gutenberg number -> the id and the content's
+      digest (None if it is not known) of every book loaded, the
+      `limit` ones checked longest ago (the ones never checked first),
+      see save_content_checked()
+    """
+
+    query = sql.SQL(
+        """
+        SELECT ebook_id, id, content_hash FROM {}
+          WHERE ebook_id IS NOT NULL AND NOT text_pending
+          ORDER BY content_checked NULLS FIRST, ebook_id LIMIT %s
+        """
+    ).format(sql.Identifier(book_relation))
+    cursor.execute(query, [limit])
+
+    return {ebook_id: (book_id, digest) for ebook_id, book_id, digest in cursor}
+
+
+def save_content_checked(book_relation, book_ids, cursor):
+    """
+    Saves the time the books' digests were checked, so the next
+      refresh checks the others first, see get_content_hashes()
+
+    Returns: int: number of books
+    """
+
+    query = sql.SQL("UPDATE {} SET content_checked = now() WHERE id = ANY(%s)")
+    cursor.execute(query.format(sql.Identifier(book_relation)), [list(book_ids)])
+
+    return cursor.rowcount
+
+
+def delete_paragraphs(relation, book_id, cursor):
+    """
+    Deletes the book's paragraphs from the relation (or its partition)
+
+    Returns: int: number of the rows deleted
+    """
+
+    cursor.execute(statements.get("delete", relation, ["book_id"]), [book_id])
+
+    return cursor.rowcount
+
+
+def decode_as_latin1(error):
+    """
+    Decodes the bytes the book's encoding could not as latin-1,
+      the errors handler of FALLBACK
+
+    Returns: tuple: the text and the position to go on from
+    """
+
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+
+    return error.object[error.start : error.end].decode("iso8859-1"), error.end
+
+
+codecs.register_error(FALLBACK, decode_as_latin1)
+
+
+@metrics.timed()
+def detect_encoding(head, charset=None, final=False):
+    """
+    Detects the encoding of the book by the beginning of its bytes
+      without decoding the whole book: the byte order mark, else
+      the charset the server declared, else the "Character set
+      encoding:" line of the technical info, else utf-8 if the
+      beginning is valid utf-8 and latin-1 if it is not. A sequence
+      cut by the end of the beginning leaves it undecided, it is
+      taken for utf-8: the book is decoded with FALLBACK, so the
+      bytes found invalid later are decoded as latin-1
+
+    Parameters:
+    - head: bytes: the beginning of the file, the first chunk will do
+    - charset: str: the charset of the Content-Type header or None
+    - final: bool: `head` is the whole book, nothing is cut at its end
+
+    Returns: str: name of the encoding
+    """
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    final = final and len(head) <= DETECT_LIMIT
+    head = head[:DETECT_LIMIT]
+    match = CHARSET_PATTERN.search(head)
+    declared = match.group(1).decode("ascii") if match else None
+    for name in (charset, declared):
+        try:
+            encoding = codecs.lookup(name).name if name else None
+        except LookupError:
+            continue
+        if encoding:
+            # an ascii book may have a few 8-bit characters, utf-8 keeps them
+            return "utf-8" if encoding == "ascii" else encoding
+
+    try:
+        # unless final, the last character may be cut by the chunk's end
+        codecs.getincrementaldecoder("utf-8")().decode(head, final)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "iso8859-1"
+
+
+@metrics.timed()
+def decode(content, encoding=None):
+    """
+    Decodes the book at once, line endings are translated to "\n";
+      the invalid bytes are decoded as latin-1, see FALLBACK
+
+    Parameters:
+    - content: bytes: the book's txt file
+    - encoding: str: encoding of the text, detected if None
+
+    Returns: str: the text
+    """
+
+    encoding = encoding or detect_encoding(content, final=True)
+    text = content.decode(encoding, errors=FALLBACK)
+
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def iter_lines(chunks, encoding="utf-8"):
+    """
+    Decodes chunks of bytes incrementally and splits them into lines;
+      line endings are translated to "\n" like in a file opened
+      in the text mode; the invalid bytes are decoded as latin-1,
+      see FALLBACK
+
+    Parameters:
+    - chunks: iterable of bytes
+    - encoding: str: encoding of the text, default utf-8
+
+    Yields: str: line of the text with its line ending
+    """
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors=FALLBACK)
+    tail = ""
+
+    for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        # "\r" may be the first half of "\r\n" split between chunks
+        carriage = ""
+        if text.endswith("\r"):
+            text, carriage = text[:-1], "\r"
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        # the last line may continue in the next chunk
+        tail = lines.pop() + carriage
+        for line in lines:
+            yield line + "\n"
+
+    text = tail + decoder.decode(b"", final=True)
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    tail = lines.pop()
+    for line in lines:
+        yield line + "\n"
+    if tail:
+        yield tail
+
+
+def read_head(lines, limit=500):
+    """
+    Reads the technical info of the book from the lines iterator:
+      everything up to the "*** START OF" line (but no more than
+      HEAD_LIMIT lines) and `limit` lines below it where the
+      published year is searched for
+
+    Parameters:
+    - lines: iterator of str
+    - limit: int: number of lines to read below the "*** START OF" line
+
+    Returns: list of str: the lines read
+    """
+
+    head = list()
+
+    for line in lines:
+        head.append(line)
+        if START_PATTERN.match(line) or len(head) >= HEAD_LIMIT:
+            break
+
+    count = 0
+    for line in lines:
+        head.append(line)
+        count += 1
+        if count > limit + 1:
+            break
+
+    return head
+
+
+@metrics.timed()
+def get_header(lines):
+    """
+    Gets the book's general info from the technical info part
+      of the file in one pass: reads the lines iterator up to
+      the "*** START OF" line and stops there
+
+    Parameters:
+    - lines: iterator of str
+
+    Returns: Header: "Unknown" for the fields not found,
+      ebook_id is int or None
+    """
+
+    found = dict()
+
+    for line in lines:
+        if START_PATTERN.match(line):
+            break
+        for field, pattern in HEADER_PATTERNS.items():
+            if field in found:
+                continue
+            match = pattern.search(line)
+            if match:
+                found[field] = match.groups()
+
+    title = found.get("title", ["Unknown"])[0]
+    role, author = found.get("author", ["Unknown", "Unknown"])
+    language = found.get("language", ["Unknown"])[0]
+    release_date = found.get("release_date", ["Unknown"])[0]
+    ebook_id = found.get("ebook_id")
+
+    return Header(
+        title,
+        author,
+        role,
+        language,
+        release_date,
+        int(ebook_id[0]) if ebook_id else None,
+    )
+
+
+@metrics.timed()
+def get_year(lines, limit=500):
+    """
+    Gets the book's published year: the first 4-digit number in
+      `limit` lines of the lines iterator; call it right after
+      get_header() on the same iterator
+
+    Returns: int: the year or 10000 if not found
+    """
+
+    pattern = re.compile(r"\b(\d{4})\b")
+
+    for count, line in enumerate(lines):
+        if count > limit or "***" in line:
+            break
+        match = pattern.search(line)
+        if match:
+            return int(match.group(1))
+
+    return 10_000
+
+
+@metrics.timed()
+def parse_content(content, encoding=None):
+    """
+    Turns the raw bytes of a book into its general info and
+      paragraphs; needs no database, so it may run in a worker
+      process
+
+    Parameters:
+    - content: bytes: the book's txt file
+    - encoding: str: encoding of the text, detected if None
+
+    Returns: tuple: Header, the published year, list of paragraphs
+      and the "chars", "lines", "paragraphs" counts
+    """
+
+    text = decode(content, encoding)
+    head_lines = iter(read_head(io.StringIO(text)))
+    header = get_header(head_lines)
+    year = get_year(head_lines)
+
+    counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+    paragraphs = list(get_paragraphs(text, counts))
+
+    return header, year, paragraphs, counts
 
 
 def get_string_match(pattern, file_handler, group_number=[1]):
@@ -87,6 +541,184 @@ def get_string_match(pattern, file_handler, group_number=[1]):
     return ["Unknown" for i in range(len(group_number))]
 
 
+def get_paragraphs(lines, counts, markers=True):
+    """
+    Yields the paragraphs of the text; a paragraph is a block
+      of lines separated by an empty line, its stripped lines
+      are joined once when the block is over.
+      With markers, only the text between the "*** START OF" and
+      the "*** END OF" lines is read, so the technical info and
+      the license are not paragraphs; if there is no "*** START OF"
+      line in the first HEAD_LIMIT lines, the text is read from
+      the beginning
+
+    Parameters:
+    - lines: iterable of str: a file object or any other lines source,
+      or the whole text as one str
+    - counts: dict: "chars", "lines" and "paragraphs" counters of
+      the text read, updated in place when the text is over
+    - markers: bool: honour the start and end markers, default True
+
+    Yields: str: paragraph
+    """
+
+    if isinstance(lines, str):
+        lines = io.StringIO(lines)
+    lines = iter(lines)
+
+    if markers:
+        # the lines above the start are kept in case there is no start
+        head = list()
+        for line in lines:
+            if line[:1] == "*" and START_PATTERN.match(line):
+                head = None
+                break
+            head.append(line)
+            if len(head) >= HEAD_LIMIT:
+                break
+        if head:
+            lines = itertools.chain(head, lines)
+
+    # the counters are kept in the local variables, the lines are
+    # counted by enumerate(), so an ordinary line costs one strip()
+    # and one append()
+    block = list()
+    append = block.append
+    line_count, char_count, paragraph_count = 0, 0, 0
+    end = END_PATTERN.match if markers else lambda line: None
+
+    try:
+        for line_count, line in enumerate(lines, 1):
+            # a one char slice is cheaper than startswith()
+            if line[:1] == "*" and end(line):
+                line_count -= 1
+                break
+
+            line = line.strip()
+            if line:
+                append(line)
+
+            # when paragraph done
+            elif block:
+                paragraph = " " + " ".join(block)
+                # the joined lines have a space before every line
+                char_count += len(paragraph) - len(block)
+                paragraph_count += 1
+                block.clear()
+                yield paragraph
+
+        if block:
+            paragraph = " " + " ".join(block)
+            char_count += len(paragraph) - len(block)
+            paragraph_count += 1
+            yield paragraph
+
+    finally:
+        counts["lines"] += line_count
+        counts["chars"] += char_count
+        counts["paragraphs"] += paragraph_count
+
+
+def chunk_paragraphs(paragraphs, size):
+    """
+    Groups the paragraphs into chunks of `size` paragraphs,
+      the last chunk may be shorter
+
+    Yields: tuple: the number of the chunk's first paragraph
+      (from 0) and the list of its paragraphs
+    """
+
+    paragraphs = iter(paragraphs)
+    position = 0
+    while chunk := list(itertools.islice(paragraphs, size)):
+        yield position, chunk
+        position += len(chunk)
+
+
+def get_pool(conninfo, min_size=1, max_size=4):
+    """
+    Opens a pool of autocommit connections; a connection is checked
+      before it is given out and a broken one is replaced, so
+      a dropped connection costs one book, not the whole run
+
+    Parameters:
+    - conninfo: str: the database connection string
+    - min_size: int: connections kept open, default 1
+    - max_size: int: connections open at most, default 4
+
+    Returns: psycopg_pool.ConnectionPool: use it with `with`
+    """
+
+    return ConnectionPool(
+        conninfo,
+        min_size=min_size,
+        max_size=max(min_size, max_size),
+        kwargs={"autocommit": True},
+        check=ConnectionPool.check_connection,
+        open=True,
+    )
+
+
+def print_pool_stats(pool, elapsed, name="Pool"):
+    """
+    Prints how long the connections were waited for and how busy
+      the pool was during `elapsed` seconds
+    """
+
+    stats = pool.get_stats()
+    requests_num = stats.get("requests_num", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+    usage_ms = stats.get("usage_ms", 0)
+    # the share of the time the connections of the pool were in use
+    utilisation = usage_ms / max(elapsed * 1000 * stats["pool_max"], 1)
+
+    print(
+        f"{name}: {requests_num} connections given out, "
+        f"waited {wait_ms} ms ({wait_ms / max(requests_num, 1):.1f} ms each), "
+        f"{utilisation:.0%} utilisation of {stats['pool_max']} connections, "
+        f"{stats.get('connections_lost', 0)} lost"
+    )
+
+
+def print_dedup_stats():
+    """
+    Prints how many of the paragraphs were in the paragraphs' store
+      already and the megabytes not stored again, see store_paragraphs()
+    """
+
+    mapped = metrics.counters.get("paragraphs_mapped", 0)
+    if not mapped:
+        return
+
+    stored = metrics.counters.get("paragraphs_stored", 0)
+    size = metrics.counters.get("paragraph_bytes", 0)
+    saved = size - metrics.counters.get("paragraph_bytes_stored", 0)
+    print(
+        f"Deduplicated {mapped - stored} of {mapped} paragraphs "
+        f"({(mapped - stored) / mapped:.1%}), {saved / 2**20:.1f} of "
+        f"{size / 2**20:.1f} MB not stored again"
+    )
+
+
+def print_transfer_stats(elapsed):
+    """
+    Prints the bytes of the books downloaded during `elapsed` seconds
+      and the bytes received for them, see http_cache.fetch_url()
+    """
+
+    wire = metrics.counters.get("bytes_wire", 0)
+    if not wire:
+        return
+
+    downloaded = metrics.counters.get("bytes_downloaded", 0)
+    print(
+        f"Downloaded {downloaded / 2**20:.1f} MB of text, "
+        f"{wire / 2**20:.1f} MB on the wire ({wire / max(downloaded, 1):.0%}) "
+        f"in {elapsed:.1f} sec"
+    )
+
+
+@metrics.timed()
 def drop_tables(connection, cursor, verbose=False):
     """
     Drops all the tables mentioned in the relations dictionary
@@ -117,13 +749,15 @@ def drop_tables(connection, cursor, verbose=False):
         ).format(sql.Identifier(relation))
 
         cursor.execute(query)
+    moduli.clear()
     if verbose:
         print(f"Relations {', '.join(relations)} have been dropped")
 
     return 0
 
 
-def create_tables(relations, connection, cursor, verbose=False):
+@metrics.timed()
+def create_tables(relations, connection, cursor, verbose=False, unlogged=False):
     """
     WARNING! The SQL injection possibility! Use this function
       only within a trusted environment!
@@ -146,29 +780,70 @@ def create_tables(relations, connection, cursor, verbose=False):
                        ("PRIMARY KEY", "(id)")],
         }
       ```
+      The relations are UNLOGGED if `unlogged` (not written to the WAL,
+      emptied after a crash), e.g. the staging ones.
+      A relation with ("PARTITION BY", "HASH (key)") and ("PARTITIONS",
+      "N") entries is partitioned: its N partitions are named
+      relation_p0 ... (see PARTITION). A relation created before is
+      kept as it is: one without partitions is not partitioned and
+      one with partitions keeps their modulus, see get_modulus()
     """
 
+    table = "UNLOGGED TABLE" if unlogged else "TABLE"
     for relation, attributes in relations.items():
-        query = f"CREATE TABLE IF NOT EXISTS {relation} ("
+        options = dict(attributes)
+        query = f"CREATE {table} IF NOT EXISTS {relation} ("
         for attribute, datatype in attributes:
+            if attribute in ("PARTITION BY", "PARTITIONS"):
+                continue
             query += f"{attribute} {datatype}, "
 
         query = query.rstrip(", ") + ")"
+        if "PARTITION BY" in options:
+            query += f" PARTITION BY {options['PARTITION BY']}"
 
         if verbose:
             print(query)
+        scheme = partition_scheme(relation, cursor)
         cursor.execute(query)
 
+        partitions = int(options.get("PARTITIONS", 0))
+        if scheme and partitions:
+            partitioned, modulus = scheme
+            if not partitioned:
+                print(f"{relation} is not partitioned, start over with -C to do it")
+                partitions = 0
+            elif modulus and modulus != partitions:
+                print(f"{relation} is kept in {modulus} partitions, not {partitions}")
+                partitions = modulus
+        for i in range(partitions):
+            cursor.execute(
+                f"CREATE {table} IF NOT EXISTS {PARTITION.format(relation, i)} "
+                f"PARTITION OF {relation} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+            )
+        # the partitions are read back as they are, not as requested
+        moduli.pop(relation, None)
+        get_modulus(relation, cursor)
+
+        # the relations created before an attribute was added get it
+        for attribute, datatype in attributes:
+            if attribute.isupper() or "SERIAL" in datatype:
+                continue
+            cursor.execute(
+                f"ALTER TABLE {relation} ADD COLUMN IF NOT EXISTS {attribute} {datatype}"
+            )
+
     return 0
 
 
+@metrics.timed()
 def row_exists(
     relation, attributes_list, values_list, connection, cursor, verbose=False
 ):
     """
-    WARNING! The SQL injection possibility! Use this function
-      only within a trusted environment!
-    Checks whether the value is already in the relation.
+    Checks whether the value is already in the relation with the
+      prepared statement of the attributes, see statements.get()
     Returns: bool: True if the value exists
     """
 
@@ -176,23 +851,16 @@ def row_exists(
         print("Error: Number of attributes and values is different")
         return 1
 
-    query = f"SELECT EXISTS (SELECT 1 FROM {relation} WHERE "
-    conditions = list()
-    for attr, value in zip(attributes_list, values_list):
-        # $$string$$ helps to effectively handle additional ' symbol
-        # if there is ' in the title, for example, and you escapeit
-        # with additional ' then WHERE clause will give False match
-        conditions.append(f"{attr} = $${value}$$")
-    query += " AND ".join(conditions) + ");"
-    query = sql.SQL(query)
+    query = statements.get("exists", relation, attributes_list)
 
     if verbose:
-        print(query.as_string(connection))
-    cursor.execute(query)
+        print(query)
+    cursor.execute(query, values_list, prepare=True)
 
     return cursor.fetchone()[0]
 
 
+@metrics.timed()
 def insert_into_table(relation, attributes, values, connection, cursor):
     """
     Inserts data into attributes of the relation and returns
@@ -213,25 +881,422 @@ def insert_into_table(relation, attributes, values, connection, cursor):
         print("Error: Number of attributes and values is different")
         return 1
 
-    query = sql.SQL(
-        "INSERT INTO {rel} ({cols}) VALUES ({vals}) ON CONFLICT DO NOTHING RETURNING id;"
-    ).format(
-        rel=sql.Identifier(relation),
-        cols=sql.SQL(", ").join(map(sql.Identifier, attributes)),
-        # vals=sql.SQL(", ").join(map(sql.Literal, values)),
-        vals=sql.SQL(", ").join(sql.Placeholder() * len(values)),
-    )
-    cursor.execute(query, values)
-    # cursor.execute(query)
+    query = insert_query(relation, attributes)
+    cursor.execute(query, values, prepare=True)
     result = cursor.fetchone()
     if result:
         return result[0]
 
     print("Error handled: On conflict do nothing")
-    print(query.as_string(connection))
+    print(query)
     return 0
 
 
+def insert_query(relation, attributes):
+    """
+    Gets the INSERT ... RETURNING id statement with placeholders
+      for the values of the attributes, see statements.get()
+
+    Returns: str
+    """
+
+    return statements.get("insert", relation, attributes)
+
+
+def upsert_query(relation, attribute):
+    """
+    Gets the statement inserting a value into the unique attribute
+      and returning the id of the new or of the existing row
+      in one round trip, see statements.get()
+
+    Returns: str
+    """
+
+    return statements.get("upsert", relation, [attribute])
+
+
+def names_query(relation, attribute, limit=None):
+    """
+    Composes the query selecting the values of the unique attribute
+      with their ids, no more than `limit` of them if it is given
+
+    Returns: sql.Composed
+    """
+
+    query = sql.SQL("SELECT {attr}, id FROM {rel}").format(
+        rel=sql.Identifier(relation), attr=sql.Identifier(attribute)
+    )
+    if limit is not None:
+        query += sql.SQL(" ORDER BY id DESC LIMIT {}").format(sql.Literal(limit))
+
+    return query
+
+
+@metrics.timed()
+def upsert_name(relation, attribute, value, connection, cursor):
+    """
+    Inserts the value into the unique attribute of the relation
+      or finds the existing one in one round trip
+
+    Parameters:
+    - relation: str: name of the relation
+    - attribute: str: name of the unique attribute
+    - value: str: the value
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+
+    Returns: int: id of the row
+    """
+
+    cursor.execute(upsert_query(relation, attribute), [value], prepare=True)
+
+    return cursor.fetchone()[0]
+
+
+def copy_query(relation, attributes):
+    """
+    Gets the COPY ... FROM STDIN statement for the attributes,
+      see statements.get()
+
+    Returns: str
+    """
+
+    return statements.get("copy", relation, attributes)
+
+
+@metrics.timed()
+def insert_many(relation, attributes, rows, connection, cursor):
+    """
+    Inserts rows into attributes of the relation sending them in
+      psycopg's pipeline mode: the client does not wait for every
+      row's round trip and the statement (see statements.get())
+      is prepared once for the rows. Run it within a transaction,
+      so the rows are committed at once
+
+    Parameters:
+    - relation: str: name of the relation
+    - attributes: list or tuple of strings: list of the attributes' names
+    - rows: iterable of lists or tuples: values in the order of attributes
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+
+    Returns:
+    - int: number of rows inserted
+    """
+
+    query = statements.get("insert_many", relation, attributes)
+
+    with connection.pipeline():
+        cursor.executemany(query, rows)
+
+    return cursor.rowcount
+
+
+@metrics.timed()
+def copy_into_table(relation, attributes, rows, connection, cursor):
+    """
+    Streams rows into attributes of the relation with one
+      COPY ... FROM STDIN command instead of an INSERT per row.
+
+    Parameters:
+    - relation: str: name of the relation
+    - attributes: list or tuple of strings: list of the attributes' names
+    - rows: iterable of lists or tuples: values in the order of attributes
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+
+    Returns:
+    - int: number of rows copied
+    """
+
+    count = 0
+    with cursor.copy(copy_query(relation, attributes)) as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+
+    return count
+
+
+def partition_scheme(relation, cursor):
+    """
+    Reads from the catalog whether the relation is partitioned
+      and the modulus of its hash partitions
+
+    Returns: tuple: (bool, int) or None if there is no such relation
+    """
+
+    cursor.execute(
+        r"""
+        SELECT c.relkind = 'p', coalesce(max(substring(
+            pg_get_expr(p.relpartbound, p.oid) FROM 'modulus (\d+)')::integer), 0)
+          FROM pg_class c
+          LEFT JOIN pg_inherits i ON i.inhparent = c.oid
+          LEFT JOIN pg_class p ON p.oid = i.inhrelid
+          WHERE c.oid = to_regclass(%s)
+          GROUP BY c.relkind
+        """,
+        [relation],
+    )
+
+    return cursor.fetchone()
+
+
+def get_modulus(relation, cursor):
+    """
+    Returns: int: the modulus of the relation's hash partitions as it
+      was created, not as the schema says, 0 if it has no partitions
+    """
+
+    if relation not in moduli:
+        scheme = partition_scheme(relation, cursor)
+        moduli[relation] = scheme[1] if scheme else 0
+
+    return moduli[relation]
+
+
+def partition_query(relation, partitions):
+    """
+    Composes the query of the number of the hash partition
+      of the relation holding the integer key
+
+    Returns: sql.Composed
+    """
+
+    return sql.SQL(
+        """
+        SELECT r FROM generate_series(0, {last}) AS r
+          WHERE satisfies_hash_partition({rel}::regclass, {modulus}, r, %s::integer)
+        """
+    ).format(
+        last=sql.Literal(partitions - 1),
+        rel=sql.Literal(relation),
+        modulus=sql.Literal(partitions),
+    )
+
+
+@metrics.timed()
+def get_partition(relation, partitions, key, cursor):
+    """
+    Finds the partition of the relation the key's rows are in, so they
+      are written into it straight, not routed row by row
+
+    Parameters:
+    - relation: str: name of the relation partitioned by the hash
+      of an integer attribute
+    - partitions: int: number of the relation's partitions
+    - key: int: the attribute's value
+    - cursor: psycopg class instance
+
+    Returns: str: name of the partition
+    """
+
+    cursor.execute(partition_query(relation, partitions), [key])
+
+    return PARTITION.format(relation, cursor.fetchone()[0])
+
+
+@metrics.timed()
+def delete_book(book_relation, text_relation, ebook_id, cursor):
+    """
+    Deletes the book with its paragraphs; the paragraphs of a book
+      of the partitioned relation are deleted from its partition only
+
+    Returns: int: the book's id or 0 if there is no such book
+    """
+
+    cursor.execute(
+        sql.SQL("SELECT id FROM {} WHERE ebook_id = %s").format(
+            sql.Identifier(book_relation)
+        ),
+        [ebook_id],
+    )
+    row = cursor.fetchone()
+    if not row:
+        return 0
+
+    relation = text_relation
+    partitions = get_modulus(text_relation, cursor)
+    if partitions:
+        relation = get_partition(text_relation, partitions, row[0], cursor)
+    delete_paragraphs(relation, row[0], cursor)
+    cursor.execute(
+        sql.SQL("DELETE FROM {} WHERE id = %s").format(sql.Identifier(book_relation)),
+        [row[0]],
+    )
+
+    return row[0]
+
+
+@metrics.timed()
+def merge_staging(
+    staging, relation, attributes, book_relation, connection, cursor, verbose=False
+):
+    """
+    Moves the rows of the staging relation into the relation with one
+      INSERT ... SELECT in a transaction, in the order they were staged.
+      The rows of the books that are not in the database (a book rolled
+      back after its paragraphs were staged) are deleted. The books
+      are marked staged till their rows are merged, in the same
+      transaction: a marked book with no rows staged lost them when a
+      crash emptied the UNLOGGED relation, it is pending again and its
+      paragraphs are loaded like the catalog's ones. If many rows
+      are merged the relation's primary and foreign keys and indexes
+      are dropped before the insert and made anew after it, so they are
+      built and validated once instead of row by row.
+      The rows left by an interrupted run are merged by the next one
+
+    Parameters:
+    - staging: str: name of the staging relation
+    - relation: str: name of the relation
+    - attributes: list of str: the attributes moved
+    - book_relation: str: name of the books' relation
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of rows merged
+    """
+
+    cursor.execute("SELECT to_regclass(%s)", [staging])
+    if cursor.fetchone()[0] is None:
+        return 0
+
+    names = {"staging": sql.Identifier(staging), "rel": sql.Identifier(relation)}
+    names["cols"] = sql.SQL(", ").join(map(sql.Identifier, attributes))
+
+    with connection.transaction():
+        cursor.execute(
+            sql.SQL(
+                """
+                DELETE FROM {staging} AS s
+                  WHERE NOT EXISTS (SELECT 1 FROM {book} AS b WHERE b.id = s.book_id)
+                """
+            ).format(book=sql.Identifier(book_relation), **names)
+        )
+        orphans = cursor.rowcount
+        cursor.execute(
+            sql.SQL(
+                """
+                UPDATE {book} AS b
+                  SET text_staged = FALSE, text_pending = s.book_id IS NULL
+                  FROM {book} AS o
+                  LEFT JOIN (SELECT DISTINCT book_id FROM {staging}) AS s
+                    ON s.book_id = o.id
+                  WHERE b.id = o.id AND o.text_staged
+                  RETURNING b.text_pending
+                """
+            ).format(book=sql.Identifier(book_relation), **names)
+        )
+        lost = sum(pending for pending, in cursor.fetchall())
+        if lost:
+            print(f"{lost} staged books lost their paragraphs, they are pending again")
+        cursor.execute(
+            sql.SQL(
+                "SELECT (SELECT count(*) FROM {staging}), (SELECT count(*) FROM {rel})"
+            ).format(**names)
+        )
+        staged, total = cursor.fetchone()
+        if not staged:
+            return 0
+
+        rebuild = staged > STAGING_REBUILD_FRACTION * total
+        constraints, indexes = list(), list()
+        if rebuild:
+            cursor.execute("SET LOCAL maintenance_work_mem = '256MB'")
+            cursor.execute(
+                """
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                  WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+                  ORDER BY contype DESC
+                """,
+                [relation],
+            )
+            constraints = cursor.fetchall()
+            cursor.execute(
+                """
+                SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+                  FROM pg_index AS i
+                  LEFT JOIN pg_constraint AS c ON c.conindid = i.indexrelid
+                  WHERE i.indrelid = %s::regclass AND c.oid IS NULL
+                """,
+                [relation],
+            )
+            indexes = cursor.fetchall()
+            for name, _ in constraints:
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {rel} DROP CONSTRAINT {}").format(
+                        sql.Identifier(name), **names
+                    )
+                )
+            for name, _ in indexes:
+                cursor.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+
+        cursor.execute(
+            sql.SQL(
+                """
+                INSERT INTO {rel} ({cols})
+                  SELECT {cols} FROM {staging} ORDER BY id
+                """
+            ).format(**names)
+        )
+        cursor.execute(sql.SQL("TRUNCATE {staging}").format(**names))
+
+        # the keys first, the foreign keys are checked at once
+        for name, definition in constraints:
+            cursor.execute(
+                sql.SQL("ALTER TABLE {rel} ADD CONSTRAINT {} {}").format(
+                    sql.Identifier(name), sql.SQL(definition), **names
+                )
+            )
+        for name, definition in indexes:
+            cursor.execute(sql.SQL(definition))
+
+    cursor.execute(sql.SQL("ANALYZE {rel}").format(**names))
+
+    if verbose:
+        how = "rebuilt" if rebuild else "kept"
+        print(
+            f"Merged {staged} rows of {staging} into {relation} "
+            f"(constraints and indexes {how}), {orphans} orphaned rows deleted"
+        )
+
+    return staged
+
+
+def claim_query(book_relation):
+    """
+    Composes the query marking the paragraphs of the book
+      from the catalog as loaded (or staged, see merge_staging())
+
+    Returns: sql.Composed
+    """
+
+    return sql.SQL(
+        "UPDATE {} SET text_pending = FALSE, text_staged = %s"
+        " WHERE ebook_id = %s AND text_pending RETURNING id"
+    ).format(sql.Identifier(book_relation))
+
+
+@metrics.timed()
+def claim_book(book_relation, ebook_id, cursor, staged=False):
+    """
+    Takes the book whose general info is loaded from the catalog
+      for its paragraphs to be loaded; run it in the transaction
+      loading them, so a failed book stays pending. The book whose
+      paragraphs are loaded into the staging relation is marked
+      `staged`, see merge_staging()
+
+    Returns: int: the book's id or 0 if the book is not pending
+    """
+
+    cursor.execute(claim_query(book_relation), [staged, ebook_id])
+    row = cursor.fetchone()
+
+    return row[0] if row else 0
+
+
+@metrics.timed()
 def get_value(cursor, relation, attribute1, attribute2, match):
     """
     Returns one value from the select query to database
@@ -256,6 +1321,7 @@ def get_value(cursor, relation, attribute1, attribute2, match):
     return cursor.fetchone()[0]
 
 
+@metrics.timed()
 def get_foreign_key(
     relation,
     attribute_to_search_on,
@@ -267,15 +1333,161 @@ def get_foreign_key(
     """
     Gets the primary key of the relation's tuple.
     """
-    query = sql.SQL("SELECT id FROM {} WHERE {} = {};").format(
-        sql.Identifier(relation),
-        sql.Identifier(attribute_to_search_on),
-        sql.Literal(value),
-    )
+    query = statements.get("lookup", relation, [attribute_to_search_on])
 
     if verbose:
-        print(query.as_string(connection))
+        print(query)
         print(f"Found {relation}")
-    cursor.execute(query)
+    cursor.execute(query, [value], prepare=True)
 
     return cursor.fetchone()[0]
+
+
+def hash_paragraphs(paragraphs, hash_size):
+    """
+    Hashes the paragraphs with BLAKE2b
+
+    Returns: tuple: list of the hashes in the paragraphs' order,
+      dict: hash -> paragraph and dict: hash -> its size in bytes
+      of every distinct paragraph
+    """
+
+    hashes, unique, sizes = list(), dict(), dict()
+    for paragraph in paragraphs:
+        data = paragraph.encode()
+        digest = hashlib.blake2b(data, digest_size=hash_size).digest()
+        hashes.append(digest)
+        if digest not in unique:
+            unique[digest] = paragraph
+            sizes[digest] = len(data)
+
+    return hashes, unique, sizes
+
+
+def known_query(relation):
+    """
+    Composes the query selecting which of the hashes (an array)
+      the store has
+
+    Returns: sql.Composed
+    """
+
+    return sql.SQL("SELECT hash FROM {} WHERE hash = ANY(%s)").format(
+        sql.Identifier(relation)
+    )
+
+
+def store_query(relation):
+    """
+    Composes the query inserting the paragraphs (the arrays of the
+      hashes and of the texts) the store has not, returning the hashes
+      of the ones inserted
+
+    Returns: sql.Composed
+    """
+
+    return sql.SQL(
+        """
+        INSERT INTO {} (hash, paragraph)
+          SELECT * FROM unnest(%s::BYTEA[], %s::TEXT[])
+          ON CONFLICT DO NOTHING
+          RETURNING hash
+        """
+    ).format(sql.Identifier(relation))
+
+
+def count_stored(hashes, sizes, stored):
+    """
+    Counts the book's paragraphs and the ones stored anew,
+      see print_dedup_stats()
+    """
+
+    metrics.count("paragraphs_mapped", len(hashes))
+    metrics.count("paragraphs_stored", len(stored))
+    metrics.count("paragraph_bytes", sum(sizes[digest] for digest in hashes))
+    metrics.count("paragraph_bytes_stored", sum(sizes[digest] for digest in stored))
+
+
+@metrics.timed()
+def store_paragraphs(relation, paragraphs, cursor, hash_size=16):
+    """
+    Keeps the book's paragraphs in the content-addressed store: a
+      paragraph is kept once by the hash of its text however many
+      books (or editions, or licenses) have it. The book's hashes are
+      resolved in one batch against the store's primary key and only
+      the paragraphs it has not are sent and inserted in another;
+      ON CONFLICT DO NOTHING keeps the concurrent loaders safe, and
+      the hashes are inserted sorted, so their transactions lock
+      the same keys in the same order and do not deadlock
+
+    Parameters:
+    - relation: str: name of the store, see schemata.STORE
+    - paragraphs: iterable of str
+    - cursor: psycopg class instance
+    - hash_size: int: number of bytes of a hash, see schemata.HASH_SIZE
+
+    Returns: list of bytes: the paragraphs' hashes in their order
+    """
+
+    hashes, unique, sizes = hash_paragraphs(paragraphs, hash_size)
+
+    cursor.execute(known_query(relation), [list(unique)])
+    for row in cursor.fetchall():
+        unique.pop(row[0], None)
+
+    stored = list()
+    if unique:
+        keys = sorted(unique)
+        cursor.execute(store_query(relation), [keys, [unique[key] for key in keys]])
+        stored = [row[0] for row in cursor.fetchall()]
+    count_stored(hashes, sizes, stored)
+
+    return hashes
+
+
+@metrics.timed()
+def read_paragraph(relation, book_id, number, cursor, chunk_size=None, store=None):
+    """
+    Reads one paragraph of the book: in the chunk layout it is
+      one element of the only chunk holding it, found by the
+      (book_id, position) index; in the dedup layout it is found by
+      the same index and its text is taken from the store by hash;
+      in the paragraph layout the book's paragraphs are counted
+      in the order they were loaded
+
+    Parameters:
+    - relation: str: name of the paragraphs' relation
+    - book_id: int: the book's id
+    - number: int: the paragraph's number in the book, from 0
+    - cursor: psycopg class instance
+    - chunk_size: int: paragraphs in a chunk, None for the
+      paragraph layout
+    - store: str: name of the store of the dedup layout, None
+      for the other layouts
+
+    Returns: str: the paragraph or None if the book has fewer
+    """
+
+    if store:
+        query = sql.SQL(
+            """
+            SELECT s.paragraph FROM {} AS m
+              JOIN {} AS s ON s.hash = m.hash
+              WHERE m.book_id = %s AND m.position = %s
+            """
+        ).format(sql.Identifier(relation), sql.Identifier(store))
+        cursor.execute(query, [book_id, number])
+    elif chunk_size:
+        query = sql.SQL(
+            "SELECT paragraphs[%s] FROM {} WHERE book_id = %s AND position = %s"
+        ).format(sql.Identifier(relation))
+        offset = number % chunk_size
+        cursor.execute(query, [offset + 1, book_id, number - offset])
+    else:
+        query = sql.SQL(
+            "SELECT paragraph FROM {} WHERE book_id = %s ORDER BY id OFFSET %s LIMIT 1"
+        ).format(sql.Identifier(relation))
+        cursor.execute(query, [book_id, number])
+    row = cursor.fetchone()
+
+    return row[0] if row else None
@@ -0,0 +1,423 @@
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import struct
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+import requests
+import urllib3
+
+import metrics
+
+# number of bytes read from a cached file at a time
+CHUNK_SIZE = 64 * 1024
+# the charset parameter of the Content-Type header
+CHARSET_PATTERN = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+# the transfer encodings decompress() takes, asked for in every request
+ACCEPT_ENCODING = "gzip, deflate"
+# zlib's window bits of the gzip and the deflate transfer encodings
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+# the fixed part of a zip's local file header: signature, version,
+# flags, method, time, date, crc, sizes, name's and extra's lengths
+ZIP_HEADER = struct.Struct("<4s5H3L2H")
+# the errors of reading the content as it is received: a broken or a
+# timed out connection, a corrupt compression or archive
+CONTENT_ERRORS = (
+    urllib3.exceptions.HTTPError,
+    zlib.error,
+    zipfile.BadZipFile,
+    ValueError,
+)
+# the cache's directory, None to download the books without caching
+directory = None
+# ask for the books' .zip editions first, the .txt ones if there are none
+zipped = False
+# the keys answered 404 Not Found during the run
+not_found = set()
+
+
+def get_entry(cache_dir, key):
+    """
+    Reads the cache's index entry of the book
+
+    Parameters:
+    - cache_dir: str or Path: the cache's directory
+    - key: the book's number
+
+    Returns: dict: "url", "etag", "last_modified", "charset" and
+      "sha256" of the cached content or None if it is not cached
+    """
+
+    index = Path(cache_dir, "index", f"{key}.json")
+    try:
+        entry = json.loads(index.read_text())
+    except (OSError, ValueError):
+        return None
+
+    # the content may have been removed by hand
+    if not get_object_path(cache_dir, entry["sha256"]).exists():
+        return None
+
+    return entry
+
+
+def get_object_path(cache_dir, digest):
+    """
+    Returns: Path: where the content with the sha256 digest is kept
+    """
+
+    return Path(cache_dir, "objects", digest[:2], digest)
+
+
+def get_headers(entry=None, url=None):
+    """
+    Returns: dict: the headers of the book's request: the compressed
+      transfer is accepted, and if the book was cached from the same url
+      the server is asked whether it has changed
+    """
+
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    if entry is not None and entry.get("url") == url:
+        headers.update(get_conditional_headers(entry))
+
+    return headers
+
+
+def get_conditional_headers(entry):
+    """
+    Returns: dict: the headers asking the server to answer
+      304 Not Modified if the cached content is still fresh
+    """
+
+    headers = dict()
+    if entry is None:
+        return headers
+
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    return headers
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields: bytes: the file's chunks
+    """
+
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def store_chunks(chunks, cache_dir, key, url, headers, charset):
+    """
+    Passes the chunks through while writing them into the cache;
+      the content is kept under its sha256 digest and the index
+      entry of the key points to it. Nothing is cached if the
+      chunks are not read to the end
+
+    Parameters:
+    - chunks: iterable of bytes: the response's content
+    - cache_dir: str or Path: the cache's directory
+    - key: the book's number
+    - url: str: the book's link
+    - headers: dict: the response's headers
+    - charset: str: the charset the server declared or None
+
+    Yields: bytes: the same chunks
+    """
+
+    objects = Path(cache_dir, "objects")
+    objects.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+
+    handle, temp_name = tempfile.mkstemp(dir=objects, suffix=".part")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            for chunk in chunks:
+                digest.update(chunk)
+                file.write(chunk)
+                yield chunk
+
+        sha256 = digest.hexdigest()
+        path = get_object_path(cache_dir, sha256)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(temp_name, path)
+
+        entry = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "charset": charset,
+            "sha256": sha256,
+        }
+        index = Path(cache_dir, "index")
+        index.mkdir(exist_ok=True)
+        Path(index, f"{key}.json").write_text(json.dumps(entry))
+
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+
+
+def store(content, key, url, headers, charset):
+    """
+    Writes the whole content into the cache, see store_chunks()
+    """
+
+    if directory is None or key is None:
+        return
+
+    for chunk in store_chunks([content], directory, key, url, headers, charset):
+        pass
+
+
+def count_bytes(chunks, event="bytes_downloaded"):
+    """
+    Yields: bytes: the chunks counting them as downloaded
+      (or as the event given, e.g. "bytes_wire")
+    """
+
+    for chunk in chunks:
+        metrics.count(event, len(chunk))
+        yield chunk
+
+
+def check_content(chunks, url):
+    """
+    Passes the chunks of the response's content through; an error of
+      reading them is raised as requests.RequestException, so the
+      callers handle it as any failed request
+
+    Yields: bytes: the same chunks
+    """
+
+    try:
+        yield from chunks
+    except CONTENT_ERRORS as e:
+        metrics.count("http_errors")
+        raise requests.RequestException(f"Could not read {url}: {e!r}") from e
+
+
+def get_zip_url(url):
+    """
+    Returns: str: the link of the book's .zip edition, pg1.txt is
+      pg1.zip, or None if the link is not of a .txt file
+    """
+
+    if not url.endswith(".txt"):
+        return None
+
+    return url[: -len(".txt")] + ".zip"
+
+
+def decompress(chunks, content_encoding=None):
+    """
+    Decompresses the chunks of the response by its Content-Encoding
+      as they are received, the identity encoding is passed through
+
+    Yields: bytes: the decompressed chunks
+    """
+
+    content_encoding = (content_encoding or "identity").strip().lower()
+    if content_encoding == "identity":
+        yield from chunks
+        return
+    if content_encoding not in WBITS:
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+    decompressor = zlib.decompressobj(WBITS[content_encoding])
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def unzip(chunks):
+    """
+    Extracts the book from the chunks of a .zip edition as they are
+      received: its first file is read by its local header, so the
+      central directory at the end is not waited for. An archive
+      that cannot be read so (a stored file of an unknown size,
+      a directory first) is read whole with zipfile
+
+    Yields: bytes: the chunks of the book's text
+    """
+
+    chunks = iter(chunks)
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < ZIP_HEADER.size:
+            continue
+        fields = ZIP_HEADER.unpack_from(buffer)
+        start = ZIP_HEADER.size + fields[9] + fields[10]
+        if len(buffer) >= start:
+            break
+    else:
+        fields = None
+
+    if fields is None or fields[0] != b"PK\x03\x04":
+        raise zipfile.BadZipFile("Not a zip archive")
+
+    flags, method, size = fields[2], fields[3], fields[7]
+    name = buffer[ZIP_HEADER.size : ZIP_HEADER.size + fields[9]]
+    # bit 3: the sizes follow the data; size of 2**32 - 1: zip64
+    streamable = method == zipfile.ZIP_DEFLATED or (
+        method == zipfile.ZIP_STORED and not flags & 0x08 and size != 0xFFFFFFFF
+    )
+    if not streamable or name.endswith(b"/"):
+        yield read_zip(buffer + b"".join(chunks))
+        return
+
+    data = buffer[start:]
+    if method == zipfile.ZIP_STORED:
+        for chunk in itertools.chain([data], chunks):
+            chunk = chunk[:size]
+            size -= len(chunk)
+            if chunk:
+                yield chunk
+            if not size:
+                return
+        raise zipfile.BadZipFile("The zip archive is truncated")
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in itertools.chain([data], chunks):
+        text = decompressor.decompress(chunk)
+        if text:
+            yield text
+        if decompressor.eof:
+            return
+    raise zipfile.BadZipFile("The zip archive is truncated")
+
+
+def read_zip(content):
+    """
+    Returns: bytes: the first .txt file of the zip archive
+      (the first file if there is no .txt one)
+    """
+
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        if not names:
+            raise zipfile.BadZipFile("The zip archive is empty")
+        texts = [name for name in names if name.lower().endswith(".txt")]
+        return archive.read((texts or names)[0])
+
+
+def fetch(url, key=None, chunk_size=CHUNK_SIZE, verbose=False):
+    """
+    Requests the book once; with `zipped` its .zip edition is asked
+      for first and the url itself only if the server has none.
+      See fetch_url()
+
+    Parameters:
+    - url: str: the book's link
+    - key: the book's number, the cache's key; None for no cache
+    - chunk_size: int: number of bytes read at a time
+    - verbose: bool: print progress statements, default False
+
+    Returns: tuple: iterator of the text's chunks and the charset
+      the server declared or None, see helpers.detect_encoding();
+      raises requests.HTTPError if the url is not okay
+    """
+
+    zip_url = get_zip_url(url) if zipped else None
+    if zip_url:
+        try:
+            return fetch_url(zip_url, key, chunk_size, verbose, archive=True)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            if verbose:
+                print(f"No zip edition at {zip_url}")
+
+    return fetch_url(url, key, chunk_size, verbose)
+
+
+def fetch_url(url, key=None, chunk_size=CHUNK_SIZE, verbose=False, archive=False):
+    """
+    Requests the url once, checking the status before the content
+      is read. The content is taken compressed if the server can
+      (see ACCEPT_ENCODING) and decompressed while it is read; the
+      bytes received are counted as "bytes_wire", the decompressed
+      ones as "bytes_downloaded". If the book is in the cache (see
+      `directory`), the request is conditional and 304 Not Modified
+      is answered from the cache. An error of reading the content is
+      raised as requests.RequestException while it is read, see
+      check_content()
+
+    Parameters:
+    - url: str: the link
+    - key: the book's number, the cache's key; None for no cache
+    - chunk_size: int: number of bytes read at a time
+    - verbose: bool: print progress statements, default False
+    - archive: bool: the url is a .zip edition, its text is extracted
+
+    Returns: tuple: iterator of the text's chunks and the charset
+      the server declared or None; raises requests.HTTPError
+      if the url is not okay
+    """
+
+    cache_dir = directory
+    cached = cache_dir is not None and key is not None
+    entry = get_entry(cache_dir, key) if cached else None
+
+    r = requests.get(
+        url,
+        allow_redirects=True,
+        stream=True,
+        headers=get_headers(entry, url),
+    )
+
+    if r.status_code == 304 and entry:
+        r.close()
+        metrics.count("http_not_modified")
+        if verbose:
+            print(f"Not modified, {url} is taken from the cache")
+        path = get_object_path(cache_dir, entry["sha256"])
+        # the entries of the older versions keep requests' "encoding"
+        return read_chunks(path, chunk_size), entry.get("charset")
+
+    if r.status_code != 200:
+        r.close()
+        # a missing .zip edition is not an error, the .txt one is asked for
+        if not (archive and r.status_code == 404):
+            metrics.count("http_errors")
+        if r.status_code == 404 and key is not None and not archive:
+            not_found.add(key)
+        r.raise_for_status()
+        raise requests.HTTPError(f"{r.status_code} for url: {url}", response=r)
+
+    # r.encoding would be ISO-8859-1 for any text without a charset
+    charset = get_charset(r.headers)
+    chunks = count_bytes(r.raw.stream(chunk_size, decode_content=False), "bytes_wire")
+    chunks = decompress(chunks, r.headers.get("Content-Encoding"))
+    if archive:
+        chunks = unzip(chunks)
+    chunks = count_bytes(check_content(chunks, url))
+    if cached:
+        chunks = store_chunks(chunks, cache_dir, key, url, r.headers, charset)
+
+    return chunks, charset
+
+
+def get_charset(headers):
+    """
+    Returns: str: the charset of the Content-Type header or None
+    """
+
+    match = CHARSET_PATTERN.search(headers.get("Content-Type", ""))
+
+    return match.group(1) if match else None
@@ -0,0 +1,195 @@
+import random
+from collections import OrderedDict
+
+from psycopg import sql
+
+import helpers
+
+# name -> id caches of the small relations (author, role, language)
+caches = dict()
+# maximum number of names cached for a relation, the least recently
+# used ones are evicted; the relations not listed are not limited
+limits = {"author": 10_000}
+# hits and misses of every relation's cache
+counters = dict()
+# Gutenberg's ebook ids of the books in the database and of the ones
+# the server answered 404 Not Found, no request is sent for them
+loaded_ids = set()
+missing_ids = set()
+# ebook ids of the books whose general info is loaded from the catalog
+# and whose paragraphs are not, see catalog.load_catalog()
+catalog_ids = set()
+
+
+def preload(relation, attribute, cursor, verbose=False):
+    """
+    Fills the relation's cache with the names from the database
+      (no more than the relation's limit)
+
+    Parameters:
+    - relation: str: name of the relation
+    - attribute: str: name of the unique attribute, e.g. "name"
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of names cached
+    """
+
+    cache = caches.setdefault(relation, OrderedDict())
+    counters.setdefault(relation, {"hits": 0, "misses": 0})
+    cache.clear()
+
+    query = helpers.names_query(relation, attribute, limits.get(relation))
+    cursor.execute(query)
+    # the newest names come first, they are the last to be evicted
+    for name, id in reversed(cursor.fetchall()):
+        cache[name] = id
+
+    if verbose:
+        print(f"{len(cache)} names of {relation} cached")
+
+    return len(cache)
+
+
+def cached(relation, value):
+    """
+    Looks the value up in the relation's cache
+
+    Returns: int: the id or None if the value is not cached
+    """
+
+    cache = caches.setdefault(relation, OrderedDict())
+    counter = counters.setdefault(relation, {"hits": 0, "misses": 0})
+
+    id = cache.get(value)
+    if id is None:
+        counter["misses"] += 1
+        return None
+
+    counter["hits"] += 1
+    cache.move_to_end(value)
+
+    return id
+
+
+def remember(relation, value, id):
+    """
+    Puts the value's id into the relation's cache evicting
+      the least recently used names over the limit
+    """
+
+    cache = caches.setdefault(relation, OrderedDict())
+    cache[value] = id
+    cache.move_to_end(value)
+
+    limit = limits.get(relation)
+    while limit is not None and len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def get_id(relation, attribute, value, connection, cursor):
+    """
+    Gets the id of the value from the cache; a miss costs one
+      INSERT ... ON CONFLICT ... RETURNING id round trip
+
+    Parameters:
+    - relation: str: name of the relation
+    - attribute: str: name of the unique attribute, e.g. "name"
+    - value: str: the value to look up
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+
+    Returns: int: id of the row
+    """
+
+    id = cached(relation, value)
+    if id is None:
+        id = helpers.upsert_name(relation, attribute, value, connection, cursor)
+        remember(relation, value, id)
+
+    return id
+
+
+def clear():
+    """
+    Empties the caches, e.g. when a transaction which could insert
+      the cached names is rolled back; the counters are kept
+    """
+
+    for cache in caches.values():
+        cache.clear()
+
+
+def preload_ebook_ids(book_relation, missing_relation, cursor, verbose=False):
+    """
+    Fills the sets of the ebook ids loaded, missing and pending
+      (from the catalog) with the ids from the database
+
+    Returns: int: number of ids known
+    """
+
+    for ids, relation, condition in (
+        (loaded_ids, book_relation, "NOT text_pending"),
+        (catalog_ids, book_relation, "text_pending"),
+        (missing_ids, missing_relation, "TRUE"),
+    ):
+        query = sql.SQL("SELECT ebook_id FROM {} WHERE ebook_id IS NOT NULL AND {};")
+        cursor.execute(query.format(sql.Identifier(relation), sql.SQL(condition)))
+        ids.clear()
+        ids.update(id for id, in cursor.fetchall())
+
+    if verbose:
+        print(
+            f"{len(loaded_ids)} ebook ids loaded, {len(missing_ids)} missing, "
+            f"{len(catalog_ids)} from the catalog"
+        )
+
+    return len(loaded_ids) + len(missing_ids)
+
+
+def mark_loaded(ebook_id):
+    """
+    Marks the book loaded once its transaction is committed: it is
+      not requested again and is not pending in the catalog any more
+    """
+
+    if ebook_id is None:
+        return
+
+    catalog_ids.discard(ebook_id)
+    loaded_ids.add(ebook_id)
+
+
+def is_known(ebook_id):
+    """
+    Returns: bool: True if the book is loaded or missing
+    """
+
+    return ebook_id in loaded_ids or ebook_id in missing_ids
+
+
+def sample_ebook_ids(n, last_id):
+    """
+    Picks the ebook ids without replacement skipping the known ones
+
+    Parameters:
+    - n: int: number of ids
+    - last_id: int: the ids are picked from 1 to last_id
+
+    Returns: list of int: no more than n ids
+    """
+
+    ids = [id for id in range(1, last_id + 1) if not is_known(id)]
+
+    return random.sample(ids, min(n, len(ids)))
+
+
+def stats():
+    """
+    Returns: dict: relation -> its cache's size, hits and misses
+    """
+
+    return {
+        relation: {"size": len(caches.get(relation, ())), **counter}
+        for relation, counter in counters.items()
+    }
@@ -1,20 +1,45 @@
+import asyncio
+import atexit
+import contextlib
+import cProfile
+import itertools
+import pstats
+import queue
 import random
-import re
 import sys
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 import psycopg
 import requests
-from psycopg import sql
 
+import catalog
 import helpers
+import http_cache
 import info
+import lookup
+import metrics
+import mirror
+import reader
 import schemata
+import search
+import statements
+
+try:
+    # aiohttp is needed to parse the books at once only
+    import async_helpers
+except ImportError:
+    async_helpers = None
 
 # complete dictionary of relations' schemata
 relations = schemata.relations
+# where the books are downloaded from, {0} is the book's number
+URL = "http://www.gutenberg.org/cache/epub/{0}/pg{0}.txt"
+# the books' numbers are picked from 1 to LAST_EBOOK_ID
+LAST_EBOOK_ID = 73_081
 
 
 def main():
@@ -24,7 +49,58 @@ def main():
     verbose = False
     # start the database over
     clear_database = False
-    no_warning = False
+    # load paragraphs with COPY
+    bulk = False
+    # parse books straight from the http response
+    stream = False
+    # number of books parsed at once, 0 to parse them one by one
+    concurrency = 0
+    # number of connections to the same host and seconds between
+    # the requests to it when the books are parsed at once
+    per_host = 4
+    delay = 1
+    url = URL
+    # number of the parsing processes, 0 to parse in this process
+    workers = 0
+    queue_size = 0
+    # size of the pool of connections; the maximum is the
+    # concurrency when the books are parsed at once
+    pool_min = 1
+    pool_max = 0
+    # load every book in a transaction, `batch` books are committed at once
+    transactions = False
+    batch = 1
+    # read the books from a local mirror instead of downloading them,
+    # only parse them without the database
+    mirror_path = None
+    parse_only = False
+    # dump the metrics and the profile into the files at exit
+    metrics_path = None
+    profile_path = None
+    # build the full-text search index after the load; search the
+    # paragraphs of the books in the language instead of loading
+    search_index = False
+    search_query = None
+    language = "English"
+    # keep a row per paragraph or chunks of paragraphs, see schemata.layouts
+    layout = "paragraph"
+    # load the paragraphs into an UNLOGGED relation, merge them at the end
+    staging = False
+    # split the paragraphs' relation into hash partitions by book
+    partitions = 0
+    # download the books' .zip editions, the .txt ones if there are none
+    zipped = False
+    # the book to delete instead of loading
+    delete_id = None
+    # the book to read (or export) instead of loading, its first paragraph
+    book_id = None
+    start_paragraph = 0
+    # export the paragraphs into the file instead of loading
+    export_path = None
+    # load the general info of the books from the Gutenberg's catalog
+    catalog_path = None
+    # reload the loaded books whose content has changed instead of loading
+    refresh = False
 
     args = sys.argv
     if len(args) > 1:
@@ -39,99 +115,653 @@ def main():
             )
             return 1
         args = sys.argv[2:]
-        if len(args) < 4:
-            if "-V" in args:
-                verbose = True
-                args.remove("-V")
-            if "-C" in args:
-                clear_database = True
-                args.remove("-C")
-            if "-NW" in args:
-                no_warning = True
-                args.remove("-NW")
-            if args:
-                print_usage()
-                return 1
-        else:
+        try:
+            concurrency = int(pop_option(args, "--concurrency", 0))
+            per_host = int(pop_option(args, "--per-host", 4))
+            delay = float(pop_option(args, "--delay", 1))
+            url = pop_option(args, "--url", URL)
+            workers = int(pop_option(args, "--workers", 0))
+            queue_size = int(pop_option(args, "--queue-size", 0))
+            pool_min = int(pop_option(args, "--pool-min", 1))
+            pool_max = int(pop_option(args, "--pool-max", 0))
+            batch = int(pop_option(args, "--batch", 1))
+            http_cache.directory = pop_option(args, "--cache")
+            mirror_path = pop_option(args, "--mirror")
+            metrics_path = pop_option(args, "--metrics")
+            profile_path = pop_option(args, "--profile")
+            search_query = pop_option(args, "--search")
+            language = pop_option(args, "--language", "English")
+            layout = pop_option(args, "--layout", "paragraph")
+            partitions = int(pop_option(args, "--partitions", 0))
+            delete_id = pop_option(args, "--delete")
+            book_id = pop_option(args, "--book")
+            start_paragraph = int(pop_option(args, "--from", 0))
+            export_path = pop_option(args, "--export")
+            catalog_path = pop_option(args, "--catalog")
+        except (IndexError, ValueError):
             print_usage()
             return 1
-
-    if not no_warning:
-        if warning_message():
+        if "-V" in args:
+            verbose = True
+            args.remove("-V")
+        if "-C" in args:
+            clear_database = True
+            args.remove("-C")
+        if "-NW" in args:
+            # every value is sent as a parameter of a prepared statement,
+            # there is no warning to skip; kept for the old command lines
+            args.remove("-NW")
+        if "-B" in args:
+            bulk = True
+            args.remove("-B")
+        if "-S" in args:
+            stream = True
+            args.remove("-S")
+        if "-T" in args:
+            transactions = True
+            args.remove("-T")
+        if "--parse-only" in args:
+            parse_only = True
+            args.remove("--parse-only")
+        if "--search-index" in args:
+            search_index = True
+            args.remove("--search-index")
+        if "--staging" in args:
+            staging = True
+            args.remove("--staging")
+        if "--zip" in args:
+            zipped = True
+            args.remove("--zip")
+        if "--refresh" in args:
+            refresh = True
+            args.remove("--refresh")
+        if args:
+            print_usage()
             return 1
 
+    if parse_only and not mirror_path:
+        print("--parse-only needs --mirror")
+        return 1
+    if mirror_path and not Path(mirror_path).exists():
+        print(f"There is no mirror {mirror_path}")
+        return 1
+    if layout not in schemata.layouts:
+        print(f"--layout is one of {', '.join(schemata.layouts)}")
+        return 1
+    if search_index and layout != "paragraph":
+        print("--search-index needs the paragraph layout")
+        return 1
+    relations = schemata.get_relations(layout, partitions)
+    http_cache.zipped = zipped
+    # the relations the books are loaded into
+    load_relations = schemata.get_staging(relations) if staging else relations
+    staging_rel = list(load_relations)[4]
+
+    profiler = None
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(report, metrics_path, profiler, profile_path, verbose)
+
+    if search_query:
+        # the number of links is the number of paragraphs found
+        return search_paragraphs(search_query, language, n, relations)
+
+    if delete_id:
+        return delete_book(int(delete_id), relations, verbose)
+
+    if export_path:
+        ebook_id = int(book_id) if book_id else None
+        return export_paragraphs(export_path, ebook_id, relations, verbose)
+
+    if book_id:
+        # the number of links is the number of paragraphs read
+        return read_book(int(book_id), start_paragraph, n, relations)
+
+    if parse_only:
+        # no database at all: the parse stage alone
+        parse_mirror(mirror_path, n, relations, None, verbose, parse_only=True)
+        return 0
+
     print("Поехали!")
+    # the statements of every relation are composed once
+    statements.prepare(relations | load_relations, verbose)
 
-    # connect to database
-    with psycopg.connect(
-        f"""
-            host={info.host}
-            port={info.port}
-            dbname={info.dbname}
-            user={info.user}
-            password={info.pwd}
-         """,
-        autocommit=True,
-    ) as conn:
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    # open the pool of connections to database
+    with helpers.get_pool(get_conninfo(), pool_min, pool_max or 4) as pool:
         if verbose:
-            print(f"Connection with database {info.dbname} established")
-
-        # create a cursor
-        with conn.cursor() as cur:
-            if verbose:
-                print("Cursor created")
+            print(f"Pool of connections with database {info.dbname} opened")
 
+        with pool.connection() as conn, conn.cursor() as cur:
             # drop tables if True
             if clear_database:
                 helpers.drop_tables(conn, cur, verbose)
             # create tables
-            helpers.create_tables(relations, conn, cur, verbose)
-
-            # parse data into tables
-            for i in range(n):
-                if n > 1 and i > 0:
-                    go_sleep = random.randint(1, 7)
-                    if verbose:
-                        print(f"Sleep for {go_sleep} sec")
-                    time.sleep(go_sleep)
-                rand = random.randint(1, 73_081)
-                url = f"http://www.gutenberg.org/cache/epub/{rand}/pg{rand}.txt"
-                print("Checking the url:", url)
-                # check url
-                if helpers.url_check(url):
-                    continue
-
-                if parse_book(url, relations, conn, cur, verbose):
-                    continue
+            helpers.create_tables(
+                schemata.get_stores(layout) | relations, conn, cur, verbose
+            )
+            if staging:
+                staging_relations = {staging_rel: load_relations[staging_rel]}
+                helpers.create_tables(staging_relations, conn, cur, verbose, True)
+            # the paragraphs staged by an interrupted run are merged first
+            merge_staging(relations, conn, cur, verbose)
+            # cache the names of the small relations
+            for relation in (author_rel, role_rel, language_rel):
+                lookup.preload(relation, relations[relation][1][0], cur, verbose)
+            if catalog_path:
+                catalog.load_catalog(catalog_path, relations, conn, cur, verbose)
+            # the books loaded or missing are never requested again
+            lookup.preload_ebook_ids(book_rel, missing_rel, cur, verbose)
+
+        start = time.perf_counter()
+
+        # the books' numbers are picked without replacement
+        books = list()
+        if not mirror_path and not refresh:
+            books = lookup.sample_ebook_ids(n, LAST_EBOOK_ID)
+            if len(books) < n:
+                print(f"Only {len(books)} books are neither loaded nor missing")
+
+        # parse data into tables
+        if refresh:
+            refresh_books(n, url, mirror_path, relations, pool, verbose, delay)
+        elif mirror_path and workers:
+            parse_books_pipeline(
+                mirror.read_books(mirror_path, n, verbose, lookup.loaded_ids),
+                load_relations,
+                pool,
+                workers,
+                queue_size,
+                verbose,
+                transactions,
+            )
+        elif mirror_path:
+            parse_mirror(mirror_path, n, load_relations, pool, verbose, transactions)
+        elif concurrency:
+            asyncio.run(
+                parse_books_async(
+                    books,
+                    url,
+                    load_relations,
+                    concurrency,
+                    per_host,
+                    delay,
+                    verbose,
+                    pool_min,
+                    pool_max or concurrency,
+                    transactions,
+                )
+            )
+        elif workers:
+            parse_books_pipeline(
+                download_books(books, url, verbose, delay),
+                load_relations,
+                pool,
+                workers,
+                queue_size,
+                verbose,
+                transactions,
+            )
+
+        else:
+            parse_books(
+                books,
+                url,
+                load_relations,
+                pool,
+                verbose,
+                bulk,
+                stream,
+                transactions,
+                batch,
+            )
+
+        if staging:
+            with pool.connection() as conn, conn.cursor() as cur:
+                merge_staging(relations, conn, cur, verbose)
+
+        # remember the books the server does not have
+        save_missing(missing_rel, relations, pool, verbose)
+
+        if search_index:
+            with pool.connection() as conn, conn.cursor() as cur:
+                search.build_index(text_rel, book_rel, language_rel, conn, cur, verbose)
+
+        helpers.print_pool_stats(pool, time.perf_counter() - start)
+        helpers.print_transfer_stats(time.perf_counter() - start)
+        helpers.print_dedup_stats()
 
         if verbose:
-            print("Cursor terminated")
+            for relation, stats in lookup.stats().items():
+                print(
+                    f"Cache of {relation}: {stats['size']} names, "
+                    f"{stats['hits']} hits, {stats['misses']} misses"
+                )
 
     if verbose:
-        print("Connection closed")
+        print("Pool closed")
         print("Пролетарии всех стран, соединяйтесь!")
 
 
-def parse_book(url, relations, connection, cursor, verbose=False):
+def parse_books(
+    books,
+    url,
+    relations,
+    pool,
+    verbose=False,
+    bulk=False,
+    stream=False,
+    transactions=False,
+    batch=1,
+):
+    """
+    Parses the books one by one. With transactions every book
+      is loaded in its own transaction (a savepoint within a batch
+      of `batch` books) and is visible only when it is loaded
+      completely; a failed book is rolled back alone. The books
+      loaded in a transaction are downloaded before it is opened,
+      see fetch_book(), so it holds its locks for the database work
+      only, never for a request or for the sleep between them
+
+    Parameters:
+    - books: list of int: the books' numbers
+    - url: str: link template, {0} is the book's number
+    - relations: dict: relations' schemata
+    - pool: psycopg_pool.ConnectionPool instance
+    - verbose: bool: print progress statements, default False
+    - bulk: bool: load the paragraphs with COPY, default False
+    - stream: bool: parse the books straight from the http response
+    - transactions: bool: load the books in transactions, default False
+    - batch: int: number of books committed at once, default 1
+
+    Returns: int: number of books loaded
+    """
+
+    loaded = 0
+    batch = batch if transactions else 1
+    n = len(books)
+
+    for i in range(0, n, batch):
+        # the books of the batch loaded in transactions are downloaded
+        # first, the url is checked with the download itself
+        fetched, summaries = dict(), dict()
+        for j in range(i, min(i + batch, n)):
+            if j > 0:
+                go_sleep = random.randint(1, 7)
+                if verbose:
+                    print(f"Sleep for {go_sleep} sec")
+                time.sleep(go_sleep)
+            book = books[j]
+            if transactions or book in lookup.catalog_ids:
+                with metrics.book(url.format(book)) as summaries[book]:
+                    fetched[book] = fetch_book(url.format(book), verbose, stream, book)
+
+        # every batch gets a checked connection from the pool,
+        # a broken one is replaced with a new one
+        # the books of the batch are marked loaded once it is committed
+        done = list()
+        try:
+            with pool.connection() as conn, conn.cursor() as cur:
+                with conn.transaction() if transactions else contextlib.nullcontext():
+                    for j in range(i, min(i + batch, n)):
+                        book = books[j]
+                        if book in fetched and fetched[book] is None:
+                            continue
+                        with metrics.book(url.format(book), summaries.get(book)):
+                            if not parse_book_in_transaction(
+                                url.format(book),
+                                relations,
+                                conn,
+                                cur,
+                                verbose,
+                                bulk,
+                                stream,
+                                transactions,
+                                book,
+                                fetched.get(book),
+                            ):
+                                done.append(book)
+
+        except psycopg.OperationalError as e:
+            lookup.clear()
+            print("Database error:", e)
+            # the batch is rolled back, the books loaded by themselves are not
+            if transactions:
+                done.clear()
+        finally:
+            # the files of the books a failed batch did not get to
+            for lines in fetched.values():
+                close_book(lines, verbose)
+            # the digests of the books skipped or failed are not kept
+            for book in books[i : i + batch]:
+                helpers.content_hashes.pop(book, None)
+
+        loaded += len(done)
+        for book in done:
+            lookup.mark_loaded(book)
+
+    return loaded
+
+
+def parse_book_in_transaction(
+    url,
+    relations,
+    connection,
+    cursor,
+    verbose,
+    bulk,
+    stream,
+    transactions,
+    key=None,
+    lines=None,
+):
+    """
+    Parses the book in its own transaction if `transactions`,
+      a database error rolls the book back. A book of the catalog
+      is always loaded in a transaction, so it is claimed (see
+      claim_book()) only if its paragraphs are loaded too. The book
+      loaded in a transaction is given downloaded, see fetch_book()
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    if not transactions and key not in lookup.catalog_ids:
+        return parse_book(
+            url, relations, connection, cursor, verbose, bulk, stream, False, key
+        )
+
+    try:
+        with connection.transaction():
+            return load_book(
+                lines, relations, connection, cursor, verbose, bulk, transactions, key
+            )
+
+    except psycopg.OperationalError:
+        raise
+    except psycopg.Error as e:
+        # the cache may keep the ids of the names rolled back
+        lookup.clear()
+        print("Database error, the book is rolled back:", e)
+        return 1
+
+
+def get_conninfo():
+    """
+    Returns: str: the database connection string out of info.py
+    """
+
+    return f"""
+            host={info.host}
+            port={info.port}
+            dbname={info.dbname}
+            user={info.user}
+            password={info.pwd}
+         """
+
+
+def parse_book(
+    url,
+    relations,
+    connection,
+    cursor,
+    verbose=False,
+    bulk=False,
+    stream=False,
+    transaction=False,
+    key=None,
+):
+    if stream:
+        return stream_book(
+            url, relations, connection, cursor, verbose, bulk, transaction, key
+        )
+
+    lines = fetch_book(url, verbose, False, key)
+    if lines is None:
+        return 1
+
+    return load_book(
+        lines, relations, connection, cursor, verbose, bulk, transaction, key
+    )
+
+
+def fetch_book(url, verbose=False, stream=False, key=None):
+    """
+    Downloads the book before it is loaded, so the transaction
+      loading it never waits for the network: the book is saved
+      into its file, with `stream` its lines are kept in memory
+
+    Returns: iterator of str: the book's lines, the open file or
+      the lines in memory, None if the book is not downloaded
+    """
+
+    if stream:
+        print(f"Streaming a file from {url}")
+        try:
+            return iter(list(helpers.stream_lines(url, verbose=verbose, key=key)))
+        except requests.RequestException as e:
+            print("Error:", e)
+            return None
+
     # download book and save it to txt file
     file_name = helpers.get_file_name(url)
     print(f"Downloading a file from {url}")
-    if helpers.get_txt(url, file_name, verbose):
-        return 1
+    encoding = helpers.get_txt(url, file_name, verbose, key)
+    if encoding is None:
+        return None
 
-    # try open the text
+    # try open the text, it is decoded incrementally while it is read
     try:
-        file_handler = open(file_name, "r")
+        file_handler = open(file_name, "r", encoding=encoding, errors=helpers.FALLBACK)
         if verbose:
             print(f"File {file_name} opened")
     except:
         Path.unlink(file_name)
         print("Could not open a file")
+        return None
+
+    return file_handler
+
+
+def load_book(
+    lines,
+    relations,
+    connection,
+    cursor,
+    verbose=False,
+    bulk=False,
+    transaction=False,
+    key=None,
+):
+    """
+    Loads the book downloaded by fetch_book(), see book_to_database();
+      its file is closed and removed then
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    head = helpers.read_head(lines)
+    try:
+        return book_to_database(
+            head,
+            itertools.chain(head, lines),
+            relations,
+            connection,
+            cursor,
+            verbose,
+            bulk,
+            transaction,
+            key,
+        )
+    finally:
+        close_book(lines, verbose)
+
+
+def close_book(lines, verbose=False):
+    """
+    Closes and removes the file of the book downloaded by fetch_book(),
+      the lines kept in memory are left as they are
+    """
+
+    if getattr(lines, "closed", True):
+        return
+
+    lines.close()
+    Path.unlink(lines.name)
+    if verbose:
+        print(f"File {lines.name} closed and removed")
+
+
+def stream_book(
+    url,
+    relations,
+    connection,
+    cursor,
+    verbose=False,
+    bulk=False,
+    transaction=False,
+    key=None,
+):
+    """
+    Parses the book straight from the http response: the lines
+      are read by chunks and only the book's technical info is
+      kept in memory to get the book's general info from it
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    print(f"Streaming a file from {url}")
+    try:
+        lines = helpers.stream_lines(url, verbose=verbose, key=key)
+        head = helpers.read_head(lines)
+        return book_to_database(
+            head,
+            itertools.chain(head, lines),
+            relations,
+            connection,
+            cursor,
+            verbose,
+            bulk,
+            transaction,
+            key,
+        )
+
+    except requests.RequestException as e:
+        print("Error:", e)
         return 1
 
+
+def book_to_database(
+    head,
+    lines,
+    relations,
+    connection,
+    cursor,
+    verbose=False,
+    bulk=False,
+    transaction=False,
+    ebook_id=None,
+):
+    """
+    Gets the book's general info from the technical info part
+      of the file and loads the book with its paragraphs into
+      the relations
+
+    Parameters:
+    - head: list of str: the book's technical info lines,
+      see helpers.read_head()
+    - lines: iterable of str: all the book's lines to parse the
+      paragraphs from, the head including
+    - relations: dict: relations' schemata
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+    - bulk: bool: load the paragraphs with COPY, default False
+    - transaction: bool: the book is loaded within a transaction,
+      the paragraphs are sent in the pipeline mode, default False
+    - ebook_id: int: the book's Gutenberg number, by default the one
+      in the technical info
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    ## Get the book's general info
+    # the book of the catalog has it in the database already
+    book_id = claim_book(ebook_id, relations, cursor)
+    title = f"#{ebook_id}"
+    if not book_id:
+        # read the technical info once: title, author, role, language
+        head_lines = iter(head)
+        header = helpers.get_header(head_lines)
+        # and the year below it
+        book_year = helpers.get_year(head_lines)
+
+        book_id = header_to_database(
+            header, book_year, relations, connection, cursor, verbose, ebook_id
+        )
+        if not book_id:
+            return 1
+        title = header.title
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+
+    # populate text table
+    chars, count, pcount = text_to_database(
+        text_rel,
+        text_attributes(relations[text_rel]),
+        book_id,
+        lines,
+        connection,
+        cursor,
+        verbose,
+        bulk,
+        transaction,
+        text_partition(text_rel, book_id, cursor),
+    )
+
+    # the rest of the book (its license) is read too, so the streamed
+    # book is hashed (and cached) whole
+    for line in lines:
+        pass
+    helpers.save_content_hash(book_rel, book_id, ebook_id, cursor)
+
+    print("Loaded {} paragraphs, {} lines, {} characters".format(pcount, count, chars))
+    count_book(title, pcount, chars)
+
+    return 0
+
+
+def header_to_database(
+    header, book_year, relations, connection, cursor, verbose=False, ebook_id=None
+):
+    """
+    Loads the book's general info into the relations: the author,
+      the role and the language are found or inserted, the book
+      is inserted if it is not in the database yet
+
+    Parameters:
+    - header: helpers.Header: the book's general info
+    - book_year: int: the book's published year
+    - relations: dict: relations' schemata
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+    - ebook_id: int: the book's Gutenberg number, by default the one
+      in the header
+
+    Returns: int: the book's id or 0 if the book is in the database
+    """
+
+    ebook_id = ebook_id or header.ebook_id
+    metrics.note(ebook_id=ebook_id)
+    if ebook_id in lookup.loaded_ids:
+        print(f"The book #{ebook_id} is already in the database")
+        metrics.count("books_skipped")
+        return 0
+
     ## Let's organize rels' variables and their future values
     # variables of the relations' names
-    author_rel, role_rel, language_rel, book_rel, text_rel = relations.keys()
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
     # dictionary of only attributes' names
     attributes_dict = dict()
     for relation, attributes in relations.items():
@@ -140,39 +770,14 @@ def parse_book(url, relations, connection, cursor, verbose=False):
     # dictionary of values we want to insert into relations
     values_dict = defaultdict(list)
 
-    ## Get the book's general info
-    # get the book's title
-    pattern = re.compile(r"Title: (.*)$")
-    book_title = helpers.get_string_match(pattern, file_handler)
-    # escape ' symbol if it is in the string
-    if book_title:
-        book_title = book_title.replace("'", "''")
-    # insert value into the values_dict
-    values_dict[book_rel].append(book_title)
+    # the values are sent as the statements' parameters as they are
+    book_title = header.title
+    book_author = header.author
+    book_role = header.role
+    book_language = header.language
 
-    # get the book's year
-    book_year = 10000
-    pattern = re.compile(r"\b(\d{4})\b")
-    # get the caret below the technical info
-    for line in file_handler:
-        if not line.startswith("***"):
-            continue
-        break
-    count = 0
-    for line in file_handler:
-        if count > 500:
-            break
-        if "***" in line:
-            book_year = 10_000
-            break
-        match = re.search(pattern, line)
-        if match:
-            file_handler.seek(0)
-            book_year = match.group(1)
-            break
-        count += 1
-    file_handler.seek(0)
-    # insert value into the values_dict
+    # insert values into the values_dict
+    values_dict[book_rel].append(book_title)
     values_dict[book_rel].append(book_year)
 
     # check if the book has already been parsed
@@ -185,26 +790,8 @@ def parse_book(url, relations, connection, cursor, verbose=False):
         verbose,
     ):
         print("The book is already in the database")
-        Path.unlink(file_name)
-        return 1
-
-    # get the book's author
-    pattern = re.compile(r"(Author|Creator|Compiler|Contributor): (.*)$")
-    book_role, book_author = helpers.get_string_match(
-        pattern, file_handler, group_number=[1, 2]
-    )
-    # escape ' symbol if it is in the string
-    if book_author:
-        book_author = book_author.replace("'", "''")
-    # insert value into the values_dict
-    values_dict[author_rel].append(book_author)
-    values_dict[role_rel].append(book_role)
-
-    # get the book's language
-    pattern = re.compile(r"Language: ([A-Za-z]+)")
-    book_language = helpers.get_string_match(pattern, file_handler)
-    # insert value into the values_dict
-    values_dict[language_rel].append(book_language)
+        metrics.count("books_skipped")
+        return 0
 
     # print book's general info
     if verbose:
@@ -214,179 +801,1032 @@ def parse_book(url, relations, connection, cursor, verbose=False):
         print("***")
 
     ## populate the relations
-    # populate the author relation
-    attrs = attributes_dict[author_rel][1:-1]
-    vals = values_dict[author_rel]
-    # if the author is in the database already
-    if helpers.row_exists(author_rel, attrs, vals, connection, cursor, verbose):
-        author_id = helpers.get_foreign_key(
-            author_rel, attrs[0], book_author, connection, cursor, verbose
-        )
-    else:
-        author_id = helpers.insert_into_table(
-            author_rel,
-            attributes_dict[author_rel][1:-1],
-            values_dict[author_rel],
-            connection,
-            cursor,
-        )
-
-    # populate the role relation
-    attrs = attributes_dict[role_rel][1:-1]
-    vals = values_dict[role_rel]
-    # if the role is in the database already
-    if helpers.row_exists(role_rel, attrs, vals, connection, cursor, verbose):
-        role_id = helpers.get_foreign_key(
-            role_rel, attrs[0], book_role, connection, cursor, verbose
-        )
-    else:
-        role_id = helpers.insert_into_table(
-            role_rel,
-            attributes_dict[role_rel][1:-1],
-            values_dict[role_rel],
-            connection,
-            cursor,
-        )
+    # the names are looked up in the cache, a miss is one upsert
+    name = attributes_dict[author_rel][1]
+    author_id = lookup.get_id(author_rel, name, book_author, connection, cursor)
+    name = attributes_dict[role_rel][1]
+    role_id = lookup.get_id(role_rel, name, book_role, connection, cursor)
+    name = attributes_dict[language_rel][1]
+    language_id = lookup.get_id(language_rel, name, book_language, connection, cursor)
 
-    # populate the language relation
-    attrs = attributes_dict[language_rel][1:-1]
-    vals = values_dict[language_rel]
-    # if the language is in the database already
-    if helpers.row_exists(language_rel, attrs, vals, connection, cursor, verbose):
-        language_id = helpers.get_foreign_key(
-            language_rel, attrs[0], book_language, connection, cursor, verbose
-        )
-    else:
-        language_id = helpers.insert_into_table(
-            language_rel,
-            attributes_dict[language_rel][1:-1],
-            values_dict[language_rel],
-            connection,
-            cursor,
-        )
     # add values to values_dict - check schema for order!
     values_dict[book_rel].append(author_id)
     values_dict[book_rel].append(role_id)
     values_dict[book_rel].append(language_id)
+    values_dict[book_rel].append(ebook_id)
+
+    # the book's paragraphs staged are merged later, see merge_staging()
+    attributes = attributes_dict[book_rel][1:7]
+    if schemata.is_staging(text_rel):
+        attributes = attributes + ["text_staged"]
+        values_dict[book_rel].append(True)
 
     # populate the book table
     book_id = helpers.insert_into_table(
         book_rel,
-        attributes_dict[book_rel][1:-2],
+        attributes,
         values_dict[book_rel],
         connection,
         cursor,
     )
 
-    # populate text table
-    # value "" represents paragraph
-    values_dict[text_rel] = ["", book_id]
-    chars, count, pcount = text_to_database(
-        text_rel,
-        attributes_dict[text_rel][1:-1],
-        values_dict[text_rel],
-        file_handler,
-        connection,
-        cursor,
-        verbose,
-    )
-
-    print("Loaded {} paragraphs, {} lines, {} characters".format(pcount, count, chars))
-
-    # close file
-    file_handler.close()
-    if verbose:
-        print(f"File {file_name} closed")
-
-    # remove the downloaded file
-    Path.unlink(file_name)
-    if verbose:
-        print(f"File {file_name} removed")
-
-    return 0
+    return book_id
 
 
-def text_to_database(
-    relation,
-    attributes,
-    values,
-    file_handler,
-    connection,
-    cursor,
+async def parse_books_async(
+    books,
+    url,
+    relations,
+    concurrency,
+    per_host,
+    delay=1,
     verbose=False,
+    pool_min=1,
+    pool_max=0,
+    transactions=False,
 ):
     """
-    Parses the paragraphs from the txt file,
-      creates the relation with the name of the book,
-      inserts the paragraphs to the database into the relation
+    Downloads and loads the books concurrently: `concurrency` tasks
+      take the books' numbers from a queue and a connection from
+      the pool for every book; the requests to the same host are
+      limited to `per_host` connections and `delay` seconds apart
 
     Parameters:
-    - relation: str: relation name
-    - attributes: str: list of attributes' names
-    - values: str: list of values to insert names
-    - file_handler: object
-    - connection: of of psycopg
-    - cursor: object of psycopg
+    - books: list of int: the books' numbers
+    - url: str: link template, {0} is the book's number
+    - relations: dict: relations' schemata
+    - concurrency: int: number of books parsed at once
+    - per_host: int: number of connections to the same host
+    - delay: float: seconds between the requests to the same host
     - verbose: bool: print progress statements, default False
+    - pool_min: int: connections kept open in the pool, default 1
+    - pool_max: int: connections in the pool at most, by default
+      the concurrency
+    - transactions: bool: load every book in a transaction
 
-    Returns:
-    - tuple: number of chars, of lines, of paragraphs
-
+    Returns: int: number of books loaded
     """
 
-    if verbose:
-        print(f'Started relation "{relation}" populating...')
+    if async_helpers is None:
+        print("Install aiohttp to parse the books at once")
+        return 0
 
-    paragraph = ""
-    chars, count, pcount = 0, 0, 0
+    queue = asyncio.Queue()
+    for book in books:
+        queue.put_nowait(book)
+    # hosts' politeness state shared between the tasks
+    hosts = dict()
+    start = time.perf_counter()
 
-    for line in file_handler:
-        count += 1
-        line = line.strip()
-        chars += len(line)
+    pool = async_helpers.get_pool(get_conninfo(), pool_min, pool_max or concurrency)
+    async with pool, async_helpers.get_session(concurrency, per_host) as session:
+        tasks = [
+            book_worker(
+                queue,
+                session,
+                url,
+                relations,
+                pool,
+                hosts,
+                delay,
+                verbose,
+                transactions,
+            )
+            for i in range(min(concurrency, len(books)))
+        ]
+        loaded = sum(await asyncio.gather(*tasks))
 
-        # insert paragraphs
-        # skip empty lines
-        if line == "" and paragraph == "":
-            continue
+        elapsed = time.perf_counter() - start
+        print(f"Loaded {loaded} of {len(books)} books in {elapsed:.1f} sec")
+        helpers.print_pool_stats(pool, elapsed, "Async pool")
 
-        # when paragraph done
-        elif line == "":
-            values[0] = paragraph
-            helpers.insert_into_table(relation, attributes, values, connection, cursor)
-            pcount += 1
+    return loaded
 
-            if pcount % 50 == 0:
-                connection.commit()
-            if pcount % 100 == 0:
-                if verbose:
-                    print(f"    {pcount} loaded...")
-                time.sleep(1)
 
-            paragraph = ""
-            continue
+async def book_worker(
+    queue,
+    session,
+    url,
+    relations,
+    pool,
+    hosts,
+    delay,
+    verbose=False,
+    transaction=False,
+):
+    """
+    Takes the books' numbers from the queue and parses them
+      one by one; every book gets a checked connection from the pool
+
+    Returns: int: number of books loaded
+    """
 
-        # populating paragraph
-        paragraph += " " + line
+    loaded = 0
 
-    connection.commit()
+    while not queue.empty():
+        book = queue.get_nowait()
+        try:
+            lines = await async_helpers.get_txt(
+                session, url.format(book), hosts, delay, verbose, book
+            )
+            if lines is None:
+                continue
+            async with pool.connection() as conn, conn.cursor() as cur:
+                if not await book_to_database_async(
+                    lines, relations, conn, cur, verbose, transaction, book
+                ):
+                    loaded += 1
 
-    return chars, count, pcount
+        except Exception as e:
+            print(f"Error in book {book}:", e)
+        finally:
+            # the digest of a book skipped or failed is not kept
+            helpers.content_hashes.pop(book, None)
 
+    return loaded
 
-def warning_message():
-    warning = input(
-        "You are about to launch the app with the vulnerable to SQL injection functionality. Provide only trusted files with the relations' schemas. Are you sure you want to continue? yes/no: "
-    ).lower()
 
-    if warning == "yes" or warning == "y":
-        return 0
-    elif warning == "no" or warning == "n":
-        print("Chicken!")
-        return 1
-    else:
-        print("Seems like you pressed the wrong button buddy. Try again")
-        return main()
+async def book_to_database_async(
+    lines,
+    relations,
+    connection,
+    cursor,
+    verbose=False,
+    transaction=False,
+    ebook_id=None,
+):
+    """
+    Gets the book's general info from the lines and loads the book
+      with its paragraphs into the relations over the async cursor;
+      the paragraphs are loaded with COPY
+
+    Parameters:
+    - lines: list of str: all the book's lines
+    - relations: dict: relations' schemata
+    - connection: psycopg.AsyncConnection instance
+    - cursor: psycopg.AsyncCursor instance
+    - verbose: bool: print progress statements, default False
+    - transaction: bool: load the book with its paragraphs in one
+      transaction; the names are committed before it, so the other
+      tasks never get the id of a name that is not committed
+    - ebook_id: int: the book's Gutenberg number, by default the one
+      in the technical info
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    attributes_dict = dict()
+    for relation, attributes in relations.items():
+        attributes_dict[relation] = [attr for attr, _ in attributes]
+
+    # the general info of a book of the catalog is in the database
+    from_catalog = ebook_id in lookup.catalog_ids
+    book_title = title = f"#{ebook_id}"
+    if not from_catalog:
+        # read the technical info once
+        head_lines = iter(lines)
+        header = helpers.get_header(head_lines)
+        book_year = helpers.get_year(head_lines)
+        ebook_id = ebook_id or header.ebook_id
+
+        # the values are sent as the statements' parameters as they are
+        book_title = header.title
+        book_author = header.author
+        title = header.title
+
+        # check if the book has already been parsed
+        if ebook_id in lookup.loaded_ids:
+            print(f"The book #{ebook_id} is already in the database")
+            return 1
+        if await async_helpers.row_exists(
+            book_rel, attributes_dict[book_rel][1:3], [book_title, book_year], cursor
+        ):
+            print(f'"{book_title}" is already in the database')
+            return 1
+
+        print(f'  {book_author} "{book_title}" in {header.language}, {book_year}')
+
+        # the names are looked up in the cache, a miss is one upsert
+        # (the tasks may insert the same name at once, hence upserts)
+        ids = list()
+        for relation, value in zip(
+            (author_rel, role_rel, language_rel),
+            (book_author, header.role, header.language),
+        ):
+            id = lookup.cached(relation, value)
+            if id is None:
+                name = attributes_dict[relation][1]
+                id = await async_helpers.upsert_name(relation, name, value, cursor)
+                lookup.remember(relation, value, id)
+            ids.append(id)
+        author_id, role_id, language_id = ids
+
+    # a book of the catalog is claimed with its paragraphs in a transaction
+    atomic = transaction or from_catalog
+    # the book's paragraphs staged are merged later, see merge_staging()
+    staged = schemata.is_staging(text_rel)
+    async with connection.transaction() if atomic else contextlib.nullcontext():
+        if from_catalog:
+            book_id = await async_helpers.claim_book(book_rel, ebook_id, cursor, staged)
+        else:
+            # populate the book table - check schema for order!
+            book_id = await async_helpers.insert_into_table(
+                book_rel,
+                attributes_dict[book_rel][1:7] + ["text_staged"],
+                [book_title, book_year, author_id, role_id, language_id, ebook_id]
+                + [staged],
+                cursor,
+            )
+        if not book_id:
+            print(f'"{book_title}" is already in the database')
+            return 1
+
+        # populate text table
+        counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+        paragraphs = helpers.get_paragraphs(lines, counts)
+        if schemata.is_deduplicated(text_rel):
+            paragraphs = await async_helpers.store_paragraphs(
+                schemata.STORE, paragraphs, cursor, schemata.HASH_SIZE
+            )
+        partition = text_rel
+        # the partitions were read from the catalog by create_tables()
+        partitions = helpers.moduli.get(text_rel, 0)
+        if partitions:
+            partition = await async_helpers.get_partition(
+                text_rel, partitions, book_id, cursor
+            )
+        await async_helpers.copy_into_table(
+            partition,
+            text_attributes(relations[text_rel]),
+            text_rows(text_rel, paragraphs, book_id),
+            cursor,
+        )
+        await async_helpers.save_content_hash(book_rel, book_id, ebook_id, cursor)
+    lookup.mark_loaded(ebook_id)
+
+    print(
+        f'Loaded "{book_title}": {counts["paragraphs"]} paragraphs, '
+        f'{counts["lines"]} lines, {counts["chars"]} characters'
+    )
+    count_book(title, counts["paragraphs"], counts["chars"])
+    if verbose:
+        print(f"    book id {book_id}")
+
+    return 0
+
+
+def download_books(books, url, verbose=False, delay=1):
+    """
+    Downloads the books one by one, the requests to the same host
+      are `delay` seconds apart
+
+    Parameters:
+    - books: iterable of int: the books' numbers
+    - url: str: link template, {0} is the book's number
+    - verbose: bool: print progress statements, default False
+    - delay: float: seconds between the requests to the same host
+
+    Yields: tuple: the book's link, its bytes, encoding and number
+    """
+
+    # host name -> the time of its last request
+    hosts = dict()
+    for book in books:
+        book_url = url.format(book)
+        helpers.wait_turn(book_url, hosts, delay)
+        print(f"Downloading a file from {book_url}")
+        result = helpers.get_content(book_url, verbose, book)
+        if result:
+            yield book_url, *result, book
+
+
+def parse_books_pipeline(
+    sources,
+    relations,
+    pool,
+    workers,
+    queue_size=0,
+    verbose=False,
+    transactions=False,
+):
+    """
+    Loads the books in three stages: a thread reads the raw books
+      from the sources, `workers` processes turn them into the
+      general info and paragraphs, this process writes them into
+      the database. The stages are connected with the queues of
+      `queue_size` books, so a fast stage waits for a slow one
+      instead of piling the books up in memory
+
+    Parameters:
+    - sources: iterable of tuples: the book's name, bytes, encoding
+      and Gutenberg number (or None), see download_books()
+    - relations: dict: relations' schemata
+    - pool: psycopg_pool.ConnectionPool instance
+    - workers: int: number of the parsing processes
+    - queue_size: int: number of books waiting between the stages,
+      by default twice the number of workers
+    - verbose: bool: print progress statements, default False
+    - transactions: bool: write every book in a transaction
+
+    Returns: int: number of books loaded
+    """
+
+    queue_size = queue_size or 2 * workers
+    raw_books = queue.Queue(maxsize=queue_size)
+    loaded, total = 0, 0
+    start = time.perf_counter()
+
+    # stage 1: read the raw books
+    reader_thread = threading.Thread(
+        target=read_sources, args=(sources, raw_books), daemon=True
+    )
+    reader_thread.start()
+
+    # stage 2: parse them in the worker processes
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsing = dict()
+        while True:
+            source = raw_books.get()
+            if source is None:
+                break
+            name, content, encoding, key = source
+            future = executor.submit(helpers.parse_content, content, encoding)
+            parsing[future] = name, key
+            total += 1
+
+            # stage 3: write the parsed books as they are ready
+            if len(parsing) >= queue_size:
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, key = parsing.pop(future)
+                    loaded += not future_to_database(
+                        name, future, relations, pool, verbose, transactions, key
+                    )
+
+        for future in list(parsing):
+            name, key = parsing.pop(future)
+            loaded += not future_to_database(
+                name, future, relations, pool, verbose, transactions, key
+            )
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {loaded} of {total} books in {elapsed:.1f} sec")
+
+    return loaded
+
+
+def read_sources(sources, raw_books):
+    """
+    Puts the raw books into the queue, None when they are over
+    """
+
+    try:
+        for source in sources:
+            # the digest of the book's bytes is saved with the book
+            helpers.hash_book(source[1], source[3])
+            raw_books.put(source)
+    finally:
+        raw_books.put(None)
+
+
+def future_to_database(
+    name, future, relations, pool, verbose=False, transaction=False, ebook_id=None
+):
+    """
+    Writes the book parsed in a worker process into the relations,
+      see parsed_to_database()
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    try:
+        parsed = future.result()
+    except Exception as e:
+        helpers.content_hashes.pop(ebook_id, None)
+        print(f"Could not parse {name}:", e)
+        return 1
+
+    return parsed_to_database(
+        name, parsed, relations, pool, verbose, transaction, ebook_id
+    )
+
+
+def parsed_to_database(
+    name, parsed, relations, pool, verbose=False, transaction=False, ebook_id=None
+):
+    """
+    Writes the book parsed by helpers.parse_content() into the
+      relations; the paragraphs are loaded with COPY, within one
+      transaction if `transaction`
+
+    Returns: int: 0 if the book is loaded
+    """
+
+    header, book_year, paragraphs, counts = parsed
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    attributes = text_attributes(relations[text_rel])
+
+    # a book of the catalog is claimed with its paragraphs in a transaction
+    atomic = transaction or ebook_id in lookup.catalog_ids
+    try:
+        with pool.connection() as connection, connection.cursor() as cursor:
+            with connection.transaction() if atomic else contextlib.nullcontext():
+                book_id = claim_book(ebook_id, relations, cursor) or header_to_database(
+                    header, book_year, relations, connection, cursor, verbose, ebook_id
+                )
+                if not book_id:
+                    return 1
+
+                paragraphs = store_paragraphs(text_rel, paragraphs, cursor)
+                rows = text_rows(text_rel, paragraphs, book_id)
+                partition = text_partition(text_rel, book_id, cursor)
+                helpers.copy_into_table(partition, attributes, rows, connection, cursor)
+                helpers.save_content_hash(book_rel, book_id, ebook_id, cursor)
+
+    except psycopg.Error as e:
+        lookup.clear()
+        print(f"Database error in {name}:", e)
+        return 1
+    finally:
+        # the digest of a book skipped or failed is not kept
+        helpers.content_hashes.pop(ebook_id, None)
+    lookup.mark_loaded(ebook_id or header.ebook_id)
+
+    print(
+        "Loaded {} paragraphs, {} lines, {} characters".format(
+            counts["paragraphs"], counts["lines"], counts["chars"]
+        )
+    )
+    count_book(header.title, counts["paragraphs"], counts["chars"])
+
+    return 0
+
+
+def parse_mirror(
+    path, n, relations, pool, verbose=False, transactions=False, parse_only=False
+):
+    """
+    Loads the books of a local mirror one by one without any network,
+      timing the parse and the load stages apart: a book is read into
+      memory, parsed with helpers.parse_content() and written with COPY
+
+    Parameters:
+    - path: str: the mirror, a directory of .txt and .zip files
+      or an archive, see mirror.iter_books()
+    - n: int: number of books loaded at most
+    - relations: dict: relations' schemata
+    - pool: psycopg_pool.ConnectionPool instance, None to parse only
+    - verbose: bool: print progress statements, default False
+    - transactions: bool: write every book in a transaction
+    - parse_only: bool: skip the load stage, default False
+
+    Returns: int: number of books loaded (parsed if `parse_only`)
+    """
+
+    books, size, loaded = 0, 0, 0
+    read_time, parse_time, load_time = 0.0, 0.0, 0.0
+
+    sources = mirror.read_books(path, n, verbose, lookup.loaded_ids)
+    while True:
+        start = time.perf_counter()
+        source = next(sources, None)
+        read_time += time.perf_counter() - start
+        if source is None:
+            break
+        name, content, encoding, ebook_id = source
+        books += 1
+        size += len(content)
+        metrics.count("bytes_read", len(content))
+
+        start = time.perf_counter()
+        try:
+            parsed = helpers.parse_content(content, encoding)
+        except Exception as e:
+            print(f"Could not parse {name}:", e)
+            continue
+        finally:
+            parse_time += time.perf_counter() - start
+
+        if parse_only:
+            loaded += 1
+            if verbose:
+                print(f"Parsed {name}: {parsed[3]['paragraphs']} paragraphs")
+            continue
+
+        start = time.perf_counter()
+        helpers.hash_book(content, ebook_id)
+        with metrics.book(name):
+            loaded += not parsed_to_database(
+                name, parsed, relations, pool, verbose, transactions, ebook_id
+            )
+        load_time += time.perf_counter() - start
+
+    megabytes = size / 2**20
+    print(f"Read {books} books, {megabytes:.1f} MB in {read_time:.2f} sec")
+    print(
+        f"Parsed in {parse_time:.2f} sec: "
+        f"{books / (parse_time or 1):.1f} books/sec, "
+        f"{megabytes / (parse_time or 1):.1f} MB/sec"
+    )
+    if not parse_only:
+        print(
+            f"Loaded {loaded} books in {load_time:.2f} sec: "
+            f"{loaded / (load_time or 1):.1f} books/sec"
+        )
+
+    return loaded
+
+
+def refresh_books(n, url, mirror_path, relations, pool, verbose=False, delay=1):
+    """
+    Checks whether the loaded books have changed: every book is read
+      again (from the mirror or with a request of its url, conditional
+      if it is in the http cache, so an unchanged book is read from
+      the cache) and hashed, the books whose digests differ from the
+      ones saved with them are reloaded, see reload_book(). A book
+      loaded without a digest gets it saved and is not reloaded
+
+    Parameters:
+    - n: int: number of books checked at most, the ones checked
+      longest ago
+    - url: str: link template, {0} is the book's number
+    - mirror_path: str: the mirror the books are read from, None
+      to download them
+    - relations: dict: relations' schemata
+    - pool: psycopg_pool.ConnectionPool instance
+    - verbose: bool: print progress statements, default False
+    - delay: float: seconds between the requests to the same host
+
+    Returns: int: number of books reloaded
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    with pool.connection() as conn, conn.cursor() as cur:
+        books = helpers.get_content_hashes(book_rel, cur, None if mirror_path else n)
+
+    if mirror_path:
+        sources = mirror.read_books(mirror_path, n, verbose, only=books)
+    else:
+        sources = download_books(books, url, verbose, delay)
+
+    checked, unchanged, reloaded, hashed = 0, 0, 0, 0
+    # the books asked for are checked, the ones not downloaded too
+    asked = set() if mirror_path else set(books)
+    start = time.perf_counter()
+    for name, content, encoding, ebook_id in sources:
+        checked += 1
+        asked.add(ebook_id)
+        book_id, saved = books[ebook_id]
+        digest = helpers.hash_book(content, ebook_id)[0]
+        if saved is None:
+            with pool.connection() as conn, conn.cursor() as cur:
+                hashed += helpers.save_content_hash(book_rel, book_id, ebook_id, cur)
+        elif bytes(saved) == digest:
+            metrics.count("books_unchanged")
+            unchanged += 1
+            if verbose:
+                print(f"The book #{ebook_id} has not changed")
+        else:
+            with metrics.book(name):
+                reloaded += not reload_book(
+                    name, content, encoding, book_id, ebook_id, relations, pool, verbose
+                )
+        # the digest of a book not reloaded is not kept either
+        helpers.content_hashes.pop(ebook_id, None)
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        helpers.save_content_checked(book_rel, [books[id][0] for id in asked], cur)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Checked {checked} books in {elapsed:.1f} sec: {unchanged} unchanged, "
+        f"{reloaded} changed and reloaded, {hashed} hashed for the first time"
+    )
+
+    return reloaded
+
+
+def reload_book(
+    name, content, encoding, book_id, ebook_id, relations, pool, verbose=False
+):
+    """
+    Replaces the book's paragraphs with the ones of its new content in
+      one transaction: the old paragraphs are deleted, the new ones
+      are loaded with COPY and the new digest is saved, so the book is
+      never seen half replaced and a failed one keeps its old paragraphs.
+      The book's general info is kept
+
+    Returns: int: 0 if the book is reloaded
+    """
+
+    try:
+        header, book_year, paragraphs, counts = helpers.parse_content(content, encoding)
+    except Exception as e:
+        print(f"Could not parse {name}:", e)
+        return 1
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    attributes = text_attributes(relations[text_rel])
+
+    try:
+        with pool.connection() as connection, connection.cursor() as cursor:
+            with connection.transaction():
+                partition = text_partition(text_rel, book_id, cursor)
+                deleted = helpers.delete_paragraphs(partition, book_id, cursor)
+                paragraphs = store_paragraphs(text_rel, paragraphs, cursor)
+                rows = text_rows(text_rel, paragraphs, book_id)
+                helpers.copy_into_table(partition, attributes, rows, connection, cursor)
+                helpers.save_content_hash(book_rel, book_id, ebook_id, cursor)
+
+    except psycopg.Error as e:
+        print(f"Database error in {name}, the book is kept as it was:", e)
+        return 1
+
+    metrics.count("books_reloaded")
+    print(
+        f"Reloaded the book #{ebook_id}: {counts['paragraphs']} paragraphs "
+        f"in place of {deleted} rows"
+    )
+    count_book(header.title, counts["paragraphs"], counts["chars"])
+
+    return 0
+
+
+def save_missing(relation, relations, pool, verbose=False):
+    """
+    Inserts the books' numbers answered 404 Not Found during the run
+      into the relation, so they are never requested again
+
+    Returns: int: number of the books' numbers saved
+    """
+
+    ids = sorted(http_cache.not_found - lookup.missing_ids)
+    if not ids:
+        return 0
+
+    attributes = [attr for attr, _ in relations[relation]]
+    try:
+        with pool.connection() as connection, connection.cursor() as cursor:
+            with connection.transaction():
+                helpers.insert_many(
+                    relation,
+                    attributes[1:-1],
+                    ([id, 404] for id in ids),
+                    connection,
+                    cursor,
+                )
+    except psycopg.Error as e:
+        print("Could not save the missing books:", e)
+        return 0
+
+    lookup.missing_ids.update(ids)
+    if verbose:
+        print(f"{len(ids)} missing books saved")
+
+    return len(ids)
+
+
+def count_book(title, paragraphs, chars):
+    """
+    Counts the book loaded in the metrics and notes it in its summary
+    """
+
+    metrics.count("books_loaded")
+    metrics.count("paragraphs_loaded", paragraphs)
+    metrics.count("chars_loaded", chars)
+    metrics.note(title=title, paragraphs=paragraphs, chars=chars)
+
+
+@metrics.timed("paragraph_load")
+def text_to_database(
+    relation,
+    attributes,
+    book_id,
+    lines,
+    connection,
+    cursor,
+    verbose=False,
+    bulk=False,
+    transaction=False,
+    partition=None,
+):
+    """
+    Parses the paragraphs from the txt file,
+      creates the relation with the name of the book,
+      inserts the paragraphs to the database into the relation
+
+    Parameters:
+    - relation: str: relation name
+    - attributes: str: list of attributes' names, see text_attributes()
+    - book_id: int: the book's id
+    - lines: iterable of str: a file object or a lines generator
+    - connection: of of psycopg
+    - cursor: object of psycopg
+    - verbose: bool: print progress statements, default False
+    - bulk: bool: stream all the paragraphs with one COPY command
+      instead of inserting them one by one, default False
+    - transaction: bool: the paragraphs are inserted within
+      a transaction, so they are sent in the pipeline mode
+      without waiting for every row's round trip, default False
+    - partition: str: the relation's partition the rows are written
+      into, see text_partition(), by default the relation
+
+    Returns:
+    - tuple: number of chars, of lines, of paragraphs
+
+    """
+
+    if verbose:
+        print(f'Started relation "{relation}" populating...')
+
+    counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+    paragraphs = helpers.get_paragraphs(lines, counts)
+    paragraphs = store_paragraphs(relation, paragraphs, cursor)
+    rows = text_rows(relation, paragraphs, book_id)
+    relation = partition or relation
+
+    if bulk:
+        helpers.copy_into_table(relation, attributes, rows, connection, cursor)
+        if verbose:
+            print(f"    {counts['paragraphs']} loaded with COPY")
+
+        return counts["chars"], counts["lines"], counts["paragraphs"]
+
+    if transaction:
+        helpers.insert_many(relation, attributes, rows, connection, cursor)
+        if verbose:
+            print(f"    {counts['paragraphs']} loaded in the pipeline mode")
+
+        return counts["chars"], counts["lines"], counts["paragraphs"]
+
+    # every statement is committed by itself (autocommit)
+    for rcount, row in enumerate(rows, 1):
+        helpers.insert_into_table(relation, attributes, row, connection, cursor)
+
+        if rcount % 100 == 0:
+            if verbose:
+                print(f"    {rcount} rows loaded...")
+            time.sleep(1)
+
+    return counts["chars"], counts["lines"], counts["paragraphs"]
+
+
+def claim_book(ebook_id, relations, cursor):
+    """
+    Takes the book whose general info is loaded from the catalog,
+      so only its paragraphs are loaded, see helpers.claim_book();
+      run it in the transaction loading them. The book is marked
+      loaded in memory once it is committed, see lookup.mark_loaded()
+
+    Returns: int: the book's id or 0 if the book is not from the catalog
+    """
+
+    if ebook_id not in lookup.catalog_ids:
+        return 0
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    staged = schemata.is_staging(text_rel)
+    book_id = helpers.claim_book(book_rel, ebook_id, cursor, staged)
+    if book_id:
+        metrics.note(ebook_id=ebook_id)
+        print(f"The book #{ebook_id} is in the catalog, loading its paragraphs")
+
+    return book_id
+
+
+def delete_book(ebook_id, relations, verbose=False):
+    """
+    Deletes the book with its paragraphs, see helpers.delete_book()
+
+    Returns: int: 0 if the book is deleted
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    start = time.perf_counter()
+
+    with psycopg.connect(get_conninfo()) as conn, conn.cursor() as cur:
+        book_id = helpers.delete_book(book_rel, text_rel, ebook_id, cur)
+    if not book_id:
+        print(f"There is no book #{ebook_id} in the database")
+        return 1
+
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Deleted the book #{ebook_id} in {elapsed:.1f} ms")
+    if verbose:
+        print(f"    book id {book_id}")
+
+    return 0
+
+
+def read_book(ebook_id, start, count, relations):
+    """
+    Prints `count` paragraphs of the book from paragraph `start`
+      streamed by a server-side cursor, see reader.stream_paragraphs()
+
+    Returns: int: 0 if the book is read
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+
+    with psycopg.connect(get_conninfo()) as conn, conn.cursor() as cur:
+        book_id = reader.get_book_id(book_rel, ebook_id, cur)
+        if book_id is None:
+            print(f"There is no book #{ebook_id} in the database")
+            return 1
+
+        paragraphs = reader.stream_paragraphs(
+            text_rel, book_id, conn, start, start + count
+        )
+        for number, paragraph in enumerate(paragraphs, start):
+            print(f"[{number}] {paragraph}")
+
+    return 0
+
+
+def export_paragraphs(path, ebook_id, relations, verbose=False):
+    """
+    Exports the paragraphs of the book (of every book if ebook_id is
+      None) into the file, see reader.export()
+
+    Returns: int: 0 if the paragraphs are exported
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    start = time.perf_counter()
+
+    with psycopg.connect(get_conninfo()) as conn, conn.cursor() as cur:
+        book_id = None
+        if ebook_id is not None:
+            book_id = reader.get_book_id(book_rel, ebook_id, cur)
+            if book_id is None:
+                print(f"There is no book #{ebook_id} in the database")
+                return 1
+        count = reader.export(text_rel, path, cur, book_id, verbose)
+
+    elapsed = time.perf_counter() - start
+    print(f"Exported {count} paragraphs to {path} in {elapsed:.2f} sec")
+
+    return 0
+
+
+def merge_staging(relations, connection, cursor, verbose=False):
+    """
+    Merges the paragraphs of the staging relation into the paragraphs'
+      relation, see helpers.merge_staging()
+
+    Returns: int: number of rows merged
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    start = time.perf_counter()
+    merged = helpers.merge_staging(
+        schemata.STAGING.format(text_rel),
+        text_rel,
+        text_attributes(relations[text_rel]),
+        book_rel,
+        connection,
+        cursor,
+        verbose,
+    )
+    if merged:
+        elapsed = time.perf_counter() - start
+        print(f"Merged {merged} staged rows into {text_rel} in {elapsed:.2f} sec")
+
+    return merged
+
+
+def text_partition(relation, book_id, cursor):
+    """
+    Returns: str: the partition of the paragraphs' relation the book's
+      rows are in, the relation itself if it has no partitions
+    """
+
+    partitions = helpers.get_modulus(relation, cursor)
+    if not partitions:
+        return relation
+
+    return helpers.get_partition(relation, partitions, book_id, cursor)
+
+
+def text_attributes(attributes):
+    """
+    Returns: list of str: the attributes of the paragraphs' relation
+      a row is inserted with, see text_rows()
+    """
+
+    return [attr for attr, _ in attributes if not attr.isupper()][1:]
+
+
+def store_paragraphs(relation, paragraphs, cursor):
+    """
+    Keeps the book's paragraphs in the store first if the relation is
+      of the dedup layout, see helpers.store_paragraphs()
+
+    Returns: iterable: the paragraphs or their hashes in the dedup layout
+    """
+
+    if not schemata.is_deduplicated(relation):
+        return paragraphs
+
+    return helpers.store_paragraphs(
+        schemata.STORE, paragraphs, cursor, schemata.HASH_SIZE
+    )
+
+
+def text_rows(relation, paragraphs, book_id):
+    """
+    Lays the book's paragraphs out as the relation's rows:
+      [paragraph, book_id] for the paragraph layout,
+      [book_id, position, paragraphs] for the chunk layout,
+      [book_id, position, hash] for the dedup layout, the paragraphs
+      are their hashes then, see store_paragraphs()
+
+    Returns: iterable of lists: the rows in the order of text_attributes()
+    """
+
+    if schemata.is_chunked(relation):
+        chunks = helpers.chunk_paragraphs(paragraphs, schemata.CHUNK_SIZE)
+        return ([book_id, position, chunk] for position, chunk in chunks)
+
+    if schemata.is_deduplicated(relation):
+        hashes = enumerate(paragraphs)
+        return ([book_id, position, digest] for position, digest in hashes)
+
+    return ([paragraph, book_id] for paragraph in paragraphs)
+
+
+def search_paragraphs(query, language, limit, relations):
+    """
+    Prints the paragraphs of the books in the language best matching
+      the query with their books' titles, see search.search()
+
+    Returns: int: 0 if the search is done
+    """
+
+    author_rel, role_rel, language_rel, book_rel, text_rel, missing_rel = relations
+    start = time.perf_counter()
+
+    try:
+        with psycopg.connect(get_conninfo()) as conn, conn.cursor() as cur:
+            found = search.search(
+                query, text_rel, book_rel, language_rel, cur, language, limit
+            )
+            languages = [] if found else search.get_languages(language_rel, cur)
+    except psycopg.errors.UndefinedColumn:
+        print("There is no search index yet, load the books with --search-index")
+        return 1
+
+    if languages and language.lower() not in map(str.lower, languages):
+        print(f"There are no books in {language}, only in {', '.join(languages)}")
+        return 1
+
+    elapsed = (time.perf_counter() - start) * 1000
+    for title, paragraph, rank in found:
+        print(f'{rank:.3f} "{title}":')
+        print(f"    {paragraph.strip()[:300]}")
+    print(f"Found {len(found)} paragraphs in {elapsed:.1f} ms")
+
+    return 0
+
+
+def report(metrics_path=None, profiler=None, profile_path=None, verbose=False):
+    """
+    Prints the metrics if verbose, dumps them into the file (JSON if
+      its name ends with .json, Prometheus text format otherwise)
+      and saves the profile; registered to run at exit
+    """
+
+    if verbose:
+        print("Time spent in the stages:")
+        metrics.print_summary()
+    if metrics_path:
+        metrics.dump(metrics_path)
+        print(f"Metrics saved to {metrics_path}")
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        print(f"Profile saved to {profile_path}, the hottest functions:")
+        stats = pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+        stats.print_stats(15)
+
+
+def pop_option(args, option, default=None):
+    """
+    Removes the option and its value from the arguments' list
+
+    Returns: str: the option's value or default if the option is absent
+    """
+
+    if option not in args:
+        return default
+
+    index = args.index(option)
+    value = args[index + 1]
+    del args[index : index + 2]
+
+    return value
 
 
 def print_usage():
@@ -394,7 +1834,38 @@ def print_usage():
     print("Available options:")
     print("\t-C (clear databse)")
     print("\t-V (verbose on)")
-    print("\t-NW (skip warning message)")
+    print("\t-NW (no effect, there is no warning message any more)")
+    print("\t-B (bulk load paragraphs with COPY)")
+    print("\t-S (stream books without saving them to files)")
+    print("\t-T (load every book in a transaction, in the pipeline mode)")
+    print("\t--batch N (books committed at once with -T, default 1)")
+    print("\t--cache DIR (keep the downloaded books in DIR, ask for changes only)")
+    print("\t--zip (download the books' .zip editions, the .txt ones if none)")
+    print("\t--mirror PATH (load N books from a local mirror: a directory or archive)")
+    print("\t--parse-only (with --mirror: parse the books without the database)")
+    print("\t--metrics FILE (save the metrics at exit: FILE.json or Prometheus text)")
+    print("\t--profile FILE (save the cProfile of the run into FILE)")
+    print("\t--staging (load the paragraphs into an UNLOGGED table, merge them once)")
+    print("\t--partitions N (split the paragraphs into N hash partitions by book)")
+    print("\t--catalog FILE (load every book's general info from pg_catalog.csv)")
+    print("\t--refresh (reload N loaded books whose content has changed)")
+    print("\t--delete NUMBER (delete the book with this Gutenberg number, do not load)")
+    print("\t--book NUMBER (print N paragraphs of the book, do not load)")
+    print("\t--from N (with --book: the first paragraph printed, default 0)")
+    print("\t--export FILE (export the paragraphs with COPY, of --book only if given)")
+    print("\t--layout NAME (paragraph: a row per paragraph, chunk: chunks of them,")
+    print("\t\tdedup: every distinct paragraph kept once, the books refer to it)")
+    print("\t--search-index (build the full-text search index after the load)")
+    print("\t--search QUERY (print N paragraphs matching QUERY, do not load)")
+    print("\t--language NAME (the books' language to search, default English)")
+    print("\t--concurrency N (parse N books at once with asyncio)")
+    print("\t--per-host N (connections to the same host, default 4)")
+    print("\t--delay SEC (seconds between requests to the same host, default 1)")
+    print("\t--url TEMPLATE (books' link, {0} is the book's number)")
+    print("\t--workers N (parse books in N processes, write in one)")
+    print("\t--queue-size N (books waiting between the stages, default 2 * workers)")
+    print("\t--pool-min N (connections kept open in the pool, default 1)")
+    print("\t--pool-max N (connections in the pool at most, default concurrency or 4)")
 
 
 if __name__ == "__main__":
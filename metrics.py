@@ -0,0 +1,267 @@
+import bisect
+import contextlib
+import functools
+import inspect
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+
+# upper bounds in seconds of the histograms' buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+# the prefix of the metrics' names in the Prometheus text format
+PREFIX = "gutenberg"
+
+# event -> number of times it happened, e.g. "books_loaded"
+counters = defaultdict(int)
+# stage -> "count", "sum", "max" seconds and the buckets' counts
+histograms = dict()
+# summaries of the books loaded one by one, see book()
+books = list()
+# the summary of the book being loaded, see note()
+current = None
+# the worker threads (the pipeline's reader) update the metrics too
+lock = threading.Lock()
+# the thread's seconds of reading the iterators of timed_iter(),
+# not counted by the timers of the code reading them
+local = threading.local()
+
+
+def count(event, value=1):
+    """
+    Adds the value to the event's counter
+    """
+
+    with lock:
+        counters[event] += value
+
+
+def observe(stage, seconds):
+    """
+    Puts the stage's duration into its histogram
+    """
+
+    with lock:
+        histogram = histograms.setdefault(
+            stage, {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        )
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        histogram["max"] = max(histogram["max"], seconds)
+        histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """
+    Times the block of code as the stage:
+      `with metrics.timer("download"): ...`; the time of reading
+      the iterators of timed_iter() within the block is not counted
+    """
+
+    start = time.perf_counter()
+    excluded = getattr(local, "excluded", 0.0)
+    try:
+        yield
+    finally:
+        excluded = getattr(local, "excluded", 0.0) - excluded
+        observe(stage, time.perf_counter() - start - excluded)
+
+
+def timed_iter(iterable, stage, seconds=0.0):
+    """
+    Times the reads of the iterable as the stage, e.g. the chunks of
+      a book streamed from the network while it is parsed and loaded:
+      the stage is observed once when the iterable is over, and the
+      timers of the code reading it do not count its time. `seconds`
+      already spent in the stage (e.g. the request) are added to it
+
+    Yields: the items of the iterable
+    """
+
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                seconds += elapsed
+                local.excluded = getattr(local, "excluded", 0.0) + elapsed
+            yield item
+    finally:
+        observe(stage, seconds)
+
+
+def timed(stage=None):
+    """
+    Decorates a function (or a coroutine function) to time its every
+      call as the stage, by default the function's name
+    """
+
+    def decorator(function):
+        name = stage or function.__name__
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with timer(name):
+                    return await function(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with timer(name):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def book(name, summary=None):
+    """
+    Makes the summary of the book loaded in the block: its total time,
+      the time of every stage within it and the fields of note().
+      The stages are exact when the books are loaded one by one.
+      The summary of a book downloaded before it is loaded in
+      another block is given to that block to be continued
+
+    Yields: dict: the summary
+    """
+
+    global current
+
+    with lock:
+        before = {stage: h["sum"] for stage, h in histograms.items()}
+    continued = summary is not None
+    if not continued:
+        summary = {"book": name, "seconds": 0.0, "stages": dict()}
+    current = summary
+    start = time.perf_counter()
+
+    try:
+        yield summary
+    finally:
+        seconds = summary["seconds"] + time.perf_counter() - start
+        summary["seconds"] = round(seconds, 6)
+        stages = summary["stages"]
+        with lock:
+            for stage, h in histograms.items():
+                if h["sum"] != before.get(stage, 0.0):
+                    seconds = stages.get(stage, 0.0) + h["sum"] - before.get(stage, 0.0)
+                    stages[stage] = round(seconds, 6)
+        current = None
+        if not continued:
+            books.append(summary)
+
+
+def note(**fields):
+    """
+    Adds the fields (title, paragraphs, etc.) to the summary
+      of the book being loaded, if any
+    """
+
+    if current is not None:
+        current.update(fields)
+
+
+def clear():
+    """
+    Starts the metrics over
+    """
+
+    with lock:
+        counters.clear()
+        histograms.clear()
+        books.clear()
+
+
+def to_dict():
+    """
+    Returns: dict: the counters, the histograms and the books' summaries
+    """
+
+    with lock:
+        return {
+            "counters": dict(counters),
+            "histograms": {
+                stage: {
+                    "count": h["count"],
+                    "sum": round(h["sum"], 6),
+                    "max": round(h["max"], 6),
+                    "buckets": dict(zip(map(str, BUCKETS), h["buckets"])),
+                }
+                for stage, h in histograms.items()
+            },
+            "books": list(books),
+        }
+
+
+def to_prometheus():
+    """
+    Returns: str: the counters and the histograms in the Prometheus
+      text exposition format (the books' summaries are left out)
+    """
+
+    lines = [
+        f"# HELP {PREFIX}_events_total Number of the events of the run",
+        f"# TYPE {PREFIX}_events_total counter",
+    ]
+    with lock:
+        for event, value in sorted(counters.items()):
+            lines.append(f'{PREFIX}_events_total{{event="{event}"}} {value}')
+
+        lines.append(f"# HELP {PREFIX}_stage_seconds Time spent in the stages")
+        lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+        for stage, h in sorted(histograms.items()):
+            total = 0
+            for bound, value in zip(BUCKETS, h["buckets"]):
+                total += value
+                le = "+Inf" if bound == math.inf else bound
+                lines.append(
+                    f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}'
+                )
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {h["sum"]}')
+            lines.append(
+                f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {h["count"]}'
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    """
+    Writes the metrics into the file: JSON if its name ends
+      with .json, the Prometheus text format otherwise
+    """
+
+    with open(path, "w") as file:
+        if str(path).endswith(".json"):
+            json.dump(to_dict(), file, indent=2)
+        else:
+            file.write(to_prometheus())
+
+
+def print_summary():
+    """
+    Prints the stages by the time spent in them and the counters
+    """
+
+    with lock:
+        stages = sorted(histograms.items(), key=lambda item: -item[1]["sum"])
+        for stage, h in stages:
+            print(
+                f"  {stage:20} {h['count']:7} calls {h['sum']:9.3f} sec, "
+                f"{h['sum'] / h['count'] * 1000:8.2f} ms each, "
+                f"{h['max'] * 1000:8.2f} ms at most"
+            )
+        for event, value in sorted(counters.items()):
+            print(f"  {event:20} {value:7}")
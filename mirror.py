@@ -0,0 +1,189 @@
+import itertools
+import os
+import re
+import tarfile
+import zipfile
+from pathlib import Path
+
+# number of bytes read from an archive's file at a time
+CHUNK_SIZE = 1024 * 1024
+# the books' files in a mirror
+SUFFIXES = (".txt", ".zip")
+# Gutenberg's names of the files by encoding: 1-0.txt is utf-8,
+# 1-8.txt is latin-1, the encoding of plain 1.txt is detected
+ENCODINGS = {"-0": "utf-8", "-8": "iso-8859-1"}
+# the book's number in the name of its file: 1.txt, 1-0.txt, pg1.txt
+EBOOK_ID_PATTERN = re.compile(r"^(?:pg)?(\d+)")
+
+
+def iter_books(path, verbose=False):
+    """
+    Finds the books in a local Gutenberg mirror: a directory tree of
+      .txt and .zip files, a .zip or .tar archive or a single file.
+      In a directory, a .zip book is skipped if the same book is
+      there as a .txt file
+
+    Parameters:
+    - path: str or Path: the mirror
+    - verbose: bool: print progress statements, default False
+
+    Yields: tuple: the book's name and an iterator of its bytes' chunks;
+      read the chunks before asking for the next book
+    """
+
+    path = Path(path)
+
+    if not path.exists():
+        print(f"There is no mirror {path}")
+        return
+
+    if path.is_dir():
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            names = set(files)
+            for name in sorted(files):
+                stem, suffix = os.path.splitext(name)
+                suffix = suffix.lower()
+                if suffix not in SUFFIXES:
+                    continue
+                file = Path(root, name)
+                if suffix == ".zip":
+                    if stem + ".txt" in names:
+                        continue
+                    yield from iter_zip(file, verbose)
+                else:
+                    yield str(file), read_chunks(file)
+
+    # a tar archive keeping a .zip book looks like a zip archive too
+    elif tarfile.is_tarfile(path):
+        yield from iter_tar(path, verbose)
+
+    elif zipfile.is_zipfile(path):
+        yield from iter_zip(path, verbose)
+
+    else:
+        yield str(path), read_chunks(path)
+
+
+def select_books(path, verbose=False, skip=(), only=None):
+    """
+    Finds the books of the mirror leaving the skipped ones (and the
+      ones not in `only`) out before they are read, see iter_books()
+
+    Yields: tuple: the book's name, an iterator of its bytes' chunks
+      and its number (None if the name has no number)
+    """
+
+    for name, chunks in iter_books(path, verbose):
+        ebook_id = get_ebook_id(name)
+        if ebook_id in skip:
+            if verbose:
+                print(f"The book #{ebook_id} is already in the database")
+            continue
+        if only is not None and ebook_id not in only:
+            continue
+        yield name, chunks, ebook_id
+
+
+def read_books(path, limit=None, verbose=False, skip=(), only=None):
+    """
+    Reads the books of the mirror into memory one by one, the source
+      of main.parse_books_pipeline()
+
+    Parameters:
+    - path: str or Path: the mirror, see iter_books()
+    - limit: int: number of books read at most, None for all of them;
+      the skipped books and the ones not in `only` are not counted
+    - verbose: bool: print progress statements, default False
+    - skip: container of int: the books' numbers not to read,
+      e.g. the ones already loaded
+    - only: container of int: the only books' numbers to read,
+      None for every book
+
+    Yields: tuple: the book's name, its bytes, encoding and number
+      (None if the name has no number)
+    """
+
+    books = itertools.islice(select_books(path, verbose, skip, only), limit)
+    for name, chunks, ebook_id in books:
+        if verbose:
+            print(f"Reading {name}")
+        yield name, b"".join(chunks), get_encoding(name), ebook_id
+
+
+def get_encoding(name):
+    """
+    Returns: str: the encoding of the book's file by its name or None
+      to detect it by the content, see helpers.detect_encoding()
+    """
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+
+    return ENCODINGS.get(stem[-2:])
+
+
+def get_ebook_id(name):
+    """
+    Returns: int: the book's number by the name of its file or None
+    """
+
+    match = EBOOK_ID_PATTERN.match(os.path.basename(name))
+
+    return int(match.group(1)) if match else None
+
+
+def read_chunks(path):
+    """
+    Reads the file with one read() call: the book is kept in memory
+      whole, see read_books(), and its only chunk is not copied when
+      the chunks are joined
+
+    Yields: bytes: the file's content
+    """
+
+    with open(path, "rb") as file:
+        yield file.read()
+
+
+def iter_zip(path, verbose=False, name=None):
+    """
+    Yields: tuple: the name and the chunks of every .txt file
+      of the zip archive; `name` is the archive's name if `path`
+      is a file object, e.g. a member of a tar archive
+    """
+
+    name = name or path
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(".txt"):
+                    continue
+                with archive.open(member) as file:
+                    yield f"{name}/{member.filename}", iter(
+                        lambda: file.read(CHUNK_SIZE), b""
+                    )
+
+    except zipfile.BadZipFile as e:
+        print(f"Could not read {name}:", e)
+
+
+def iter_tar(path, verbose=False):
+    """
+    Yields: tuple: the name and the chunks of every .txt or .zip file
+      of the tar archive (it may be compressed); the archive is read
+      once from the start, so a book kept in both files is read twice
+    """
+
+    with tarfile.open(path) as archive:
+        for member in archive:
+            name = member.name.lower()
+            if not member.isfile() or not name.endswith(SUFFIXES):
+                continue
+            file = archive.extractfile(member)
+            if name.endswith(".zip"):
+                yield from iter_zip(file, verbose, f"{path}/{member.name}")
+            else:
+                yield f"{path}/{member.name}", iter(lambda: file.read(CHUNK_SIZE), b"")
+
+        if verbose:
+            print(f"{path} is read")
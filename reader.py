@@ -0,0 +1,227 @@
+import gzip
+
+from psycopg import sql
+
+import metrics
+import schemata
+
+# number of rows a server-side cursor fetches from the server at a time
+FETCH_SIZE = 1000
+# number of bytes written into the exported file at a time
+BUFFER_SIZE = 1024 * 1024
+
+
+def range_query(relation, book_id, start=0, stop=None):
+    """
+    Makes the query selecting the book's paragraphs numbered from
+      `start` up to `stop` in the order they were loaded: in the
+      paragraph layout they are counted by id, in the chunk layout
+      the chunks holding the range are found by the (book_id, position)
+      index and unnested on the server, in the dedup layout the range
+      is found by the same index and joined with the store, so every
+      row is one paragraph in every layout
+
+    Parameters:
+    - relation: str: name of the paragraphs' relation
+    - book_id: int: the book's id
+    - start: int: number of the first paragraph, from 0
+    - stop: int: number of the paragraph after the last one,
+      None for the end of the book
+
+    Returns: tuple: sql.Composed and its parameters
+    """
+
+    if schemata.is_chunked(relation):
+        # the chunk at this position holds paragraph `start`
+        first = start - start % schemata.CHUNK_SIZE
+        query = sql.SQL(
+            """
+            SELECT u.paragraph
+              FROM {rel} AS c,
+              unnest(c.paragraphs) WITH ORDINALITY AS u(paragraph, n)
+              WHERE c.book_id = %(book_id)s AND c.position >= %(first)s
+                AND (%(stop)s::INTEGER IS NULL OR c.position < %(stop)s)
+                AND c.position + u.n - 1 >= %(start)s
+                AND (%(stop)s::INTEGER IS NULL OR c.position + u.n - 1 < %(stop)s)
+              ORDER BY c.position, u.n
+            """
+        ).format(rel=sql.Identifier(relation))
+        params = {"book_id": book_id, "first": first, "start": start, "stop": stop}
+    elif schemata.is_deduplicated(relation):
+        query = sql.SQL(
+            """
+            SELECT s.paragraph FROM {rel} AS m
+              JOIN {store} AS s ON s.hash = m.hash
+              WHERE m.book_id = %(book_id)s AND m.position >= %(start)s
+                AND (%(stop)s::INTEGER IS NULL OR m.position < %(stop)s)
+              ORDER BY m.position
+            """
+        ).format(rel=sql.Identifier(relation), store=sql.Identifier(schemata.STORE))
+        params = {"book_id": book_id, "start": start, "stop": stop}
+    else:
+        # LIMIT NULL is no limit
+        query = sql.SQL(
+            """
+            SELECT paragraph FROM {rel}
+              WHERE book_id = %(book_id)s
+              ORDER BY id OFFSET %(start)s LIMIT %(limit)s
+            """
+        ).format(rel=sql.Identifier(relation))
+        limit = None if stop is None else max(stop - start, 0)
+        params = {"book_id": book_id, "start": start, "limit": limit}
+
+    return query, params
+
+
+def stream_paragraphs(
+    relation, book_id, connection, start=0, stop=None, fetch_size=FETCH_SIZE
+):
+    """
+    Streams the book's paragraphs in order through a named
+      (server-side) cursor: `fetch_size` rows are fetched at a time,
+      so the client keeps no more of them in memory however big the
+      book is. The cursor lives in a transaction of the connection
+      until the paragraphs are read or the generator is closed
+
+    Parameters:
+    - relation: str: name of the paragraphs' relation
+    - book_id: int: the book's id
+    - connection: psycopg class instance, a pool's autocommit
+      connection will do
+    - start: int: number of the first paragraph, from 0
+    - stop: int: number of the paragraph after the last one,
+      None for the end of the book
+    - fetch_size: int: number of rows fetched at a time
+
+    Yields: str: the paragraph
+    """
+
+    query, params = range_query(relation, book_id, start, stop)
+
+    with connection.transaction():
+        with connection.cursor(name=f"{relation}_{book_id}_reader") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row[0]
+
+
+def get_book_id(book_relation, ebook_id, cursor):
+    """
+    Returns: int: id of the book with the Gutenberg number or None
+    """
+
+    cursor.execute(
+        sql.SQL("SELECT id FROM {} WHERE ebook_id = %s").format(
+            sql.Identifier(book_relation)
+        ),
+        [ebook_id],
+    )
+    row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+@metrics.timed()
+def read_page(relation, book_id, start, count, cursor):
+    """
+    Reads a page of the book's paragraphs, see range_query()
+
+    Parameters:
+    - relation: str: name of the paragraphs' relation
+    - book_id: int: the book's id
+    - start: int: number of the first paragraph, from 0
+    - count: int: number of the paragraphs at most
+    - cursor: psycopg class instance
+
+    Returns: list of str: the paragraphs, fewer than `count`
+      at the end of the book
+    """
+
+    cursor.execute(*range_query(relation, book_id, start, start + count))
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def corpus_query(relation):
+    """
+    Returns: sql.Composed: the query selecting the book's id and the
+      paragraph of every paragraph of the relation, the books' ones
+      in order
+    """
+
+    if schemata.is_chunked(relation):
+        query = """
+            SELECT c.book_id, u.paragraph
+              FROM {rel} AS c,
+              unnest(c.paragraphs) WITH ORDINALITY AS u(paragraph, n)
+              ORDER BY c.book_id, c.position, u.n
+            """
+    elif schemata.is_deduplicated(relation):
+        query = """
+            SELECT m.book_id, s.paragraph FROM {rel} AS m
+              JOIN {store} AS s ON s.hash = m.hash
+              ORDER BY m.book_id, m.position
+            """
+    else:
+        query = "SELECT book_id, paragraph FROM {rel} ORDER BY book_id, id"
+
+    return sql.SQL(query).format(
+        rel=sql.Identifier(relation), store=sql.Identifier(schemata.STORE)
+    )
+
+
+def open_export(path):
+    """
+    Returns: file object: the binary file the export is written into,
+      gzipped if its name ends with .gz
+    """
+
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "wb")
+
+    return open(path, "wb", buffering=BUFFER_SIZE)
+
+
+@metrics.timed()
+def export(relation, path, cursor, book_id=None, verbose=False):
+    """
+    Exports the book's paragraphs (or the whole corpus) into the file
+      with one COPY ... TO STDOUT: the data is written into the file
+      as it comes from the server, nothing is kept in memory. The
+      format is CSV with a header if the file's name ends with .csv
+      or .csv.gz and the COPY's text format otherwise (a row a line,
+      the line breaks of a paragraph escaped as \n)
+
+    Parameters:
+    - relation: str: name of the paragraphs' relation
+    - path: str or Path: the file, see open_export()
+    - cursor: psycopg class instance
+    - book_id: int: the book's id, None for the whole corpus: the book's
+      id and the paragraph of every paragraph
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of the paragraphs exported
+    """
+
+    if book_id is None:
+        query, params = corpus_query(relation), None
+    else:
+        query, params = range_query(relation, book_id)
+
+    options = sql.SQL("")
+    if str(path).removesuffix(".gz").endswith(".csv"):
+        options = sql.SQL(" (FORMAT csv, HEADER)")
+
+    size = 0
+    with open_export(path) as file:
+        copy_query = sql.SQL("COPY ({}) TO STDOUT{}").format(query, options)
+        with cursor.copy(copy_query, params) as copy:
+            for data in copy:
+                file.write(data)
+                size += len(data)
+
+    if verbose:
+        print(f"{cursor.rowcount} paragraphs, {size} bytes exported to {path}")
+
+    return cursor.rowcount
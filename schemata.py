@@ -22,6 +22,19 @@ relations = {
         ("author_id", "INTEGER REFERENCES author(id) ON DELETE CASCADE"),
         ("role_id", "INTEGER REFERENCES role(id) ON DELETE CASCADE"),
         ("language_id", "INTEGER REFERENCES language(id) ON DELETE CASCADE"),
+        ("ebook_id", "INTEGER UNIQUE"),
+        # the general info is loaded from the catalog, the paragraphs not yet
+        ("text_pending", "BOOLEAN DEFAULT FALSE"),
+        # the paragraphs are in the UNLOGGED staging relation, not merged
+        # yet: a crash empties it, see helpers.merge_staging()
+        ("text_staged", "BOOLEAN DEFAULT FALSE"),
+        # the sha256 digest and the size of the book's bytes it was loaded
+        # from, a changed edition is reloaded, see main.refresh_books()
+        ("content_hash", "BYTEA"),
+        ("content_size", "BIGINT"),
+        # when the digest was checked last, the books checked longest ago
+        # are checked first, see helpers.get_content_hashes()
+        ("content_checked", "TIMESTAMPTZ"),
         ("UNIQUE", "(title, year, language_id)"),
         ("PRIMARY KEY", "(id)"),
     ],
@@ -31,4 +44,160 @@ relations = {
         ("book_id", "INTEGER REFERENCES book(id) ON DELETE CASCADE"),
         ("PRIMARY KEY", "(id)"),
     ],
+    "missing": [
+        ("id", "SERIAL"),
+        ("ebook_id", "INTEGER UNIQUE"),
+        ("status", "INTEGER"),
+        ("PRIMARY KEY", "(id)"),
+    ],
+}
+
+# number of paragraphs kept in one row of the chunk layout
+CHUNK_SIZE = 64
+# the relations keeping the paragraphs by layout: a row per paragraph,
+# a row per CHUNK_SIZE paragraphs of a book (an array, compressed by
+# TOAST as a whole), paragraph N is paragraphs[N % CHUNK_SIZE + 1] of
+# the chunk at position N - N % CHUNK_SIZE, or a row per paragraph of
+# a book referring to its text kept once in the STORE
+layouts = {
+    "paragraph": {"text": relations["text"]},
+    "chunk": {
+        "text_chunk": [
+            ("id", "SERIAL"),
+            ("book_id", "INTEGER REFERENCES book(id) ON DELETE CASCADE"),
+            ("position", "INTEGER"),
+            ("paragraphs", "TEXT[]"),
+            ("UNIQUE", "(book_id, position)"),
+            ("PRIMARY KEY", "(id)"),
+        ],
+    },
+    "dedup": {
+        "book_paragraph": [
+            ("id", "SERIAL"),
+            ("book_id", "INTEGER REFERENCES book(id) ON DELETE CASCADE"),
+            ("position", "INTEGER"),
+            ("hash", "BYTEA REFERENCES paragraph_store(hash)"),
+            ("UNIQUE", "(book_id, position)"),
+            ("PRIMARY KEY", "(id)"),
+        ],
+    },
+}
+
+# the relation of the dedup layout keeping every paragraph once by the
+# hash of its text (HASH_SIZE bytes of BLAKE2b), the books' paragraphs
+# refer to it in order, see helpers.store_paragraphs()
+STORE = "paragraph_store"
+HASH_SIZE = 16
+# the relations a layout's paragraphs' relation refers to, created before
+# the relations and kept when a book is deleted
+stores = {
+    "dedup": {
+        STORE: [
+            ("hash", "BYTEA"),
+            ("paragraph", "TEXT"),
+            ("PRIMARY KEY", "(hash)"),
+        ],
+    },
 }
+
+
+def get_relations(layout="paragraph", partitions=0):
+    """
+    Returns: dict: the relations' schemata with the paragraphs kept
+      in the layout, split into the hash partitions by book if
+      `partitions`; the relations' order is the same for every layout
+    """
+
+    result = dict()
+    for relation, attributes in relations.items():
+        if relation != "text":
+            result[relation] = attributes
+            continue
+        for name, attributes in layouts[layout].items():
+            if partitions:
+                attributes = partition(attributes, partitions)
+            result[name] = attributes
+
+    return result
+
+
+def partition(attributes, partitions, key="book_id"):
+    """
+    Splits the relation into the partitions by the hash of the key,
+      see helpers.create_tables(): the rows with the same key (a book's
+      paragraphs) are in one partition which is loaded, vacuumed and
+      deleted from alone. The primary key leads with the key as every
+      unique constraint of a partitioned relation must include it,
+      so it is the index a book's rows are found by too
+
+    Returns: list of tuples: the relation's attributes
+    """
+
+    result = list()
+    for attr, datatype in attributes:
+        if attr == "PRIMARY KEY":
+            datatype = f"({key}, {datatype.strip('()')})"
+        result.append((attr, datatype))
+    result.append(("PARTITION BY", f"HASH ({key})"))
+    result.append(("PARTITIONS", str(partitions)))
+
+    return result
+
+
+def get_stores(layout="paragraph"):
+    """
+    Returns: dict: the schemata of the layout's stores, see `stores`
+    """
+
+    return dict(stores.get(layout, dict()))
+
+
+def is_deduplicated(relation):
+    """
+    Returns: bool: True if the relation keeps the hashes of paragraphs
+      kept in the STORE
+    """
+
+    return any(relation in (name, STAGING.format(name)) for name in layouts["dedup"])
+
+
+def is_chunked(relation):
+    """
+    Returns: bool: True if the relation keeps the chunks of paragraphs
+    """
+
+    return any(relation in (name, STAGING.format(name)) for name in layouts["chunk"])
+
+
+# the UNLOGGED relation the paragraphs are loaded into before they are
+# merged into their relation at once, see helpers.merge_staging()
+STAGING = "{}_staging"
+
+
+def is_staging(relation):
+    """
+    Returns: bool: True if the relation is a staging one
+    """
+
+    return relation.endswith(STAGING.format(""))
+
+
+def get_staging(relations):
+    """
+    Returns: dict: the relations with the paragraphs' relation (the fifth)
+      replaced by its staging relation: the same attributes with
+      their bare types, no constraints and no indexes
+    """
+
+    result = dict()
+    for i, (relation, attributes) in enumerate(relations.items()):
+        if i == 4:
+            result[STAGING.format(relation)] = [
+                (attr, datatype.split()[0])
+                for attr, datatype in attributes
+                if not attr.isupper()
+            ]
+        else:
+            result[relation] = attributes
+
+    return result
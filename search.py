@@ -0,0 +1,175 @@
+from psycopg import sql
+
+import metrics
+
+# the tsvector attribute added to the text relation and its GIN index
+COLUMN = "search"
+INDEX = "{}_search_index"
+# the index is dropped and built anew if more than this part of the rows
+# are not indexed yet, otherwise the new rows are added into it
+REBUILD_FRACTION = 0.2
+# the text search configuration of the languages Postgres has none for
+DEFAULT_CONFIG = "simple"
+
+
+@metrics.timed()
+def build_index(
+    text_relation, book_relation, language_relation, connection, cursor, verbose=False
+):
+    """
+    Builds or refreshes the full-text search index of the paragraphs
+      after a load: the tsvectors of the rows not indexed yet are made
+      by one UPDATE with the text search configuration of the book's
+      language ("english" for English, DEFAULT_CONFIG if there is no
+      such configuration) and the GIN index is built over them.
+      Nothing is maintained row by row while the books are loaded
+
+    Parameters:
+    - text_relation: str: name of the paragraphs' relation
+    - book_relation: str: name of the books' relation
+    - language_relation: str: name of the languages' relation
+    - connection: psycopg class instance
+    - cursor: psycopg class instance
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of paragraphs indexed
+    """
+
+    text = sql.Identifier(text_relation)
+    column = sql.Identifier(COLUMN)
+    index = sql.Identifier(INDEX.format(text_relation))
+
+    cursor.execute(
+        sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} TSVECTOR").format(
+            text, column
+        )
+    )
+    cursor.execute(
+        sql.SQL("SELECT count(*) FILTER (WHERE {} IS NULL), count(*) FROM {}").format(
+            column, text
+        )
+    )
+    new, total = cursor.fetchone()
+
+    with connection.transaction():
+        # the index is built in memory as far as possible
+        cursor.execute("SET LOCAL maintenance_work_mem = '256MB'")
+        rebuild = new > REBUILD_FRACTION * total
+        if rebuild:
+            cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(index))
+
+        if new:
+            cursor.execute(
+                sql.SQL(
+                    """
+                    UPDATE {text} AS t
+                      SET {column} = to_tsvector(
+                        COALESCE(c.cfgname, {default})::regconfig, t.paragraph
+                      )
+                      FROM {book} AS b
+                      JOIN {language} AS l ON l.id = b.language_id
+                      LEFT JOIN pg_ts_config AS c ON c.cfgname = lower(l.name)
+                      WHERE t.book_id = b.id AND t.{column} IS NULL
+                    """
+                ).format(
+                    text=text,
+                    column=column,
+                    default=sql.Literal(DEFAULT_CONFIG),
+                    book=sql.Identifier(book_relation),
+                    language=sql.Identifier(language_relation),
+                )
+            )
+
+        cursor.execute(
+            sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} USING GIN ({})").format(
+                index, text, column
+            )
+        )
+
+    cursor.execute(sql.SQL("ANALYZE {}").format(text))
+
+    if verbose:
+        how = "built" if rebuild else "refreshed"
+        print(f"Search index {how}: {new} of {total} paragraphs indexed")
+
+    return new
+
+
+def get_config(language, cursor):
+    """
+    Returns: str: the text search configuration of the language
+    """
+
+    cursor.execute(
+        "SELECT cfgname FROM pg_ts_config WHERE cfgname = lower(%s)", [language]
+    )
+    row = cursor.fetchone()
+
+    return row[0] if row else DEFAULT_CONFIG
+
+
+def get_languages(language_relation, cursor):
+    """
+    Returns: list of str: the names of the books' languages
+    """
+
+    cursor.execute(
+        sql.SQL("SELECT name FROM {} ORDER BY name").format(
+            sql.Identifier(language_relation)
+        )
+    )
+
+    return [name for name, in cursor.fetchall()]
+
+
+@metrics.timed()
+def search(
+    query,
+    text_relation,
+    book_relation,
+    language_relation,
+    cursor,
+    language="English",
+    limit=10,
+):
+    """
+    Finds the paragraphs of the books in the language (its name in
+      any case) matching the query (the web search syntax: words,
+      "phrases", or, -word). Only the paragraphs indexed by the last
+      build_index() are found, the ones loaded after it are not
+
+    Parameters:
+    - query: str: what to search for
+    - text_relation: str: name of the paragraphs' relation
+    - book_relation: str: name of the books' relation
+    - language_relation: str: name of the languages' relation
+    - cursor: psycopg class instance
+    - language: str: the books' language, default "English"
+    - limit: int: number of paragraphs at most, default 10
+
+    Returns: list of tuples: the book's title, the paragraph and
+      its rank, the best ranked first
+    """
+
+    cursor.execute(
+        sql.SQL(
+            """
+            SELECT b.title, t.paragraph, ts_rank(t.{column}, q) AS rank
+              FROM {text} AS t
+              JOIN {book} AS b ON b.id = t.book_id
+              JOIN {language} AS l ON l.id = b.language_id,
+              websearch_to_tsquery(%s::regconfig, %s) AS q
+              WHERE t.{column} @@ q AND lower(l.name) = lower(%s)
+              ORDER BY rank DESC
+              LIMIT %s
+            """
+        ).format(
+            column=sql.Identifier(COLUMN),
+            text=sql.Identifier(text_relation),
+            book=sql.Identifier(book_relation),
+            language=sql.Identifier(language_relation),
+        ),
+        [get_config(language, cursor), query, language, limit],
+    )
+
+    return cursor.fetchall()
@@ -0,0 +1,130 @@
+from psycopg import sql
+
+# the statements composed from the relations' schemata by kind; the
+# values are always sent apart from the statement as its parameters
+TEMPLATES = {
+    # returns the new row's id, nothing on conflict
+    "insert": (
+        "INSERT INTO {rel} ({cols}) VALUES ({vals}) "
+        "ON CONFLICT DO NOTHING RETURNING id"
+    ),
+    # for executemany(), returns nothing
+    "insert_many": "INSERT INTO {rel} ({cols}) VALUES ({vals})",
+    "exists": "SELECT EXISTS (SELECT 1 FROM {rel} WHERE {conds})",
+    "lookup": "SELECT id FROM {rel} WHERE {conds}",
+    # returns the id of the new or of the existing row of the unique key
+    "upsert": (
+        "INSERT INTO {rel} ({cols}) VALUES ({vals}) "
+        "ON CONFLICT ({cols}) DO UPDATE SET {excluded} RETURNING id"
+    ),
+    "copy": "COPY {rel} ({cols}) FROM STDIN",
+    "update": "UPDATE {rel} SET {sets} WHERE id = %s",
+    "delete": "DELETE FROM {rel} WHERE {conds}",
+}
+
+# (kind, relation, attributes) -> the statement's text, see get()
+cache = dict()
+
+
+def data_attributes(attributes):
+    """
+    Returns: list of str: the attributes the values are given for,
+      neither the constraints nor the SERIAL ones
+    """
+
+    return [
+        attr
+        for attr, datatype in attributes
+        if not attr.isupper() and "SERIAL" not in datatype
+    ]
+
+
+def unique_keys(attributes):
+    """
+    Returns: list of tuples of str: the attributes of every UNIQUE
+      attribute and UNIQUE constraint of the relation
+    """
+
+    keys = list()
+    for attr, datatype in attributes:
+        if attr == "UNIQUE":
+            keys.append(tuple(name.strip() for name in datatype.strip("()").split(",")))
+        elif not attr.isupper() and "UNIQUE" in datatype.split():
+            keys.append((attr,))
+
+    return keys
+
+
+def compose(kind, relation, attributes):
+    """
+    Composes the statement of the kind (see TEMPLATES) for the
+      attributes of the relation, a %s placeholder for every value
+
+    Returns: str: the statement's text
+    """
+
+    identifiers = [sql.Identifier(attr) for attr in attributes]
+    query = sql.SQL(TEMPLATES[kind]).format(
+        rel=sql.Identifier(relation),
+        cols=sql.SQL(", ").join(identifiers),
+        vals=sql.SQL(", ").join(sql.Placeholder() * len(attributes)),
+        conds=sql.SQL(" AND ").join(
+            sql.SQL("{} = %s").format(attr) for attr in identifiers
+        ),
+        excluded=sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(attr) for attr in identifiers
+        ),
+        sets=sql.SQL(", ").join(
+            sql.SQL("{} = %s").format(attr) for attr in identifiers
+        ),
+    )
+
+    return query.as_string(None)
+
+
+def get(kind, relation, attributes):
+    """
+    Gets the statement from the cache, composing it the first time:
+      the same text is executed every time, so psycopg runs it as the
+      server-side prepared statement of the connection (see
+      prepare=True of cursor.execute()) and it is parsed and planned
+      once per connection
+
+    Returns: str: the statement's text
+    """
+
+    key = (kind, relation, tuple(attributes))
+    statement = cache.get(key)
+    if statement is None:
+        statement = cache[key] = compose(kind, relation, attributes)
+
+    return statement
+
+
+def prepare(relations, verbose=False):
+    """
+    Composes the statements of every relation at startup: the inserts
+      and the COPY of its attributes, the lookups and the existence
+      checks of its unique keys, the upserts of its unique attributes
+
+    Parameters:
+    - relations: dict: relations' schemata
+    - verbose: bool: print progress statements, default False
+
+    Returns: int: number of the statements in the cache
+    """
+
+    for relation, attributes in relations.items():
+        data = data_attributes(attributes)
+        for kind in ("insert", "insert_many", "copy"):
+            get(kind, relation, data)
+        for key in unique_keys(attributes):
+            for kind in ("exists", "lookup"):
+                get(kind, relation, key)
+            if len(key) == 1:
+                get("upsert", relation, key)
+
+    if verbose:
+        print(f"{len(cache)} statements composed")
+
+    return len(cache)
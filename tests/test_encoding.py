@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers
+
+# an undeclared latin-1 book, its first letter outside ascii far from its start
+LATIN1 = (
+    b"Title: Caf\xe9s\r\n\r\n" + b"A line.\r\n" * 1000 + b"Un caf\xe9 na\xefve.\r\n"
+)
+
+
+def test_a_whole_latin1_book_is_detected():
+    assert helpers.detect_encoding(b"abc\xe9", final=True) == "iso8859-1"
+    assert helpers.detect_encoding(b"abc\xe9t") == "iso8859-1"
+
+
+def test_utf8_is_detected():
+    assert helpers.detect_encoding("café".encode(), final=True) == "utf-8"
+    # the last character cut by the end of the chunk
+    assert helpers.detect_encoding("café".encode()[:-1]) == "utf-8"
+
+
+def test_a_latin1_letter_cut_by_the_chunk_keeps_its_text():
+    book = LATIN1.decode("iso8859-1").replace("\r\n", "\n")
+    # the first chunk ends with the first letter outside ascii
+    first = LATIN1.index(b"\xe9") + 1
+    chunks = [LATIN1[:first], LATIN1[first:]]
+
+    encoding = helpers.detect_encoding(chunks[0])
+    assert "".join(helpers.iter_lines(chunks, encoding)) == book
+
+
+def test_latin1_letters_after_the_first_chunk_keep_their_text():
+    book = LATIN1.decode("iso8859-1").replace("\r\n", "\n")
+    chunks = [LATIN1[:5], LATIN1[5:]]
+
+    encoding = helpers.detect_encoding(chunks[0])
+    assert encoding == "utf-8"
+    assert "".join(helpers.iter_lines(chunks, encoding)) == book
+    assert helpers.decode(LATIN1, encoding) == book
+
+
+def test_utf8_is_decoded_across_the_chunks():
+    text = "Un café naïve.\n" * 100
+    content = text.encode()
+    chunks = [content[i : i + 7] for i in range(0, len(content), 7)]
+
+    encoding = helpers.detect_encoding(chunks[0])
+    assert "".join(helpers.iter_lines(chunks, encoding)) == text
@@ -0,0 +1,97 @@
+import gzip
+import io
+import sys
+import zipfile
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import http_cache
+
+BOOK = b"Title: A Book\r\n\r\n" + b"A paragraph of the book.\r\n" * 500
+
+
+class Unseekable(io.BytesIO):
+    """
+    A stream on which zipfile writes the sizes after the file's data
+    """
+
+    def tell(self):
+        raise OSError
+
+    def seekable(self):
+        return False
+
+
+def split(content, size):
+    return [content[i : i + size] for i in range(0, len(content), size)]
+
+
+def make_zip(method, names=("1.txt",), stream=io.BytesIO):
+    buffer = stream()
+    with zipfile.ZipFile(buffer, "w", method) as archive:
+        for name in names:
+            if name.endswith("/"):
+                archive.writestr(name, b"")
+            else:
+                archive.writestr(name, BOOK)
+
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+@pytest.mark.parametrize("method", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_unzip_streams_the_first_file(method, size):
+    assert b"".join(http_cache.unzip(split(make_zip(method), size))) == BOOK
+
+
+@pytest.mark.parametrize("method", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_unzip_reads_the_sizes_after_the_data(method):
+    content = make_zip(method, stream=Unseekable)
+
+    assert b"".join(http_cache.unzip(split(content, 5))) == BOOK
+
+
+def test_unzip_skips_a_directory_first():
+    content = make_zip(zipfile.ZIP_DEFLATED, ("books/", "books/1.txt"))
+
+    assert b"".join(http_cache.unzip(split(content, 3))) == BOOK
+
+
+@pytest.mark.parametrize("method", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_unzip_raises_on_a_truncated_archive(method):
+    content = make_zip(method)
+    # the end of the file's data, before the central directory
+    content = content[: content.index(b"PK\x01\x02") - 8]
+
+    with pytest.raises(zipfile.BadZipFile):
+        b"".join(http_cache.unzip(split(content, 64)))
+
+
+def test_unzip_raises_on_not_a_zip():
+    with pytest.raises(zipfile.BadZipFile):
+        list(http_cache.unzip([BOOK]))
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_decompress_gzip_and_deflate(size):
+    gzipped = split(gzip.compress(BOOK), size)
+    deflated = split(zlib.compress(BOOK), size)
+
+    assert b"".join(http_cache.decompress(gzipped, "gzip")) == BOOK
+    assert b"".join(http_cache.decompress(deflated, " Deflate ")) == BOOK
+
+
+def test_decompress_passes_the_identity_through():
+    chunks = split(BOOK, 100)
+
+    assert list(http_cache.decompress(chunks)) == chunks
+    assert list(http_cache.decompress(chunks, "identity")) == chunks
+
+
+def test_decompress_raises_on_an_unknown_encoding():
+    with pytest.raises(ValueError):
+        list(http_cache.decompress([BOOK], "br"))
@@ -0,0 +1,56 @@
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mirror
+
+
+def make_mirror(directory, numbers):
+    for number in numbers:
+        Path(directory, f"{number}.txt").write_bytes(f"Book {number}\n".encode())
+
+    return directory
+
+
+def read_numbers(*args, **kwargs):
+    return [book[3] for book in mirror.read_books(*args, **kwargs)]
+
+
+def test_limit_counts_the_books_read_not_the_skipped_ones(tmp_path):
+    path = make_mirror(tmp_path, range(1, 7))
+
+    assert read_numbers(path, 3, skip={1, 2, 3}) == [4, 5, 6]
+
+
+def test_only_books_after_the_limit_are_read(tmp_path):
+    path = make_mirror(tmp_path, range(1, 7))
+
+    assert read_numbers(path, 3, only={5, 6}) == [5, 6]
+    assert read_numbers(path, 1, only={5, 6}) == [5]
+
+
+def test_skip_and_only_together(tmp_path):
+    path = make_mirror(tmp_path, range(1, 7))
+
+    assert read_numbers(path, 2, skip={5}, only={4, 5, 6}) == [4, 6]
+
+
+def test_zip_in_tar_is_named_by_its_member(tmp_path):
+    book = tmp_path / "7.zip"
+    with zipfile.ZipFile(book, "w") as archive:
+        archive.writestr("7.txt", "Book 7\n")
+    with tarfile.open(tmp_path / "mirror.tar", "w") as archive:
+        archive.add(book, "books/7.zip")
+
+    books = list(mirror.read_books(tmp_path / "mirror.tar"))
+
+    assert [book[0] for book in books] == [f"{tmp_path}/mirror.tar/books/7.zip/7.txt"]
+    assert books[0][1] == b"Book 7\n"
+
+
+def test_missing_mirror_has_no_books(tmp_path, capsys):
+    assert read_numbers(tmp_path / "missing") == []
+    assert "There is no mirror" in capsys.readouterr().out
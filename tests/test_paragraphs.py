@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers
+
+BOOK = (
+    "Title: Moby Dick\n"
+    "Author: Herman Melville\n"
+    "\n"
+    "*** START OF THE PROJECT GUTENBERG EBOOK MOBY DICK ***\n"
+    "\n"
+    "Call me\n"
+    "  Ishmael.  \n"
+    "\n"
+    "\n"
+    "Some years ago.\n"
+    "\n"
+    "*** END OF THE PROJECT GUTENBERG EBOOK MOBY DICK ***\n"
+    "\n"
+    "The license.\n"
+)
+
+
+def split(lines, markers=True):
+    counts = {"chars": 0, "lines": 0, "paragraphs": 0}
+
+    return list(helpers.get_paragraphs(lines, counts, markers)), counts
+
+
+def test_only_the_text_between_the_markers_is_split():
+    paragraphs, counts = split(BOOK)
+
+    assert paragraphs == [" Call me Ishmael.", " Some years ago."]
+    # the lines between the markers, the chars of the stripped lines
+    assert counts == {"chars": 30, "lines": 7, "paragraphs": 2}
+
+
+def test_the_lines_are_read_the_same_as_the_text():
+    assert split(BOOK.splitlines(keepends=True)) == split(BOOK)
+
+
+def test_the_text_without_markers_is_read_from_the_beginning():
+    text = "First line\nof the first.\n\nSecond.\n"
+
+    paragraphs, counts = split(text)
+
+    assert paragraphs == [" First line of the first.", " Second."]
+    assert counts["lines"] == 4
+
+
+def test_the_text_without_an_end_is_read_to_the_end():
+    paragraphs, _ = split(BOOK.split("*** END")[0] + "The last.\n")
+
+    assert paragraphs == [" Call me Ishmael.", " Some years ago.", " The last."]
+
+
+def test_the_markers_are_paragraphs_without_markers():
+    paragraphs, _ = split(BOOK, markers=False)
+
+    assert paragraphs[0] == " Title: Moby Dick Author: Herman Melville"
+    assert paragraphs[-1] == " The license."
+
+
+def test_the_counts_are_added_to():
+    counts = {"chars": 1, "lines": 1, "paragraphs": 1}
+
+    list(helpers.get_paragraphs("One.\n", counts))
+
+    assert counts == {"chars": 5, "lines": 2, "paragraphs": 2}
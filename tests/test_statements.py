@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import schemata
+import statements
+
+ATTRIBUTES = ["title", "year"]
+
+
+@pytest.mark.parametrize(
+    "kind, text",
+    [
+        (
+            "insert",
+            'INSERT INTO "book" ("title", "year") VALUES (%s, %s) '
+            "ON CONFLICT DO NOTHING RETURNING id",
+        ),
+        ("insert_many", 'INSERT INTO "book" ("title", "year") VALUES (%s, %s)'),
+        (
+            "exists",
+            'SELECT EXISTS (SELECT 1 FROM "book" WHERE "title" = %s AND "year" = %s)',
+        ),
+        ("lookup", 'SELECT id FROM "book" WHERE "title" = %s AND "year" = %s'),
+        (
+            "upsert",
+            'INSERT INTO "book" ("title", "year") VALUES (%s, %s) '
+            'ON CONFLICT ("title", "year") DO UPDATE SET '
+            '"title" = EXCLUDED."title", "year" = EXCLUDED."year" RETURNING id',
+        ),
+        ("copy", 'COPY "book" ("title", "year") FROM STDIN'),
+        ("update", 'UPDATE "book" SET "title" = %s, "year" = %s WHERE id = %s'),
+        ("delete", 'DELETE FROM "book" WHERE "title" = %s AND "year" = %s'),
+    ],
+)
+def test_compose(kind, text):
+    assert statements.compose(kind, "book", ATTRIBUTES) == text
+
+
+def test_the_identifiers_are_quoted():
+    text = statements.compose("lookup", 'bo"ok', ['ti"tle'])
+
+    assert text == 'SELECT id FROM "bo""ok" WHERE "ti""tle" = %s'
+
+
+def test_data_attributes_skip_the_serial_ones_and_the_constraints():
+    attributes = [
+        ("id", "SERIAL PRIMARY KEY"),
+        ("title", "TEXT"),
+        ("year", "INTEGER"),
+        ("UNIQUE", "(title, year)"),
+    ]
+
+    assert statements.data_attributes(attributes) == ATTRIBUTES
+
+
+def test_unique_keys():
+    keys = statements.unique_keys(schemata.relations["book"])
+
+    assert keys == [("ebook_id",), ("title", "year", "language_id")]
+
+
+def test_get_caches_the_statement(monkeypatch):
+    monkeypatch.setattr(statements, "cache", dict())
+
+    text = statements.get("copy", "book", ATTRIBUTES)
+
+    assert statements.get("copy", "book", tuple(ATTRIBUTES)) is text
+    assert statements.cache == {("copy", "book", tuple(ATTRIBUTES)): text}
+
+
+def test_prepare_composes_without_a_database(monkeypatch):
+    monkeypatch.setattr(statements, "cache", dict())
+
+    count = statements.prepare(schemata.relations)
+
+    assert count == len(statements.cache) > 0
+    assert (
+        "copy",
+        "book",
+        tuple(statements.data_attributes(schemata.relations["book"])),
+    ) in statements.cache
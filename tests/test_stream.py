@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import pytest
+import requests
+
+import http_cache
+import main
+import schemata
+import server
+
+
+@pytest.fixture
+def corrupt_zip(tmp_path, monkeypatch):
+    book = Path(tmp_path, "cache", "epub", "1")
+    book.mkdir(parents=True)
+    Path(book, "pg1.txt").write_bytes(b"Title: A Book\r\n\r\nA paragraph.\r\n")
+    # a local file header of a deflated file followed by garbage
+    header = http_cache.ZIP_HEADER.pack(b"PK\x03\x04", 20, 0, 8, 0, 0, 0, 0, 0, 5, 0)
+    Path(book, "pg1.zip").write_bytes(header + b"a.txt" + b"\xff" * 64)
+
+    monkeypatch.setattr(http_cache, "zipped", True)
+    monkeypatch.setattr(http_cache, "directory", None)
+    httpd, url = server.start_server(tmp_path)
+    yield url.format(1)
+    httpd.shutdown()
+
+
+def test_stream_book_handles_a_corrupt_archive(corrupt_zip):
+    relations = schemata.get_relations()
+
+    assert main.stream_book(corrupt_zip, relations, None, None, key=1) == 1
+
+
+def test_fetch_raises_a_request_error_for_a_corrupt_archive(corrupt_zip):
+    chunks, charset = http_cache.fetch(corrupt_zip)
+
+    with pytest.raises(requests.RequestException):
+        b"".join(chunks)